@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# Background indexing: the server starts on the index already on disk and this thread keeps it
+# up to date. The watched folder is polled (names, sizes and mtimes only; no file is read) and a
+# run starts once a change has been stable for one poll interval, so theses still being copied
+# in are not picked up half-written. reindex() starts a run right away. Runs never overlap; a
+# request during a run queues one more run after it.
+INDEX_POLL_SECONDS = float(os.environ.get("RAG_INDEX_POLL_SECONDS", "60"))  # 0: no watching, runs on request only
+WATCH_SUFFIXES = (".pdf", ".txt")
+STATUS_WRITE_INTERVAL = 1.0  # seconds between status file writes while a run reports progress
+
+log = logging.getLogger(__name__)
+
+
+def folder_signature(folder, suffixes=WATCH_SUFFIXES):
+    """{file name: (size, mtime_ns)} of the watched files in folder."""
+    signature = {}
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(suffixes) and entry.is_file():
+                    st = entry.stat()
+                    signature[entry.name] = (st.st_size, st.st_mtime_ns)
+    except FileNotFoundError:
+        pass
+    return signature
+
+
+def changed_files(old, new):
+    """Names added, modified or removed between two folder signatures."""
+    return sorted({name for name, sig in new.items() if old.get(name) != sig} | (old.keys() - new.keys()))
+
+
+def read_status(path):
+    """Status written by a BackgroundIndexer in another process, or None."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class BackgroundIndexer:
+    """
+    run_index(progress) indexes what changed in the folder and returns a stats dict; it calls
+    progress(phase, done, total) as it goes. on_published(stats) runs after every run whose
+    stats say the index changed (stats["changed"]). With status_path the status is also kept in
+    that JSON file, for processes that do not run the indexer (pre-fork workers).
+    """
+
+    def __init__(self, folder, run_index, on_published=None, poll_interval=INDEX_POLL_SECONDS, status_path=None):
+        self.folder = folder
+        self.run_index = run_index
+        self.on_published = on_published
+        self.poll_interval = poll_interval
+        self.status_path = status_path
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._requested = True  # the first run starts as soon as the thread does
+        self._indexed = {}      # folder signature the last run started from
+        self._seen = None       # folder signature at the previous poll
+        self._status_written = 0.0
+        self._status = {
+            "state": "idle",
+            "phase": None,
+            "done": 0,
+            "total": 0,
+            "queued_files": 0,
+            "reindex_requested": True,
+            "runs": 0,
+            "failures": 0,
+            "started_at": None,
+            "last_finished_at": None,
+            "last_run": None,
+            "last_error": None,
+            "watching": poll_interval > 0,
+        }
+
+    # --- control (any thread) ---
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="rag-indexer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        # Returns once the current run is over; a run is not interrupted halfway
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def reindex(self):
+        """Start a run now, or right after the one in progress."""
+        with self._lock:
+            self._requested = True
+            self._status["reindex_requested"] = True
+        self._wake.set()
+        return self.status()
+
+    def status(self):
+        with self._lock:
+            return dict(self._status)
+
+    # --- indexer thread ---
+    def _loop(self):
+        while not self._stopping.is_set():
+            signature = folder_signature(self.folder)
+            stable = signature == self._seen
+            self._seen = signature
+            with self._lock:
+                requested = self._requested
+                self._requested = False
+                self._status["queued_files"] = len(changed_files(self._indexed, signature))
+                queued = self._status["queued_files"] and self.poll_interval > 0
+            if requested or (queued and stable):
+                self._index(signature)
+                continue  # rescan at once: files may have arrived during the run
+            self._write_status()
+            self._wake.wait(self.poll_interval if self.poll_interval > 0 else None)
+            self._wake.clear()
+
+    def _index(self, signature):
+        with self._lock:
+            self._status.update(state="indexing", phase=None, done=0, total=0, reindex_requested=False,
+                                started_at=time.time())
+        self._write_status()
+        stats = None
+        try:
+            stats = self.run_index(self._progress)
+        except Exception as e:
+            log.exception("Background indexing run failed")
+            with self._lock:
+                self._status["failures"] += 1
+                self._status["last_error"] = f"{type(e).__name__}: {e}"
+        # Not retried until the folder changes again or a reindex is requested
+        self._indexed = signature
+        with self._lock:
+            self._status.update(state="idle", phase=None, last_finished_at=time.time())
+            self._status["runs"] += 1
+            if stats is not None:
+                self._status["last_run"] = stats
+                self._status["last_error"] = None
+        self._write_status()
+        if stats is not None and stats.get("changed") and self.on_published is not None:
+            try:
+                self.on_published(stats)
+            except Exception:
+                log.exception("Publishing the new index failed")
+
+    def _progress(self, phase, done, total):
+        with self._lock:
+            self._status.update(phase=phase, done=done, total=total)
+        if time.monotonic() - self._status_written >= STATUS_WRITE_INTERVAL or done == total:
+            self._write_status()
+
+    def _write_status(self):
+        self._status_written = time.monotonic()
+        if self.status_path is None:
+            return
+        status = self.status()
+        tmp = self.status_path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.status_path) or ".", exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(status, f)
+            os.replace(tmp, self.status_path)
+        except OSError as e:
+            log.warning("Could not write index status to %s: %s", self.status_path, e)
@@ -0,0 +1,105 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import chunk_sentences, word_counter, DEFAULT_MAX_TOKENS, CHUNK_OVERLAP_TOKENS  # noqa: E402
+
+# Benchmark: original 500-word sentence_chunking vs chunking.chunk_sentences on a synthetic
+# thesis (~300 words per page). With --tokenizer the new chunker counts MiniLM word-pieces and
+# the report shows how many chunks of each chunker exceed the 256-token embedding limit.
+#   python benchmarks/bench_chunking.py --pages 300
+#   python benchmarks/bench_chunking.py --pages 300 --tokenizer
+WORDS = ("the of and in to a is that for on with as by analysis results growth yield respondents "
+         "significant municipality agricultural production households income statistical regression "
+         "Oreochromis niloticus photosynthetic socio-economic characteristics questionnaire").split()
+
+
+def legacy_sentence_chunking(text, chunk_size=500):
+    sentences = text.split('. ')
+    sentences = [s.strip() + ('' if s.strip().endswith('.') else '.') for s in sentences if s.strip()]
+    chunks = []
+    window = []
+    window_len = 0
+    overlap = int(chunk_size * 0.2)
+    i = 0
+    while i < len(sentences):
+        window = []
+        window_len = 0
+        j = i
+        while j < len(sentences) and window_len < chunk_size:
+            sent = sentences[j]
+            sent_len = len(sent.split())
+            if window_len + sent_len > chunk_size and window:
+                break
+            window.append(sent)
+            window_len += sent_len
+            j += 1
+        if window:
+            chunks.append(' '.join(window))
+        if window_len == 0:
+            i += 1
+        else:
+            step = max(1, window_len - overlap)
+            words_seen = 0
+            for k in range(i, len(sentences)):
+                words_seen += len(sentences[k].split())
+                if words_seen >= step:
+                    i = k + 1
+                    break
+            else:
+                break
+    return chunks
+
+
+def synthetic_thesis(pages, seed=0):
+    rng = random.Random(seed)
+    parts = []
+    for page in range(pages):
+        words = 0
+        while words < 300:
+            n = rng.randint(5, 40)
+            parts.append(" ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + ".")
+            words += n
+        parts.append(f"\n{page + 1}\n")
+    return " ".join(parts)
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sentence chunking")
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tokenizer", action="store_true", help="count MiniLM word-pieces (needs transformers)")
+    args = parser.parse_args()
+    text = synthetic_thesis(args.pages)
+    print(f"thesis: {args.pages} pages, {len(text.split())} words, {len(text)} chars")
+    seconds, legacy = timed(lambda: legacy_sentence_chunking(text), args.repeat)
+    print(f"legacy (500 words):        {seconds * 1000:8.1f} ms, {len(legacy)} chunks")
+    seconds, new = timed(lambda: chunk_sentences(text, word_counter, DEFAULT_MAX_TOKENS, CHUNK_OVERLAP_TOKENS), args.repeat)
+    print(f"new (word counts):         {seconds * 1000:8.1f} ms, {len(new)} chunks")
+    seconds, same_budget = timed(lambda: chunk_sentences(text, word_counter, 500, 100), args.repeat)
+    print(f"new (500 words, 100 over): {seconds * 1000:8.1f} ms, {len(same_budget)} chunks")
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/all-MiniLM-L6-v2")
+
+        def count_tokens(texts):
+            return [len(ids) for ids in tokenizer(list(texts), add_special_tokens=False, verbose=False)["input_ids"]]
+
+        seconds, new = timed(lambda: chunk_sentences(text, count_tokens, DEFAULT_MAX_TOKENS, CHUNK_OVERLAP_TOKENS), args.repeat)
+        print(f"new (MiniLM tokens):       {seconds * 1000:8.1f} ms, {len(new)} chunks")
+        for name, chunks in (("legacy", legacy), ("new", [c for c, _, _ in new])):
+            over = sum(n > DEFAULT_MAX_TOKENS for n in count_tokens(chunks))
+            print(f"{name:6s} chunks truncated at embedding: {over}/{len(chunks)}")
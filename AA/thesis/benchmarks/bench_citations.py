@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from citations import SourceContext, renumber_answer  # noqa: E402
+
+# Micro-benchmark: prompt_chain post-processing before and after citations.py.
+# legacy_chain() is the pre-rewrite prompt_chain loop body (Gemini call replaced by recorded
+# answers); new_chain() is the current loop. Both return (final answer, last prompt context),
+# so the timed work includes building every prompt. They are run over the same recorded answers
+# and checked to give the same final answer for single-prompt chains (the only kind /search uses).
+#   python benchmarks/bench_citations.py                      # synthetic answers
+#   python benchmarks/bench_citations.py --answers rec.json   # [{"top_chunks": [...], "answers": ["..."]}]
+INSTRUCTIONS = "Synthesize the findings. "
+
+
+def legacy_chain(top_chunks, answers):
+    context = ""
+    answer = ""
+    for idx, raw in enumerate(answers):
+        if idx == 0:
+            doc_infos = []
+            seen_pdfs = []
+            pdf_to_number = {}
+            for i, c in enumerate(top_chunks):
+                meta = c['meta']
+                pdf_id = meta.get('pdf', meta.get('file', '[Unknown]'))
+                if pdf_id not in seen_pdfs:
+                    seen_pdfs.append(pdf_id)
+                    pdf_to_number[pdf_id] = len(seen_pdfs)
+                    doc_infos.append(f"[{len(seen_pdfs)}] Title: {meta.get('title','') or '[Unknown]'}\n    Author: {meta.get('author','') or '[Unknown]'}\n    Year: {meta.get('publication_year','') or '[Unknown]'}\n    File: {pdf_id}")
+                if len(doc_infos) >= 10:
+                    break
+            doc_info_str = "Top 10 relevant documents found (numbered for reference):\n" + "\n".join(doc_infos) + "\n\n"
+            chunk_context = "\n\n".join([
+                f"[{pdf_to_number[c['meta'].get('pdf', c['meta'].get('file', '[Unknown]'))]}] From {c['meta'].get('pdf', c['meta'].get('file', '[Unknown]'))} (chunk {c['meta']['chunk_idx']}): {c['chunk']}"
+                for c in top_chunks if c['meta'].get('pdf', c['meta'].get('file', '[Unknown]')) in pdf_to_number
+            ])
+            context = f"{doc_info_str}Context: {chunk_context}\n\nWhen answering, please reference the relevant thesis by its number in square brackets, e.g., [1], [2], etc., to indicate the source of each point.\n\n"
+            context += INSTRUCTIONS
+        raw_answer = raw.strip()
+        ref_pattern = re.compile(r'\[(\d+)\]')
+        paragraphs = re.split(r'\n\s*\n', raw_answer)
+        ref_order = []
+        for para in paragraphs:
+            for ref in ref_pattern.findall(para):
+                if ref not in ref_order:
+                    ref_order.append(ref)
+        allowed_numbers = [str(n) for n in range(1, len(seen_pdfs)+1)]
+        ref_order = [r for r in ref_order if r in allowed_numbers]
+        for n in allowed_numbers:
+            if n not in ref_order:
+                ref_order.append(n)
+        old_to_new = {old: str(i+1) for i, old in enumerate(ref_order)}
+        seen_pdfs_new = [seen_pdfs[int(old)-1] for old in ref_order]
+        doc_infos_new = []
+        for i, pdf_id in enumerate(seen_pdfs_new):
+            meta = None
+            for c in top_chunks:
+                meta_c = c['meta']
+                pdf_id_c = meta_c.get('pdf', meta_c.get('file', '[Unknown]'))
+                if pdf_id_c == pdf_id:
+                    meta = meta_c
+                    break
+            doc_infos_new.append(f"[{i+1}] Title: {meta.get('title','') or '[Unknown]'}\n    Author: {meta.get('author','') or '[Unknown]'}\n    Year: {meta.get('publication_year','') or '[Unknown]'}\n    File: {pdf_id}")
+        doc_info_str_new = "Top 10 relevant documents found (numbered for reference):\n" + "\n".join(doc_infos_new) + "\n\n"
+        pdf_to_number_new = {pdf_id: i+1 for i, pdf_id in enumerate(seen_pdfs_new)}
+        chunk_context_new = "\n\n".join([
+            f"[{pdf_to_number_new[c['meta'].get('pdf', c['meta'].get('file', '[Unknown]'))]}] From {c['meta'].get('pdf', c['meta'].get('file', '[Unknown]'))} (chunk {c['meta']['chunk_idx']}): {c['chunk']}"
+            for c in top_chunks if c['meta'].get('pdf', c['meta'].get('file', '[Unknown]')) in pdf_to_number_new
+        ])
+
+        def replace_refs(text):
+            return ref_pattern.sub(lambda m: f"[{old_to_new.get(m.group(1), m.group(1))}]", text)
+        raw_answer_new = replace_refs(raw_answer)
+
+        def process_paragraphs(text):
+            allowed_numbers_new = set(str(n) for n in range(1, len(seen_pdfs_new)+1))
+            paragraphs = re.split(r'\n\s*\n', text)
+            ref_pattern2 = re.compile(r'\[(\d+)\]')
+            processed = []
+            assigned_refs = []
+            if paragraphs and ref_pattern2.findall(paragraphs[-1]) and not re.search(r'[a-zA-Z]', paragraphs[-1]):
+                paragraphs = paragraphs[:-1]
+            n_body = max(1, len(paragraphs)-1)
+            for i, para in enumerate(paragraphs):
+                refs = [r for r in ref_pattern2.findall(para) if r in allowed_numbers_new]
+                unique_refs = []
+                for r in refs:
+                    if r not in unique_refs:
+                        unique_refs.append(r)
+                    if len(unique_refs) == 2:
+                        break
+                para_clean = ref_pattern2.sub('', para).strip()
+                para_clean = re.sub(r'\s+\.$', '.', para_clean)
+                if i < n_body and unique_refs:
+                    for r in unique_refs:
+                        para_clean += f'[{r}]'
+                        assigned_refs.append(r)
+                processed.append(para_clean)
+            if processed:
+                summary_refs = []
+                for r in assigned_refs:
+                    if r not in summary_refs:
+                        summary_refs.append(r)
+                processed[-1] = re.sub(r'\s+\.$', '.', processed[-1])
+                end_refs = re.findall(r'(\[\d+\])', processed[-1].split('.')[-1])
+                end_refs_set = set([ref.strip('[]') for ref in end_refs])
+                for r in summary_refs:
+                    if r not in end_refs_set:
+                        processed[-1] += f'[{r}]'
+            return '\n\n'.join(processed)
+        answer = process_paragraphs(raw_answer_new)
+        context = f"{doc_info_str_new}Context: {chunk_context_new}\n\nWhen answering, please reference the relevant thesis by its number in square brackets, e.g., [1], [2], etc., to indicate the source of each point.\n\n{answer}\n\n"
+    return answer, context
+
+
+def new_chain(top_chunks, answers):
+    sources = SourceContext(top_chunks)
+    context = sources.render() + INSTRUCTIONS
+    answer = ""
+    for idx, raw in enumerate(answers):
+        answer, ref_order = renumber_answer(raw.strip(), len(sources))
+        if idx + 1 < len(answers):
+            sources.reorder(ref_order)
+            context = f"{sources.render()}{answer}\n\n"
+    return answer, context
+
+
+def synthetic_case(rng, n_chunks=50, n_sources=10, n_paragraphs=6, chain_length=1):
+    words = "growth yield soil water feed temperature rice tilapia farm income policy survey".split()
+    top_chunks = []
+    for i in range(n_chunks):
+        pdf = f"thesis_{rng.randrange(n_sources)}.pdf"
+        top_chunks.append({
+            "chunk": " ".join(rng.choice(words) for _ in range(120)),
+            "meta": {"pdf": pdf, "file": pdf, "title": f"Title of {pdf}", "author": "Author",
+                     "publication_year": "2019", "chunk_idx": i},
+        })
+    answers = []
+    for _ in range(chain_length):
+        paragraphs = []
+        for _ in range(n_paragraphs):
+            sentence = " ".join(rng.choice(words) for _ in range(60)) + " ."
+            refs = "".join(f"[{rng.randint(1, n_sources)}]" for _ in range(rng.randint(1, 3)))
+            paragraphs.append(sentence + " " + refs)
+        paragraphs.append("".join(f"[{n}]" for n in range(1, 6)))
+        answers.append("\n\n".join(paragraphs))
+    return {"top_chunks": top_chunks, "answers": answers}
+
+
+def timeit(fn, cases, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for case in cases:
+            fn(case["top_chunks"], case["answers"])
+    return (time.perf_counter() - start) / (repeat * len(cases))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark prompt_chain reference renumbering")
+    parser.add_argument("--answers", help="JSON file with recorded cases: [{top_chunks, answers}]")
+    parser.add_argument("--cases", type=int, default=200)
+    parser.add_argument("--chain-length", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    if args.answers:
+        with open(args.answers, "r", encoding="utf-8") as f:
+            cases = json.load(f)
+    else:
+        rng = random.Random(0)
+        cases = [synthetic_case(rng, chain_length=args.chain_length) for _ in range(args.cases)]
+    single = [dict(c, answers=c["answers"][:1]) for c in cases]
+    mismatches = sum(legacy_chain(c["top_chunks"], c["answers"])[0] != new_chain(c["top_chunks"], c["answers"])[0]
+                     for c in single)
+    legacy = timeit(legacy_chain, cases, args.repeat)
+    new = timeit(new_chain, cases, args.repeat)
+    print(f"cases: {len(cases)}, chain length: {max(len(c['answers']) for c in cases)}")
+    print(f"single-prompt output mismatches: {mismatches}")
+    print(f"legacy: {legacy * 1e6:8.1f} us/chain")
+    print(f"new:    {new * 1e6:8.1f} us/chain  ({legacy / new:.1f}x)")
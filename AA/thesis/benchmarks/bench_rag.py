@@ -0,0 +1,264 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+THESIS_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, THESIS_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests  # noqa: E402
+
+from mock_gemini import MockGeminiHandler, start_mock_gemini  # noqa: E402
+from synthetic_corpus import generate_corpus  # noqa: E402
+
+# End-to-end offline benchmark of the RAG server: synthetic corpus -> indexing -> /search under
+# concurrent load against a mocked Gemini, plus recall@k on the corpus' labeled queries.
+# Runs in a scratch directory (multi_thesis_rag keeps ChromaDB, caches and theses under ./RAG),
+# and writes one JSON result file that --baseline can compare against later.
+#   python benchmarks/bench_rag.py --theses 1000 --requests 500 --concurrency 8
+#   python benchmarks/bench_rag.py --theses 1000 --baseline benchmarks/results/<earlier run>.json
+#   python benchmarks/bench_rag.py --theses 1000 --vector-backend local   (same run on the in-process ANN index)
+# Needs the server's own dependencies (chromadb, sentence-transformers); no network access.
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+RECALL_KS = (1, 5, 10)
+# Metrics compared by --baseline, and whether a larger value is better
+COMPARED = {
+    "ingest.chunks_per_sec": True,
+    "ingest.docs_per_sec": True,
+    "search.p50_ms": False,
+    "search.p95_ms": False,
+    "search.p99_ms": False,
+    "search.requests_per_sec": True,
+    "recall.recall@1": True,
+    "recall.recall@5": True,
+    "recall.recall@10": True,
+    "memory.peak_rss_mb": False,
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=THESIS_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_load(url, questions, n_requests, concurrency, stream=False):
+    """POST n_requests /search calls (cycling through questions) from concurrency threads."""
+    local = threading.local()
+
+    def one(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session.post(url, json={"question": questions[i % len(questions)], "stream": stream}, timeout=120)
+            response.content  # read the whole body; SSE responses end after the "done" event
+            status = response.status_code
+        except requests.RequestException:
+            status = 0
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(n_requests)))
+    wall = time.perf_counter() - start
+    latencies = sorted(seconds * 1000 for seconds, status in results if status == 200)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "stream": stream,
+        "statuses": statuses,
+        "seconds": round(wall, 3),
+        "requests_per_sec": round(n_requests / wall, 1) if wall > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50), 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99), 2) if latencies else None,
+        "max_ms": round(latencies[-1], 2) if latencies else None,
+    }
+
+
+def measure_recall(rag, labeled, ks=RECALL_KS):
+    # Rank of the labeled thesis among the documents /search would return
+    hits = {k: 0 for k in ks}
+    for item in labeled:
+        documents, _, _ = rag.retrieve_for_question(item["question"])
+        files = [d["file"] for d in documents]
+        for k in ks:
+            if item["file"] in files[:k]:
+                hits[k] += 1
+    recall = {f"recall@{k}": round(hits[k] / len(labeled), 4) if labeled else None for k in ks}
+    recall["queries"] = len(labeled)
+    return recall
+
+
+def stage_means(metrics_text):
+    # Mean seconds per request stage from the server's rag_stage_seconds histogram
+    sums, counts = {}, {}
+    for line in metrics_text.splitlines():
+        for suffix, target in (("_sum", sums), ("_count", counts)):
+            prefix = f"rag_stage_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                name, value = line[len(prefix):].split("\"}", 1)
+                target[name] = float(value)
+    return {name: round(sums[name] / counts[name] * 1000, 3) for name in sorted(sums) if counts.get(name)}
+
+
+def compare(result, baseline, tolerance=5.0):
+    """[(metric, baseline, current, change %, regressed)]; regressed = worse by more than tolerance %."""
+    rows = []
+    for key, higher_is_better in COMPARED.items():
+        section, name = key.split(".")
+        old = baseline.get(section, {}).get(name)
+        new = result.get(section, {}).get(name)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        rows.append((key, old, new, round(change, 1), -change > tolerance if higher_is_better else change > tolerance))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark: indexing, /search latency and recall")
+    parser.add_argument("--theses", type=int, default=1000, help="corpus size (1k-100k)")
+    parser.add_argument("--pages", type=int, default=2, help="~300-word pages per thesis")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200, help="labeled queries for recall@k")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=8, help="server worker threads")
+    parser.add_argument("--stream", action="store_true", help="load-test the SSE variant of /search")
+    parser.add_argument("--gemini-latency", type=float, default=0.2, help="mock Gemini seconds per call")
+    parser.add_argument("--vector-backend", choices=("chroma", "local"), default="chroma",
+                        help="vector store the server runs on (RAG_VECTOR_BACKEND)")
+    parser.add_argument("--vector-quantization", choices=("none", "float16", "int8"), default="none",
+                        help="quantized scan of the local store (RAG_VECTOR_QUANTIZATION)")
+    parser.add_argument("--no-cache", action="store_true", help="disable the query/retrieval/overview caches")
+    parser.add_argument("--workdir", help="scratch directory (default: a new temporary directory)")
+    parser.add_argument("--output", help="result JSON path (default: benchmarks/results/bench_rag-<time>.json)")
+    parser.add_argument("--baseline", help="earlier result JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=5.0, help="%% change reported as a regression")
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="bench_rag_"))
+    output = os.path.abspath(args.output or os.path.join(
+        RESULTS_DIR, f"bench_rag-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    # Mock Gemini; the client's rate limit is lifted so the benchmark measures the server, not the quota
+    MockGeminiHandler.hang = args.gemini_latency
+    MockGeminiHandler.delay = 0.0
+    mock = start_mock_gemini()
+    os.environ["GEMINI_API_BASE"] = f"http://127.0.0.1:{mock.server_address[1]}/v1beta"
+    os.environ["GEMINI_API_KEY"] = "benchmark"
+    os.environ["GEMINI_RATE_PER_MINUTE"] = "1000000"
+    os.environ["GEMINI_RATE_BURST"] = "1000000"
+    os.environ["RAG_VECTOR_BACKEND"] = args.vector_backend
+    os.environ["RAG_VECTOR_QUANTIZATION"] = args.vector_quantization
+    if args.no_cache:
+        for name in ("RAG_QUERY_EMBEDDING_CACHE_SIZE", "RAG_RETRIEVAL_CACHE_SIZE", "RAG_OVERVIEW_CACHE_SIZE"):
+            os.environ[name] = "0"
+
+    result = {
+        "benchmark": "bench_rag",
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "memory": {},
+    }
+
+    print(f"Generating {args.theses} theses in {workdir} ...")
+    start = time.perf_counter()
+    thesis_dir = os.path.join("RAG", "theses")
+    labeled = generate_corpus(thesis_dir, args.theses, args.pages, args.seed, max_queries=args.queries)
+    result["corpus"] = {"theses": args.theses, "pages": args.pages, "seconds": round(time.perf_counter() - start, 3)}
+    result["memory"]["after_corpus_mb"] = peak_rss_mb()
+
+    start = time.perf_counter()
+    import multi_thesis_rag as rag
+    rag.get_embedder()
+    result["startup"] = {"import_and_model_seconds": round(time.perf_counter() - start, 3)}
+
+    print("Indexing ...")
+    start = time.perf_counter()
+    stats = rag.extract_and_chunk_pdfs(thesis_dir)
+    rag.sync_sparse_index()
+    seconds = time.perf_counter() - start
+    result["ingest"] = {
+        "documents": stats["documents"],
+        "chunks": stats["chunks"],
+        "seconds": round(seconds, 3),
+        "docs_per_sec": round(stats["documents"] / seconds, 1) if seconds > 0 else 0.0,
+        "chunks_per_sec": round(stats["chunks"] / seconds, 1) if seconds > 0 else 0.0,
+        "pipeline_chunks_per_sec": stats["chunks_per_sec"],
+    }
+    result["memory"]["after_ingest_mb"] = peak_rss_mb()
+
+    httpd = rag.BoundedThreadPoolServer(("127.0.0.1", 0), rag.MultiThesisRAGHTTPRequestHandler,
+                                        workers=args.workers, queue_size=max(32, args.concurrency * 2))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    questions = [item["question"] for item in labeled]
+    print(f"Load test: {args.requests} requests, concurrency {args.concurrency} ...")
+    run_load(base_url + "/search", questions, min(args.requests, 2 * args.concurrency), args.concurrency, args.stream)  # warm-up
+    result["search"] = run_load(base_url + "/search", questions, args.requests, args.concurrency, args.stream)
+    result["search"]["stage_mean_ms"] = stage_means(requests.get(base_url + "/metrics", timeout=30).text)
+    result["memory"]["after_search_mb"] = peak_rss_mb()
+
+    print(f"Recall on {len(labeled)} labeled queries ...")
+    result["recall"] = measure_recall(rag, labeled)
+    result["memory"]["peak_rss_mb"] = peak_rss_mb()
+    result["health"] = requests.get(base_url + "/health", timeout=30).json()
+    httpd.shutdown()
+    httpd.server_close()
+    mock.shutdown()
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    print(json.dumps({k: result[k] for k in ("ingest", "search", "recall", "memory")}, indent=2))
+    print(f"Results written to {output}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.baseline} ({baseline.get('commit') or 'unknown commit'}):")
+        differing = sorted(k for k, v in result["config"].items() if k != "workdir" and baseline.get("config", {}).get(k) != v)
+        if differing:
+            print(f"  note: runs differ in {', '.join(differing)}; numbers are not directly comparable")
+        for key, old, new, change, regressed in compare(result, baseline, args.tolerance):
+            print(f"  {key:26s} {old:>12} -> {new:>12}  {change:+7.1f}%{'  REGRESSION' if regressed else ''}")
+
+
+if __name__ == "__main__":
+    main()
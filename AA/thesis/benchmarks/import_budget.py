@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+THESIS_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Import-time budget check: cold-imports a module in fresh interpreters and fails (exit code 1)
+# when the median import takes longer than the budget, when a heavy dependency got imported,
+# or when the import opened the vector store, the sparse index or the document store. Meant for CI and for checking a change by hand;
+# CLI tools (batch_extract_metadata) and tests pay this cost on every start.
+#   python benchmarks/import_budget.py
+#   python benchmarks/import_budget.py --module extract_metadata --budget-ms 100 --top 15
+# Runs in a scratch directory, which must still be empty after the import.
+HEAVY_MODULES = ("torch", "sentence_transformers", "transformers", "chromadb", "PyPDF2", "pytesseract",
+                 "pdf2image", "rank_bm25", "requests")
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1])
+seconds = time.perf_counter() - start
+handles = ("collection", "sparse_index", "doc_store")
+print(json.dumps({
+    "seconds": seconds,
+    "heavy": sorted(m for m in sys.argv[2:] if m in sys.modules),
+    "opened": [name for name in handles if getattr(getattr(module, name, None), "is_open", False)],
+    "lazy": [name for name in handles if getattr(getattr(module, name, None), "is_open", None) is False],
+}))
+"""
+
+
+def cold_import(module, cwd):
+    # One fresh interpreter; returns the child's report (with the files it created in cwd)
+    # and its -X importtime lines
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [THESIS_ROOT, os.environ.get("PYTHONPATH")])))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", _CHILD, module, *HEAVY_MODULES],
+                          cwd=cwd, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    report = json.loads(proc.stdout.strip().splitlines()[-1])
+    report["created"] = sorted(os.listdir(cwd))
+    return report, proc.stderr
+
+
+def slowest_imports(importtime_log, top):
+    # "import time: self [us] | cumulative | imported package" lines, by cumulative time
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the cold import time of a thesis RAG module")
+    parser.add_argument("--module", default="multi_thesis_rag")
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("RAG_IMPORT_BUDGET_MS", "500")))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory(prefix="import_budget_") as scratch:
+            runs.append(cold_import(args.module, scratch))
+    median_ms = statistics.median(report["seconds"] for report, _ in runs) * 1000
+    heavy = sorted({m for report, _ in runs for m in report["heavy"]})
+    opened = sorted({name for report, _ in runs for name in report["opened"]})
+    created = sorted({name for report, _ in runs for name in report["created"]})
+
+    print(f"import {args.module}: median {median_ms:.0f} ms over {args.repeat} cold runs (budget {args.budget_ms:.0f} ms)")
+    print("slowest imports (cumulative):")
+    for micros, name in slowest_imports(runs[-1][1], args.top):
+        print(f"  {micros / 1000:8.1f} ms  {name}")
+    failures = []
+    if median_ms > args.budget_ms:
+        failures.append(f"median import time {median_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+    if heavy:
+        failures.append(f"heavy modules imported eagerly: {', '.join(heavy)}")
+    if opened:
+        failures.append(f"opened at import time: {', '.join(opened)}")
+    if created:
+        failures.append(f"the import created files: {', '.join(created)}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extract_metadata import MAIN_SUBJECTS  # noqa: E402
+
+# Synthetic thesis corpus for benchmarks/bench_rag.py.
+# Every thesis gets the header layout extract_metadata parses (title, author, degree, university,
+# year, ABSTRACT, Keywords) and a body of ~300-word pages mixing common academic words with the
+# vocabulary of its subject. Each thesis also gets three "signature" terms (made-up species /
+# place / method names) that no other thesis uses; labeled queries ask about them, so the
+# thesis they came from is the one relevant answer for recall@k.
+#   python benchmarks/synthetic_corpus.py --theses 1000 --out /tmp/corpus
+COMMON = ("the of and in to a is that for on with as by were was this study results analysis data "
+          "significant respondents effect level mean treatment sample based showed among between "
+          "higher lower factors observed using during compared total percent increase decrease").split()
+SUBJECT_TERMS = ("growth yield production management quality assessment model method response rate "
+                 "performance system community resource practice design evaluation survey variety").split()
+SYLLABLES = ("ka la ma na pa sa ta ba da ga ha ya ri ko lu mi no pe si tu bo de gi hu ro "
+             "an ag al ar ay ul ok in em ib").split()
+FIRST_NAMES = "Maria Jose Ana Juan Rosa Carlo Liza Mark Grace Paolo Joy Ramon".split()
+LAST_NAMES = "Santos Reyes Cruz Bautista Garcia Mendoza Torres Flores Ramos Aquino Castro Villanueva".split()
+DEGREES = ("Master of Science in {}", "Doctor of Philosophy in {}", "Bachelor of Science in {}")
+QUERY_TEMPLATES = (
+    "What is known about {0} in {1}?",
+    "How does {0} affect {2}?",
+    "{1} {0} findings",
+    "Studies on {2} and {0}",
+)
+
+
+def _subject_vocab(subject, rng):
+    # A few stable, subject-specific words so theses of one subject resemble each other
+    words = [w.lower() for w in subject.replace(",", "").split() if len(w) > 3]
+    return words + rng.sample(SUBJECT_TERMS, 8)
+
+
+def _signature_term(rng, used):
+    while True:
+        term = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(3, 4)))
+        if term not in used:
+            used.add(term)
+            return term
+
+
+def _sentence(rng, vocab, n_words):
+    words = [rng.choice(vocab) if rng.random() < 0.35 else rng.choice(COMMON) for _ in range(n_words)]
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_thesis(rng, pages, used_terms):
+    """Return (text, signature_terms, subject) for one thesis."""
+    subject = rng.choice(MAIN_SUBJECTS)
+    vocab = _subject_vocab(subject, random.Random(subject))
+    signature = [_signature_term(rng, used_terms) for _ in range(3)]
+    title = f"{signature[0].capitalize()} and {vocab[0]} of {signature[1].capitalize()} in {subject}"
+    author = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}".upper()
+    year = rng.randint(1985, 2024)
+    abstract = " ".join(_sentence(rng, vocab + signature, rng.randint(10, 25)) for _ in range(4))
+    lines = [
+        title.upper(),
+        author,
+        rng.choice(DEGREES).format(subject),
+        "Central Luzon State University",
+        str(year),
+        "",
+        "ABSTRACT",
+        abstract,
+        f"Keywords: {signature[0]}, {signature[1]}, {subject}",
+        "",
+        "CHAPTER I",
+        "INTRODUCTION",
+    ]
+    body_vocab = vocab + signature
+    for page in range(pages):
+        words = 0
+        sentences = []
+        while words < 300:
+            n = rng.randint(6, 30)
+            sentences.append(_sentence(rng, body_vocab, n))
+            words += n
+        lines.append(" ".join(sentences))
+        lines.append(str(page + 1))
+    return "\n".join(lines) + "\n", signature, subject
+
+
+def generate_corpus(out_dir, n_theses, pages=2, seed=0, queries_per_thesis=1, max_queries=1000):
+    """
+    Write thesis_<n>.txt (plus an empty .pdf next to each, which is what the indexer lists)
+    into out_dir. Returns the labeled queries [{"question", "file"}] and writes them to queries.json.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    used_terms = set()
+    labeled = []
+    query_every = max(1, n_theses * queries_per_thesis // max_queries) if max_queries else 1
+    for n in range(n_theses):
+        text, signature, subject = synthetic_thesis(rng, pages, used_terms)
+        name = f"thesis_{n:06d}"
+        with open(os.path.join(out_dir, name + ".txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+        open(os.path.join(out_dir, name + ".pdf"), "wb").close()
+        if n % query_every == 0:
+            for q in range(queries_per_thesis):
+                template = QUERY_TEMPLATES[(n + q) % len(QUERY_TEMPLATES)]
+                question = template.format(signature[q % 3], subject.lower(), signature[(q + 1) % 3])
+                labeled.append({"question": question, "file": name + ".txt"})
+    with open(os.path.join(out_dir, "queries.json"), "w", encoding="utf-8") as f:
+        json.dump(labeled, f, indent=1)
+    return labeled
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic thesis corpus with labeled queries")
+    parser.add_argument("--theses", type=int, default=1000)
+    parser.add_argument("--pages", type=int, default=2, help="~300-word pages per thesis")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-queries", type=int, default=1000)
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+    queries = generate_corpus(args.out, args.theses, args.pages, args.seed, max_queries=args.max_queries)
+    print(f"Wrote {args.theses} theses and {len(queries)} labeled queries to {args.out}")
@@ -0,0 +1,131 @@
+import bisect
+import copy
+import itertools
+import os
+import re
+import threading
+
+# Sentence-window chunker measured in model tokens.
+# Sentence lengths are counted once (one batched tokenizer call per document) and turned into
+# prefix sums, so every window end and every overlap start is a bisect instead of a rescan.
+# A window holds as many whole sentences as fit in max_tokens (MiniLM embeds at most 256
+# word-pieces including [CLS]/[SEP]; anything beyond is silently truncated), and the next window
+# starts at the earliest sentence that keeps at most overlap_tokens of the previous one.
+# Sentences longer than a whole window are split on word boundaries.
+# Chunks carry character offsets (start, end) into the original text.
+CHUNKER_VERSION = 2  # 1 = the original 500-word sentence_chunking
+CHUNK_MAX_TOKENS = int(os.environ.get("RAG_CHUNK_MAX_TOKENS", "0")) or None  # None -> model limit
+DEFAULT_MAX_TOKENS = 254  # all-MiniLM-L6-v2: 256 minus [CLS]/[SEP]
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("RAG_CHUNK_OVERLAP_TOKENS", "50"))
+
+_SENTENCE_BREAK = re.compile(r'[.!?]\s+')
+_WORD = re.compile(r'\S+')
+
+
+def word_counter(texts):
+    # Whitespace word counts; a stand-in when no tokenizer is available
+    return [len(t.split()) for t in texts]
+
+
+def model_token_counter(model_name=None):
+    """Return (count_tokens, max_tokens) for an embedding model; count_tokens(texts) -> [int]."""
+    from embedder_registry import get_embedder, DEFAULT_MODEL_NAME
+    model_name = model_name or DEFAULT_MODEL_NAME
+    with _counters_lock:
+        counter = _counters.get(model_name)
+        if counter is None:
+            counter = _counters[model_name] = _make_token_counter(get_embedder(model_name))
+    return counter
+
+
+def _make_token_counter(embedder):
+    # A private copy of the tokenizer: encode() on other threads (ingest embed stage, queries)
+    # switches padding/truncation on the embedder's own tokenizer on every call, and the Rust
+    # tokenizer raises "Already borrowed" when two threads use it at once
+    tokenizer = copy.deepcopy(embedder.tokenizer)
+    max_tokens = embedder.max_seq_length - 2  # room for [CLS] and [SEP]
+    lock = threading.Lock()
+
+    def count_tokens(texts):
+        if not texts:
+            return []
+        with lock:
+            encoded = tokenizer(list(texts), add_special_tokens=False, padding=False, truncation=False,
+                                return_attention_mask=False, return_token_type_ids=False, verbose=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    return count_tokens, max_tokens
+
+
+_counters = {}  # model name -> (count_tokens, max_tokens)
+_counters_lock = threading.Lock()
+
+
+def sentence_spans(text):
+    """[(start, end)] character spans of the sentences in text, whitespace excluded."""
+    spans = []
+    start = len(text) - len(text.lstrip())
+    for m in _SENTENCE_BREAK.finditer(text, start):
+        spans.append((start, m.start() + 1))  # keep the punctuation
+        start = m.end()
+    end = len(text.rstrip())
+    if end > start:
+        spans.append((start, end))
+    return spans
+
+
+def _split_long(text, span, n_tokens, max_tokens, count_tokens):
+    # Split one over-long sentence into word runs that each fit in max_tokens
+    words = [(span[0] + m.start(), span[0] + m.end()) for m in _WORD.finditer(text)]
+    if len(words) <= 1:
+        return [span], [n_tokens]
+    per_piece = max(1, int(len(words) * max_tokens / n_tokens * 0.9))
+    pieces = [(words[i][0], words[min(i + per_piece, len(words)) - 1][1]) for i in range(0, len(words), per_piece)]
+    counts = count_tokens([text[s - span[0]:e - span[0]] for s, e in pieces])
+    out_spans, out_counts = [], []
+    for piece, n in zip(pieces, counts):
+        if n > max_tokens and piece != span:
+            sub_spans, sub_counts = _split_long(text[piece[0] - span[0]:piece[1] - span[0]], piece, n, max_tokens, count_tokens)
+            out_spans.extend(sub_spans)
+            out_counts.extend(sub_counts)
+        else:
+            out_spans.append(piece)
+            out_counts.append(n)
+    return out_spans, out_counts
+
+
+def chunk_sentences(text, count_tokens=word_counter, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Split text into sentence windows of at most max_tokens tokens.
+    Returns [(chunk, start, end)]: chunk is text[start:end] with whitespace collapsed.
+    """
+    spans = sentence_spans(text)
+    if not spans:
+        return []
+    counts = count_tokens([text[s:e] for s, e in spans])
+    if max(counts) > max_tokens:
+        fitted_spans, fitted_counts = [], []
+        for span, n in zip(spans, counts):
+            if n > max_tokens:
+                sub_spans, sub_counts = _split_long(text[span[0]:span[1]], span, n, max_tokens, count_tokens)
+                fitted_spans.extend(sub_spans)
+                fitted_counts.extend(sub_counts)
+            else:
+                fitted_spans.append(span)
+                fitted_counts.append(n)
+        spans, counts = fitted_spans, fitted_counts
+    prefix = [0, *itertools.accumulate(counts)]
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens - 1))
+    chunks = []
+    i = 0
+    n_spans = len(spans)
+    while i < n_spans:
+        # Last sentence j-1 such that sentences i..j-1 fit; always at least one sentence
+        j = max(i + 1, bisect.bisect_right(prefix, prefix[i] + max_tokens, i + 1) - 1)
+        start, end = spans[i][0], spans[j - 1][1]
+        chunks.append((" ".join(text[start:end].split()), start, end))
+        if j >= n_spans:
+            break
+        # Next window starts at the earliest sentence keeping <= overlap_tokens of this one
+        i = max(i + 1, bisect.bisect_left(prefix, prefix[j] - overlap_tokens, i + 1, j + 1))
+    return chunks
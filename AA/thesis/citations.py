@@ -0,0 +1,183 @@
+import re
+
+# Reference renumbering for Gemini overviews.
+# Sources are renumbered by first appearance in the answer; every body paragraph keeps at most
+# two of its references, moved to the end of the paragraph; a trailing reference-only paragraph
+# is dropped and the summary (last) paragraph ends with all references used in the body.
+# CitationRenumberer works incrementally: feed() it streamed text and it returns finished
+# paragraphs as soon as they can no longer be the summary paragraph.
+REF_PATTERN = re.compile(r'\[(\d+)\]')
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_LETTER = re.compile(r'[a-zA-Z]')
+MAX_REFS_PER_PARAGRAPH = 2
+
+
+def _tighten_final_dot(text):
+    # Same as re.sub(r'\s+\.$', '.', text) on stripped text, without the regex's quadratic scan
+    if text.endswith('.'):
+        head = text[:-1]
+        stripped = head.rstrip()
+        if len(stripped) < len(head):
+            return stripped + '.'
+    return text
+
+
+class CitationRenumberer:
+    def __init__(self, n_sources, max_refs_per_paragraph=MAX_REFS_PER_PARAGRAPH):
+        self.n_sources = n_sources
+        self.allowed = {str(n) for n in range(1, n_sources + 1)}
+        self.max_refs = max_refs_per_paragraph
+        self.old_to_new = {}
+        self._buffer = ""
+        self._held = []         # complete paragraphs that might still be the summary
+        self._processed = 0     # paragraphs already emitted
+        self._assigned = []     # new reference numbers used by body paragraphs, in order
+
+    def _map_refs(self, para):
+        refs = []
+        for ref in REF_PATTERN.findall(para):
+            if ref in self.allowed:
+                new = self.old_to_new.get(ref)
+                if new is None:
+                    new = self.old_to_new[ref] = str(len(self.old_to_new) + 1)
+                refs.append(new)
+        return refs
+
+    def _body(self, para):
+        unique_refs = []
+        for r in self._map_refs(para):
+            if r not in unique_refs:
+                unique_refs.append(r)
+            if len(unique_refs) == self.max_refs:
+                break
+        clean = _tighten_final_dot(REF_PATTERN.sub('', para).strip())
+        for r in unique_refs:
+            clean += f'[{r}]'
+        self._assigned.extend(unique_refs)
+        self._processed += 1
+        return clean
+
+    def feed(self, text):
+        """Add streamed text; return the list of paragraphs that are now final."""
+        if not self._buffer and not self._held and not self._processed:
+            text = text.lstrip()  # the answer is stripped, as in prompt_chain
+        self._buffer += text
+        # A break is only final once non-whitespace text follows it (more whitespace could extend it)
+        end = len(self._buffer.rstrip())
+        parts = PARAGRAPH_BREAK.split(self._buffer[:end])
+        self._buffer = parts.pop() + self._buffer[end:]
+        self._held.extend(parts)
+        # Once text with letters follows, no held paragraph can be the summary
+        out = []
+        if self._held and _LETTER.search(self._buffer):
+            out = [self._body(p) for p in self._held]
+            self._held = []
+        elif len(self._held) > 1:
+            # Everything before the last paragraph that has letters is body text
+            last_texty = max((i for i, p in enumerate(self._held) if _LETTER.search(p)), default=-1)
+            if last_texty > 0:
+                out = [self._body(p) for p in self._held[:last_texty]]
+                self._held = self._held[last_texty:]
+        return out
+
+    def finish(self):
+        """Flush the remaining paragraphs; the last one becomes the summary."""
+        paragraphs = self._held + [self._buffer.rstrip()]
+        self._held = []
+        self._buffer = ""
+        if self._processed == 0 and len(paragraphs) == 1 and not paragraphs[0].strip():
+            paragraphs = [paragraphs[0].strip()]
+        elif not paragraphs[-1].strip() and len(paragraphs) > 1:
+            paragraphs.pop()
+        # Remove trailing reference-only paragraph if present (its refs still count for numbering)
+        ref_only = None
+        if paragraphs and REF_PATTERN.findall(paragraphs[-1]) and not _LETTER.search(paragraphs[-1]):
+            ref_only = paragraphs.pop()
+        total = self._processed + len(paragraphs)
+        n_body = max(1, total - 1)  # Exclude summary
+        out = []
+        for para in paragraphs:
+            if self._processed < n_body:
+                out.append(self._body(para))
+            else:
+                self._map_refs(para)
+                self._processed += 1
+                out.append(_tighten_final_dot(REF_PATTERN.sub('', para).strip()))
+        if ref_only is not None:
+            self._map_refs(ref_only)
+        if out:
+            # Summary ends with every reference assigned to the body, unless already there
+            summary = _tighten_final_dot(out[-1])
+            end_refs = set(REF_PATTERN.findall(summary.split('.')[-1]))
+            for r in dict.fromkeys(self._assigned):
+                if r not in end_refs:
+                    summary += f'[{r}]'
+            out[-1] = summary
+        return out
+
+    def ref_order(self):
+        """Old source numbers in their new order; unreferenced sources keep their relative order at the end."""
+        new_to_old = {new: old for old, new in self.old_to_new.items()}
+        order = [new_to_old[str(i)] for i in range(1, len(new_to_old) + 1)]
+        order += [str(n) for n in range(1, self.n_sources + 1) if str(n) not in self.old_to_new]
+        return order
+
+
+def renumber_answer(raw_answer, n_sources):
+    """Renumber a complete answer; returns (text, ref_order)."""
+    renumberer = CitationRenumberer(n_sources)
+    paragraphs = renumberer.feed(raw_answer)
+    paragraphs += renumberer.finish()
+    return '\n\n'.join(paragraphs), renumberer.ref_order()
+
+
+MAX_SOURCES = 10
+REFERENCE_HINT = ("When answering, please reference the relevant thesis by its number in square brackets, "
+                  "e.g., [1], [2], etc., to indicate the source of each point.\n\n")
+
+
+def _source_id(meta):
+    return meta.get('pdf', meta.get('file', '[Unknown]'))
+
+
+class SourceContext:
+    """
+    Numbered source list and chunk context for the Gemini prompt.
+    Each source's metadata block and each chunk line are formatted once; render() only
+    joins them under the current numbering, and reorder() applies a renumbering.
+    """
+
+    def __init__(self, top_chunks, max_sources=MAX_SOURCES):
+        self.sources = []     # sources[n-1] is the pdf/file of reference [n]
+        self._doc_info = {}   # source -> metadata block without its number
+        for c in top_chunks:
+            pdf_id = _source_id(c['meta'])
+            if pdf_id not in self._doc_info:
+                meta = c['meta']
+                self.sources.append(pdf_id)
+                self._doc_info[pdf_id] = (f" Title: {meta.get('title','') or '[Unknown]'}\n"
+                                          f"    Author: {meta.get('author','') or '[Unknown]'}\n"
+                                          f"    Year: {meta.get('publication_year','') or '[Unknown]'}\n"
+                                          f"    File: {pdf_id}")
+            if len(self.sources) >= max_sources:
+                break
+        # Only chunks from the numbered sources, in retrieval order
+        self._chunk_lines = []
+        for c in top_chunks:
+            pdf_id = _source_id(c['meta'])
+            if pdf_id in self._doc_info:
+                self._chunk_lines.append((pdf_id, f" From {pdf_id} (chunk {c['meta']['chunk_idx']}): {c['chunk']}"))
+
+    def __len__(self):
+        return len(self.sources)
+
+    def reorder(self, ref_order):
+        """Renumber sources: ref_order lists the current numbers (as strings) in their new order."""
+        self.sources = [self.sources[int(old) - 1] for old in ref_order]
+
+    def render(self):
+        number = {pdf_id: i for i, pdf_id in enumerate(self.sources, start=1)}
+        doc_info_str = "Top 10 relevant documents found (numbered for reference):\n" + "\n".join(
+            f"[{i}]{self._doc_info[pdf_id]}" for pdf_id, i in number.items()) + "\n\n"
+        chunk_context = "\n\n".join(f"[{number[pdf_id]}]{line}" for pdf_id, line in self._chunk_lines)
+        return f"{doc_info_str}Context: {chunk_context}\n\n{REFERENCE_HINT}"
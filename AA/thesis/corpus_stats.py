@@ -0,0 +1,42 @@
+import threading
+import time
+
+# Corpus statistics served by /health.
+# Counting documents used to mean pulling every chunk's metadata out of ChromaDB and globbing
+# RAG/theses on each probe; instead the indexer updates these numbers whenever it changes the
+# collection and /health only reads them. /health/deep re-derives them the expensive way.
+
+
+class CorpusStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.chunks = 0
+        self.txt_files = 0
+        self.sparse_chunks = 0
+        self.vector_store = None      # the store's stats() as of the last refresh
+        self.last_indexed_at = None   # when the collection last changed
+        self.updated_at = None        # when these numbers were last refreshed
+
+    def update(self, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                if not hasattr(self, name) or name.startswith("_"):
+                    raise AttributeError(f"Unknown corpus stat: {name}")
+                setattr(self, name, value)
+            self.updated_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "total_documents": self.documents,
+                "total_chunks": self.chunks,
+                "total_txt_files": self.txt_files,
+                "sparse_chunks": self.sparse_chunks,
+                "vector_store": self.vector_store,
+                "last_indexed_at": self.last_indexed_at,
+                "stats_updated_at": self.updated_at,
+            }
+
+
+corpus_stats = CorpusStats()
@@ -0,0 +1,119 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from facet_index import SUBJECT_KEY_PREFIX
+
+# Document-level metadata, one row per thesis, keyed by doc id (the .txt file name).
+# Chunks in ChromaDB only carry the doc id, their position and the few compact fields that
+# filters run on (see CHUNK_FIELDS); title, author, abstract, call number and the rest are
+# stored here once per thesis and joined in for the final top documents of a search.
+# SQLite in WAL mode: one writer (the indexer) and many readers (the /search workers).
+# 2: subjects as subj_<code> flags on the chunks instead of a subject_list array
+DOC_STORE_VERSION = 2
+# Metadata that stays on every chunk: the doc id, the chunk position, and the filter fields
+# (plus one subj_<code> flag per subject, see facet_index.subject_key)
+CHUNK_FIELDS = ("file", "chunk_idx", "char_start", "char_end", "year", "university", "degree")
+
+
+def is_chunk_field(key):
+    return key in CHUNK_FIELDS or key.startswith(SUBJECT_KEY_PREFIX)
+
+
+def chunk_metadata(meta):
+    """The compact per-chunk part of a document's metadata."""
+    return {k: v for k, v in meta.items() if is_chunk_field(k)}
+
+
+class DocumentStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " doc_id TEXT PRIMARY KEY,"
+            " meta TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS store_info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def get_info(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM store_info WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_info(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO store_info (key, value) VALUES (?, ?)", (key, str(value)))
+            self._conn.commit()
+
+    def upsert_many(self, docs):
+        """docs: iterable of (doc_id, meta dict)."""
+        now = time.time()
+        rows = [(doc_id, json.dumps(meta, ensure_ascii=False, sort_keys=True), now) for doc_id, meta in docs]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO documents (doc_id, meta, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(doc_id) DO UPDATE SET meta = excluded.meta, updated_at = excluded.updated_at",
+                rows,
+            )
+            self._conn.commit()
+
+    def upsert(self, doc_id, meta):
+        self.upsert_many([(doc_id, meta)])
+
+    def delete(self, doc_ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM documents WHERE doc_id = ?", [(d,) for d in doc_ids])
+            self._conn.commit()
+
+    def get_many(self, doc_ids):
+        """{doc_id: meta} for the given ids that exist."""
+        doc_ids = list(dict.fromkeys(d for d in doc_ids if d))
+        if not doc_ids:
+            return {}
+        out = {}
+        with self._lock:
+            # SQLite limits the number of bound parameters per statement
+            for i in range(0, len(doc_ids), 500):
+                part = doc_ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT doc_id, meta FROM documents WHERE doc_id IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                out.update((doc_id, json.loads(meta)) for doc_id, meta in rows)
+        return out
+
+    def ids(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT doc_id FROM documents")]
+
+    def items(self, page_size=5000):
+        """Iterate (doc_id, meta) over all documents."""
+        last = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT doc_id, meta FROM documents WHERE doc_id > ? ORDER BY doc_id LIMIT ?", (last, page_size)
+                ).fetchall()
+            if not rows:
+                return
+            for doc_id, meta in rows:
+                yield doc_id, json.loads(meta)
+            last = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
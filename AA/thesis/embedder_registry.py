@@ -0,0 +1,73 @@
+import logging
+import resource
+import threading
+import time
+
+# Process-wide registry of loaded SentenceTransformer models.
+# Loading MiniLM takes seconds; every caller (indexer, /search handler,
+# metadata classifier) should go through get_embedder() instead of
+# constructing its own SentenceTransformer.
+DEFAULT_MODEL_NAME = 'all-MiniLM-L6-v2'
+
+_embedders = {}
+_embedder_stats = {}
+_registry_lock = threading.Lock()
+
+log = logging.getLogger(__name__)
+
+
+def _rss_mb():
+    # ru_maxrss is reported in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def get_embedder(model_name=DEFAULT_MODEL_NAME):
+    """
+    Return the shared SentenceTransformer for model_name, loading and warming it on first use.
+    """
+    embedder = _embedders.get(model_name)
+    if embedder is not None:
+        return embedder
+    with _registry_lock:
+        # Another thread may have finished loading while we waited for the lock
+        embedder = _embedders.get(model_name)
+        if embedder is not None:
+            return embedder
+        from sentence_transformers import SentenceTransformer
+        rss_before = _rss_mb()
+        start = time.perf_counter()
+        embedder = SentenceTransformer(model_name)
+        load_seconds = time.perf_counter() - start
+        # Warm up so the first real request does not pay for lazy initialisation
+        start = time.perf_counter()
+        embedder.encode(["warmup"], convert_to_numpy=True)
+        warmup_seconds = time.perf_counter() - start
+        try:
+            param_bytes = sum(p.numel() * p.element_size() for p in embedder.parameters())
+        except Exception:
+            param_bytes = 0
+        _embedder_stats[model_name] = {
+            "model": model_name,
+            "load_seconds": round(load_seconds, 3),
+            "warmup_seconds": round(warmup_seconds, 3),
+            "param_mb": round(param_bytes / (1024 * 1024), 1),
+            "rss_delta_mb": round(max(0.0, _rss_mb() - rss_before), 1),
+            "loaded_at": time.time(),
+        }
+        _embedders[model_name] = embedder
+        log.info("Loaded embedder %s in %.2fs (warmup %.2fs)", model_name, load_seconds, warmup_seconds)
+        return embedder
+
+
+def embedder_name(embedder):
+    """Model name embedder was loaded under by get_embedder(), or None for one made elsewhere."""
+    for model_name, loaded in list(_embedders.items()):
+        if loaded is embedder:
+            return model_name
+    return None
+
+
+def embedder_stats():
+    # Snapshot of load time / memory for every loaded model, used by /health
+    with _registry_lock:
+        return [dict(s) for s in _embedder_stats.values()]
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+# On-disk cache of chunk embeddings keyed by (model name, normalized chunk text hash).
+# Layout per model under RAG/cache/embeddings/<model>/:
+#   meta.json    {"model", "dim", "dtype"}
+#   keys.bin     16-byte blake2b digests, one per row
+#   vectors.f16  float16 matrix, row i belongs to key i (memory-mapped for reads)
+# Both files are append-only; a torn write is detected on load by trimming to the shorter file.
+EMBED_CACHE_DIR = os.path.join("RAG", "cache", "embeddings")
+EMBED_CACHE_ENABLED = os.environ.get("RAG_EMBED_CACHE", "1") != "0"
+KEY_BYTES = 16
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+def text_key(text):
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=KEY_BYTES).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, model_name, cache_dir=EMBED_CACHE_DIR):
+        self.model_name = model_name
+        self.dir = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', model_name))
+        self.keys_path = os.path.join(self.dir, "keys.bin")
+        self.vectors_path = os.path.join(self.dir, "vectors.f16")
+        self.meta_path = os.path.join(self.dir, "meta.json")
+        self.dim = None
+        self._rows = {}
+        self._n_rows = 0
+        self._mm = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            self.dim = int(json.load(f)["dim"])
+        row_bytes = self.dim * 2
+        n_keys = os.path.getsize(self.keys_path) // KEY_BYTES if os.path.exists(self.keys_path) else 0
+        n_vecs = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        n = min(n_keys, n_vecs)
+        for path, size in ((self.keys_path, n * KEY_BYTES), (self.vectors_path, n * row_bytes)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        if n:
+            with open(self.keys_path, "rb") as f:
+                raw = f.read(n * KEY_BYTES)
+            self._rows = {raw[i * KEY_BYTES:(i + 1) * KEY_BYTES]: i for i in range(n)}
+        self._n_rows = n
+
+    def _matrix(self):
+        # Re-map only when rows were appended since the last mapping
+        if self._mm is None or self._mm.shape[0] < self._n_rows:
+            self._mm = np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(self._n_rows, self.dim))
+        return self._mm
+
+    def __len__(self):
+        return self._n_rows
+
+    def get_many(self, texts):
+        """
+        Return (embeddings, missing) where embeddings is a float32 array with rows filled for
+        cached texts (None if the cache is empty) and missing lists indices not in the cache.
+        """
+        keys = [text_key(t) for t in texts]
+        with self._lock:
+            rows = [self._rows.get(k) for k in keys]
+            missing = [i for i, r in enumerate(rows) if r is None]
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            if self.dim is None or len(missing) == len(texts):
+                return None, missing
+            out = np.zeros((len(texts), self.dim), dtype=np.float32)
+            hit_pos = [i for i, r in enumerate(rows) if r is not None]
+            out[hit_pos] = self._matrix()[[rows[i] for i in hit_pos]]
+            return out, missing
+
+    def put_many(self, texts, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float16)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(embeddings.shape[1])
+                os.makedirs(self.dir, exist_ok=True)
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model_name, "dim": self.dim, "dtype": "float16"}, f)
+            new_keys = []
+            new_rows = []
+            for text, emb in zip(texts, embeddings):
+                k = text_key(text)
+                if k in self._rows:
+                    continue
+                self._rows[k] = self._n_rows + len(new_keys)
+                new_keys.append(k)
+                new_rows.append(emb)
+            if not new_keys:
+                return
+            # Vectors first: a crash between the two writes leaves an orphan row that _load trims
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(new_rows, dtype=np.float16).tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(new_keys))
+            self._n_rows += len(new_keys)
+
+    def stats(self):
+        with self._lock:
+            return {"model": self.model_name, "entries": self._n_rows, "hits": self.hits, "misses": self.misses}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model_name):
+    with _caches_lock:
+        cache = _caches.get(model_name)
+        if cache is None:
+            cache = _caches[model_name] = EmbeddingCache(model_name)
+        return cache
+
+
+def encode_with_cache(embedder, texts, model_name, cache=None, **encode_kwargs):
+    """
+    Encode texts, reusing cached embeddings and encoding only the misses.
+    Vectors are returned as float32 rounded through float16, so a text embeds identically
+    whether or not it came from the cache.
+    """
+    if cache is None:
+        if not EMBED_CACHE_ENABLED:
+            return np.asarray(embedder.encode(list(texts), convert_to_numpy=True, **encode_kwargs), dtype=np.float32)
+        cache = get_embedding_cache(model_name)
+    texts = list(texts)
+    out, missing = cache.get_many(texts)
+    if missing:
+        fresh = np.asarray(embedder.encode([texts[i] for i in missing], convert_to_numpy=True, **encode_kwargs))
+        fresh = fresh.astype(np.float16)
+        cache.put_many([texts[i] for i in missing], fresh)
+        if out is None:
+            out = np.zeros((len(texts), fresh.shape[1]), dtype=np.float32)
+        out[missing] = fresh.astype(np.float32)
+    if out is None:
+        out = np.zeros((0, cache.dim or 0), dtype=np.float32)
+    return out
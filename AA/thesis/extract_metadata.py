@@ -1,3 +1,11 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+
+log = logging.getLogger(__name__)
+
 # Controlled vocabulary for main subjects
 MAIN_SUBJECTS = [
     "Agriculture",
@@ -66,11 +74,74 @@ DEGREE_TO_MAIN_SUBJECT = {
     'general science': 'General Works',
 }
 
-def extract_thesis_metadata(text):
-    import re
-    from sentence_transformers import SentenceTransformer
-    from sklearn.metrics.pairwise import cosine_similarity
+# Embedding fallback for subject classification
+SUBJECT_MODEL_NAME = 'all-MiniLM-L6-v2'
+SUBJECT_CACHE_DIR = os.path.join("RAG", "cache")
+SUBJECT_ENCODE_BATCH_SIZE = 128
+
+
+class SubjectClassifier:
+    """
+    Nearest-MAIN_SUBJECT classifier over normalized sentence embeddings.
+    The subject matrix is computed once and persisted, keyed by model name and vocabulary hash.
+    """
+    def __init__(self, model_name=SUBJECT_MODEL_NAME, subjects=None, cache_dir=SUBJECT_CACHE_DIR):
+        import numpy as np
+        from embedder_registry import get_embedder
+        self.model_name = model_name
+        self.subjects = list(subjects or MAIN_SUBJECTS)
+        self.model = get_embedder(model_name)
+        vocab_hash = hashlib.sha1("\n".join(self.subjects).encode("utf-8")).hexdigest()[:16]
+        safe_model = re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)
+        self.cache_path = os.path.join(cache_dir, f"subjects_{safe_model}_{vocab_hash}.npy") if cache_dir else None
+        self.subject_embs = None
+        if self.cache_path and os.path.exists(self.cache_path):
+            try:
+                embs = np.load(self.cache_path)
+                if embs.shape[0] == len(self.subjects):
+                    self.subject_embs = embs
+            except Exception as e:
+                log.warning("Ignoring unreadable subject cache %s: %s", self.cache_path, e)
+        if self.subject_embs is None:
+            self.subject_embs = np.asarray(
+                self.model.encode(self.subjects, convert_to_numpy=True, normalize_embeddings=True),
+                dtype=np.float32)
+            if self.cache_path:
+                try:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    np.save(self.cache_path, self.subject_embs)
+                except OSError as e:
+                    log.warning("Could not persist subject cache %s: %s", self.cache_path, e)
+
+    def classify(self, text):
+        return self.classify_many([text])[0]
+
+    def classify_many(self, texts, batch_size=SUBJECT_ENCODE_BATCH_SIZE):
+        # One batched encode and one (n_texts x n_subjects) matrix multiply for all texts
+        if not texts:
+            return []
+        embs = self.model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True,
+                                 normalize_embeddings=True, show_progress_bar=False)
+        best = (embs @ self.subject_embs.T).argmax(axis=1)
+        return [self.subjects[int(i)] for i in best]
+
 
+_subject_classifier = None
+_subject_classifier_lock = threading.Lock()
+
+
+def get_subject_classifier():
+    # Lazily build the shared classifier; heavy imports only happen on first fallback
+    global _subject_classifier
+    if _subject_classifier is None:
+        with _subject_classifier_lock:
+            if _subject_classifier is None:
+                _subject_classifier = SubjectClassifier()
+    return _subject_classifier
+
+
+def _extract_fields(text):
+    # Regex/heuristic field extraction; returns (meta, keywords) without subject classification
     meta = {}
     lines = text.splitlines()
 
@@ -146,50 +217,79 @@ def extract_thesis_metadata(text):
                 keywords += [k.strip() for k in re.split(r'[;,]', next_l) if k.strip()]
             break
 
-    # Guarantee at least one subject, and main subject is first
-    def get_main_subject(subjects, title, degree, abstract):
-        # 1. Rule-based mapping from degree/title
-        for k, v in DEGREE_TO_MAIN_SUBJECT.items():
-            if k in (degree or '').lower() or k in (title or '').lower():
-                return v
-        # 2. If any subject matches a main subject, use it
-        for s in subjects:
-            for main in MAIN_SUBJECTS:
-                if s.lower() == main.lower():
-                    return main
-        # 3. Fallback: use embedding similarity if available
-        try:
-            from sentence_transformers import SentenceTransformer
-            from sklearn.metrics.pairwise import cosine_similarity
-            model = SentenceTransformer('all-MiniLM-L6-v2')
-            main_embs = model.encode(MAIN_SUBJECTS)
-            context = ((degree or "") + ". " + (title or "")).strip()
-            if context:
-                context_emb = model.encode([context])[0]
-                sims = cosine_similarity([context_emb], main_embs)[0]
-                best_idx = int(sims.argmax())
-                return MAIN_SUBJECTS[best_idx]
-            if abstract:
-                context_emb = model.encode([abstract])[0]
-                sims = cosine_similarity([context_emb], main_embs)[0]
-                best_idx = int(sims.argmax())
-                return MAIN_SUBJECTS[best_idx]
-        except Exception:
-            pass
-        # 4. Fallback: use 'General Works' if present, else first main subject
+    return meta, [k for k in keywords if k]
+
+
+def _rule_based_main_subject(subjects, title, degree):
+    # 1. Rule-based mapping from degree/title
+    for k, v in DEGREE_TO_MAIN_SUBJECT.items():
+        if k in (degree or '').lower() or k in (title or '').lower():
+            return v
+    # 2. If any subject matches a main subject, use it
+    for s in subjects:
         for main in MAIN_SUBJECTS:
-            if main == "General Works":
+            if s.lower() == main.lower():
                 return main
-        return MAIN_SUBJECTS[0]
-
-    subjects = [s for s in keywords if s]
-    title = meta.get("title", "")
-    degree = meta.get("degree", "")
-    abstract = meta.get("abstract", "")
-    main_subject = get_main_subject(subjects, title, degree, abstract)
-    # Remove any duplicate of main subject in subjects
+    return None
+
+
+def _fallback_context(title, degree, abstract):
+    # Text used for the embedding fallback: degree + title, else the abstract
+    context = ((degree or "") + ". " + (title or "")).strip()
+    if context:
+        return context
+    return abstract or None
+
+
+def _default_main_subject():
+    # 4. Fallback: use 'General Works' if present, else first main subject
+    for main in MAIN_SUBJECTS:
+        if main == "General Works":
+            return main
+    return MAIN_SUBJECTS[0]
+
+
+def _set_subjects(meta, subjects, main_subject):
+    # Guarantee at least one subject, and main subject is first
     subjects = [s for s in subjects if main_subject.lower() != s.lower()]
     meta["main_subject"] = main_subject
     meta["subjects"] = [main_subject] + subjects if subjects else [main_subject]
+    return meta
+
+
+def extract_thesis_metadata(text):
+    return extract_thesis_metadata_batch([text])[0]
+
+
+def extract_thesis_metadata_batch(texts):
+    """
+    Extract metadata for many theses at once.
+    Fields are parsed per document; every document that needs the embedding fallback
+    for its main subject is classified in a single batched encode.
+    """
+    metas = []
+    pending = []  # (position, fallback context)
+    for text in texts:
+        meta, subjects = _extract_fields(text)
+        main_subject = _rule_based_main_subject(subjects, meta.get("title", ""), meta.get("degree", ""))
+        if main_subject is None:
+            context = _fallback_context(meta.get("title", ""), meta.get("degree", ""), meta.get("abstract", ""))
+            if context:
+                pending.append((len(metas), context))
+        metas.append((meta, subjects, main_subject))
+
+    # 3. Fallback: use embedding similarity if available
+    fallback_subjects = {}
+    if pending:
+        try:
+            labels = get_subject_classifier().classify_many([c for _, c in pending])
+            fallback_subjects = {pos: label for (pos, _), label in zip(pending, labels)}
+        except Exception as e:
+            log.warning("Embedding subject fallback unavailable: %s", e)
 
-    return meta
\ No newline at end of file
+    results = []
+    for pos, (meta, subjects, main_subject) in enumerate(metas):
+        if main_subject is None:
+            main_subject = fallback_subjects.get(pos) or _default_main_subject()
+        results.append(_set_subjects(meta, subjects, main_subject))
+    return results
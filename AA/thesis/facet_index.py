@@ -0,0 +1,253 @@
+import json
+import re
+import threading
+
+# Structured filters and facet counts for /search.
+# Chunks carry two normalized fields next to the display metadata:
+#   year          - int publication year (absent when unknown, so range filters exclude it)
+#   subj_<code>   - True, one key per subject (see subject_key); the comma-joined `subjects` string
+#                   stays for display
+# Filters are turned into a ChromaDB `where` clause, so they run inside the vector search. Subjects
+# are boolean keys rather than one list value: list metadata and `$contains` on it need a recent
+# ChromaDB, while equality on a key works on every version (and on the local store).
+# FacetIndex is the in-memory, document-level view of the same fields (one record per thesis),
+# built from the document store at startup and kept current by the indexer. It answers facet
+# counts without touching ChromaDB and tells the BM25 search which files a filter allows.
+FACET_FIELDS = ("year", "subjects", "university", "degree")
+MAX_FACET_VALUES = 50
+
+SUBJECT_KEY_PREFIX = "subj_"
+
+_YEAR = re.compile(r'(?:19|20)\d{2}')
+
+
+def normalize_year(value):
+    """Int year from a publication_year value such as '2018' or 'March 2018'; None if there is none."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    m = _YEAR.search(str(value or ""))
+    return int(m.group(0)) if m else None
+
+
+def subject_list(subjects):
+    # Subjects from a list or the comma-joined string, stripped and de-duplicated in order
+    if isinstance(subjects, str):
+        subjects = subjects.split(",")
+    out = []
+    for s in subjects or []:
+        s = str(s).strip()
+        if s and s not in out:
+            out.append(s)
+    return out
+
+
+def subject_key(subject):
+    """Metadata key flagging a subject: 'Animal Science' -> 'subj_animal_science'."""
+    return SUBJECT_KEY_PREFIX + "_".join(re.findall(r'\w+', subject.lower()))
+
+
+def add_filter_fields(meta):
+    # Normalized filter fields for a chunk / document metadata dict (in place). Subjects come from
+    # the `subjects` string, or from the `subject_list` array of chunks indexed before subject keys
+    year = normalize_year(meta.get("publication_year", meta.get("year")))
+    if year is not None:
+        meta["year"] = year
+    else:
+        meta.pop("year", None)
+    legacy_subjects = meta.pop("subject_list", None)
+    subjects = subject_list(meta.get("subjects") or legacy_subjects)
+    for key in [k for k in meta if k.startswith(SUBJECT_KEY_PREFIX)]:
+        del meta[key]
+    for s in subjects:
+        meta[subject_key(s)] = True
+    return meta
+
+
+def _str_list(value, name):
+    values = [value] if isinstance(value, str) else value
+    if not isinstance(values, list) or not all(isinstance(v, str) and v.strip() for v in values):
+        raise ValueError(f"Filter '{name}' must be a string or a list of strings")
+    return sorted({v.strip() for v in values})
+
+
+def parse_filters(raw):
+    """
+    Validate the "filters" object of a /search request:
+      {"year_min": 2015, "year_max": 2020, "subjects": ["Agriculture"], "university": "...", "degree": "..."}
+    subjects/university/degree accept a string or a list (any of). Returns a canonical dict or None.
+    """
+    if raw is None or raw == {}:
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError("filters must be an object")
+    unknown = set(raw) - {"year_min", "year_max", "subjects", "university", "degree"}
+    if unknown:
+        raise ValueError(f"Unknown filter(s): {', '.join(sorted(unknown))}")
+    filters = {}
+    for name in ("year_min", "year_max"):
+        if raw.get(name) is not None:
+            year = raw[name]
+            if isinstance(year, str) and year.strip().isdigit():
+                year = int(year)
+            if not isinstance(year, int) or isinstance(year, bool):
+                raise ValueError(f"Filter '{name}' must be an integer year")
+            filters[name] = year
+    for name in ("subjects", "university", "degree"):
+        if raw.get(name):
+            filters[name] = _str_list(raw[name], name)
+    return filters or None
+
+
+def filters_key(filters):
+    # Hashable form for cache keys
+    return json.dumps(filters, sort_keys=True) if filters else None
+
+
+def build_where(filters):
+    """ChromaDB where clause for parsed filters (None when there is nothing to filter)."""
+    if not filters:
+        return None
+    clauses = []
+    if "year_min" in filters:
+        clauses.append({"year": {"$gte": filters["year_min"]}})
+    if "year_max" in filters:
+        clauses.append({"year": {"$lte": filters["year_max"]}})
+    if "subjects" in filters:
+        any_subject = [{subject_key(s): True} for s in filters["subjects"]]
+        clauses.append(any_subject[0] if len(any_subject) == 1 else {"$or": any_subject})
+    for name in ("university", "degree"):
+        if name in filters:
+            values = filters[name]
+            clauses.append({name: values[0]} if len(values) == 1 else {name: {"$in": values}})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+class FacetIndex:
+    """One record per indexed thesis: {file: {"year", "subjects", "university", "degree"}}."""
+
+    def __init__(self):
+        self.docs = {}
+        self._postings = {field: {} for field in FACET_FIELDS}  # field -> value -> set(files)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    @staticmethod
+    def record(meta):
+        # Document-level facet record from chunk / document metadata
+        return {
+            "year": normalize_year(meta.get("year", meta.get("publication_year"))),
+            "subjects": subject_list(meta.get("subject_list") or meta.get("subjects")),
+            "university": (meta.get("university") or "").strip(),
+            "degree": (meta.get("degree") or "").strip(),
+        }
+
+    def _values(self, record):
+        for field in FACET_FIELDS:
+            value = record.get(field)
+            for v in (value if isinstance(value, list) else [value]):
+                if v not in (None, ""):
+                    yield field, v
+
+    def _add(self, file_name, record):
+        self.docs[file_name] = record
+        for field, v in self._values(record):
+            self._postings[field].setdefault(v, set()).add(file_name)
+
+    def _remove(self, file_name):
+        record = self.docs.pop(file_name, None)
+        if record is None:
+            return
+        for field, v in self._values(record):
+            files = self._postings[field].get(v)
+            if files is not None:
+                files.discard(file_name)
+                if not files:
+                    del self._postings[field][v]
+
+    def upsert(self, file_name, meta):
+        record = self.record(meta)
+        with self._lock:
+            if self.docs.get(file_name) == record:
+                return
+            self._remove(file_name)
+            self._add(file_name, record)
+
+    def remove(self, file_name):
+        with self._lock:
+            self._remove(file_name)
+
+    def replace_all(self, docs):
+        """Rebuild from (file, metadata) pairs, e.g. DocumentStore.items()."""
+        records = {file_name: self.record(meta) for file_name, meta in docs}
+        with self._lock:
+            self.docs = {}
+            self._postings = {field: {} for field in FACET_FIELDS}
+            for file_name, record in records.items():
+                self._add(file_name, record)
+
+    def canonical(self, filters):
+        # Match subject / university / degree values case-insensitively against the indexed ones
+        if not filters:
+            return filters
+        out = dict(filters)
+        with self._lock:
+            for name, field in (("subjects", "subjects"), ("university", "university"), ("degree", "degree")):
+                if name in out:
+                    known = {v.lower(): v for v in self._postings[field]}
+                    out[name] = sorted({known.get(v.lower(), v) for v in out[name]})
+        return out
+
+    def _matching(self, filters, skip=None):
+        # Files matching every filter except those on field `skip`; None means all files
+        result = None
+        for name, field in (("year", "year"), ("subjects", "subjects"), ("university", "university"), ("degree", "degree")):
+            if field == skip:
+                continue
+            if name == "year":
+                if "year_min" not in filters and "year_max" not in filters:
+                    continue
+                low, high = filters.get("year_min", -10 ** 9), filters.get("year_max", 10 ** 9)
+                files = set()
+                for year, year_files in self._postings["year"].items():
+                    if low <= year <= high:
+                        files |= year_files
+            elif name in filters:
+                files = set()
+                for v in filters[name]:
+                    files |= self._postings[field].get(v, set())
+            else:
+                continue
+            result = files if result is None else result & files
+        return result
+
+    def matching_files(self, filters):
+        """Set of files matching the filters, or None when there are no filters."""
+        if not filters:
+            return None
+        with self._lock:
+            return self._matching(filters)
+
+    def counts(self, filters=None, limit=MAX_FACET_VALUES):
+        """
+        Facet counts in documents. Each field is counted over the documents matching all the
+        other filters, so the alternatives to a selected value stay visible.
+        """
+        filters = filters or {}
+        out = {}
+        with self._lock:
+            for field in FACET_FIELDS:
+                matching = self._matching(filters, skip=field) if filters else None
+                counts = {}
+                for v, files in self._postings[field].items():
+                    n = len(files) if matching is None else len(files & matching)
+                    if n:
+                        counts[v] = n
+                top = sorted(counts.items(), key=lambda kv: (-kv[1], str(kv[0])))[:limit]
+                if field == "year":
+                    top.sort(key=lambda kv: kv[0])
+                out[field] = [{"value": v, "count": n} for v, n in top]
+            total = self._matching(filters) if filters else None
+            out["total_documents"] = len(self.docs) if total is None else len(total)
+        return out
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+
+# Incremental indexing manifest (RAG/theses/indexed_files.json).
+# Each indexed .txt has an entry with its content hash, the stat info used to skip
+# hashing when nothing changed, a hash of its document metadata, the chunker version,
+# and the chunk ids it produced with a hash of each chunk's text and offsets:
+#   {"version": 2, "files": {txt_path: {"sha1", "size", "mtime", "chunker", "meta_sha1", "chunks": {id: sha1}}}}
+# Files chunked by another chunker version count as changed.
+# The original format ({txt_path: mtime}) is migrated on load.
+MANIFEST_VERSION = 2
+CHUNK_META_KEYS = ("chunk_idx", "char_start", "char_end")  # per-chunk, not document metadata
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def text_sha1(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _meta_sha1(meta):
+    doc_meta = {k: v for k, v in meta.items() if k not in CHUNK_META_KEYS}
+    return text_sha1(json.dumps(doc_meta, sort_keys=True, default=str))
+
+
+def _chunk_sha1(chunk, meta):
+    if "char_start" in meta:
+        return text_sha1(f"{meta['char_start']}:{meta['char_end']}:{chunk}")
+    return text_sha1(chunk)
+
+
+class IndexManifest:
+    def __init__(self, path, chunker=None):
+        self.path = path
+        self.chunker = chunker
+        self.files = {}
+        self._pending = {}
+        self.dirty = False  # files changed since load / the last save
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict) and data.get("version") == MANIFEST_VERSION:
+                self.files = data.get("files", {})
+            elif isinstance(data, dict):
+                # Old format: txt_path -> mtime. Without a hash every file is re-checked once.
+                self.files = {p: {"mtime": m} for p, m in data.items() if isinstance(m, (int, float))}
+
+    def scan(self, txt_paths):
+        """
+        Return [(txt_path, sha1, stat)] for files whose content changed since they were indexed.
+        Unchanged size+mtime skips hashing, so a run with no changes only stats each file.
+        Refreshing the stat info of touched-but-identical files marks the manifest dirty.
+        """
+        changed = []
+        for txt_path in txt_paths:
+            st = os.stat(txt_path)
+            entry = self.files.get(txt_path)
+            same_chunker = entry is not None and entry.get("chunker") == self.chunker
+            if same_chunker and entry.get("sha1") and entry.get("size") == st.st_size and entry.get("mtime") == st.st_mtime:
+                continue
+            digest = file_sha1(txt_path)
+            if same_chunker and entry.get("sha1") == digest:
+                # Touched but identical: just remember the new stat
+                entry["size"] = st.st_size
+                entry["mtime"] = st.st_mtime
+                self.dirty = True
+                continue
+            changed.append((txt_path, digest, st))
+        return changed
+
+    def removed(self, txt_paths):
+        # Indexed files that no longer exist on disk
+        present = set(txt_paths)
+        return [p for p in self.files if p not in present]
+
+    def begin(self, txt_path, digest, st):
+        self._pending[txt_path] = {"sha1": digest, "size": st.st_size, "mtime": st.st_mtime, "chunker": self.chunker}
+
+    def plan(self, txt_path, ids, chunks, metas, existing_ids=None):
+        """
+        Decide which chunks of a re-indexed file need work.
+        existing_ids() is called only for files indexed before chunk ids were tracked.
+        """
+        entry = self._pending.setdefault(txt_path, {})
+        old = self.files.get(txt_path) or {}
+        old_chunks = old.get("chunks")
+        new_chunks = {chunk_id: _chunk_sha1(chunk, meta) for chunk_id, chunk, meta in zip(ids, chunks, metas)}
+        meta_sha1 = _meta_sha1(metas[0]) if metas else ""
+        entry["meta_sha1"] = meta_sha1
+        entry["chunks"] = new_chunks
+        if old_chunks is None:
+            stale = set(existing_ids()) if existing_ids is not None else set()
+            return {"embed": range(len(ids)), "update": [], "delete": sorted(stale - set(new_chunks))}
+        embed = []
+        update = []
+        for i, chunk_id in enumerate(ids):
+            if old_chunks.get(chunk_id) != new_chunks[chunk_id]:
+                embed.append(i)
+            elif old.get("meta_sha1") != meta_sha1:
+                update.append(i)
+        delete = [chunk_id for chunk_id in old_chunks if chunk_id not in new_chunks]
+        return {"embed": embed, "update": update, "delete": delete}
+
+    def commit(self, txt_path):
+        # Called once the file's chunks are in the collection
+        entry = self._pending.pop(txt_path, None)
+        if entry is not None:
+            self.files[txt_path] = entry
+            self.dirty = True
+
+    def forget(self, txt_path):
+        # Drop a file and return the chunk ids it owned
+        entry = self.files.pop(txt_path, None)
+        if entry is None:
+            return []
+        self.dirty = True
+        return list(entry.get("chunks", {}))
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
@@ -0,0 +1,252 @@
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+
+# Staged ingestion: load -> chunk -> embed -> insert, connected by bounded queues.
+# Each stage runs in its own thread so file reading, chunking, MiniLM encoding and
+# ChromaDB writes overlap, while the queue bounds keep peak memory independent of corpus size.
+EMBED_BATCH_SIZE = 256      # chunks per model.encode call, gathered across documents
+INSERT_BATCH_SIZE = 2048    # chunks per collection.add call
+DOC_BATCH_SIZE = 64         # documents handed to load_docs at once (metadata is classified per batch)
+QUEUE_SIZE = 8              # max items waiting between two stages
+
+log = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _Stage(threading.Thread):
+    def __init__(self, name, target, errors, stop):
+        super().__init__(name=name, daemon=True)
+        self._target_fn = target
+        self._errors = errors
+        self._stop_event = stop
+
+    def run(self):
+        try:
+            self._target_fn()
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop_event.set()
+
+
+def _put(q, item, stop):
+    # Blocking put that gives up once another stage has failed
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.2)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    while True:
+        try:
+            return q.get(timeout=0.2)
+        except queue.Empty:
+            if stop.is_set():
+                return _DONE
+
+
+def run_ingest_pipeline(sources, load_docs, chunk_text, embed_texts, collection,
+                        on_document_done=None, plan_document=None, sparse_index=None, embed_batch_size=EMBED_BATCH_SIZE,
+                        insert_batch_size=INSERT_BATCH_SIZE, doc_batch_size=DOC_BATCH_SIZE,
+                        queue_size=QUEUE_SIZE, log_prefix="[INDEX]"):
+    """
+    Stream sources into collection.
+
+    load_docs(list_of_sources) -> list of dicts {"source", "id_prefix", "text", "meta"}
+    chunk_text(text) -> list of chunk strings, or of (chunk, char_start, char_end) tuples;
+    offsets are stored in the chunk metadata as char_start / char_end
+    embed_texts(list_of_chunks) -> 2D array of embeddings
+    on_document_done(source, n_chunks) is called once every chunk of a document has been inserted.
+    plan_document(source, ids, chunks, metas) -> {"embed": [idx], "update": [idx], "delete": [id]}
+    lets incremental indexing re-embed only changed chunks, refresh metadata of unchanged ones
+    and delete stale ids; without it every chunk is embedded.
+    Chunks are written with collection.upsert, so re-indexing a document replaces its old chunks.
+    Writes end on document boundaries: a search running next to the indexer sees a document's
+    chunks all at once (with its stale chunks deleted right after), never part of a document.
+    If sparse_index is given it receives the same upserts and deletes as the collection.
+    Returns a stats dict (documents, chunks, embedded, deleted, seconds, chunks_per_sec).
+    """
+    sources = list(sources)
+    stop = threading.Event()
+    errors = []
+    doc_q = queue.Queue(maxsize=queue_size)
+    chunk_q = queue.Queue(maxsize=queue_size)
+    insert_q = queue.Queue(maxsize=queue_size)
+
+    def load_stage():
+        for start in range(0, len(sources), doc_batch_size):
+            if stop.is_set():
+                return
+            for doc in load_docs(sources[start:start + doc_batch_size]):
+                if not _put(doc_q, doc, stop):
+                    return
+        _put(doc_q, _DONE, stop)
+
+    def chunk_stage():
+        while True:
+            doc = _get(doc_q, stop)
+            if doc is _DONE:
+                break
+            chunks = chunk_text(doc["text"])
+            spans = None
+            if chunks and isinstance(chunks[0], tuple):
+                spans = [(start, end) for _, start, end in chunks]
+                chunks = [chunk for chunk, _, _ in chunks]
+            ids = [f"{doc['id_prefix']}_chunk_{i}" for i in range(len(chunks))]
+            metas = []
+            for idx in range(len(chunks)):
+                meta_copy = dict(doc["meta"])
+                meta_copy["chunk_idx"] = idx
+                if spans is not None:
+                    meta_copy["char_start"], meta_copy["char_end"] = spans[idx]
+                metas.append(meta_copy)
+            if plan_document is None:
+                plan = {"embed": range(len(chunks)), "update": [], "delete": []}
+            else:
+                plan = plan_document(doc["source"], ids, chunks, metas)
+            embed_idx = list(plan.get("embed", []))
+            update_idx = list(plan.get("update", []))
+            done = {
+                "source": doc["source"],
+                "count": len(chunks),
+                "update_ids": [ids[i] for i in update_idx],
+                "update_metas": [metas[i] for i in update_idx],
+                "delete_ids": list(plan.get("delete", [])),
+            }
+            item = (done, [ids[i] for i in embed_idx], [chunks[i] for i in embed_idx], [metas[i] for i in embed_idx])
+            if not _put(chunk_q, item, stop):
+                return
+        _put(chunk_q, _DONE, stop)
+
+    def embed_stage():
+        # Gather chunks from consecutive documents into encode calls of embed_batch_size
+        ids, chunks, metas = [], [], []
+        doc_ends = []  # [done record, end offset of the document in the buffers]
+
+        def flush(n):
+            # A document is reported done with the batch that carries its last chunk;
+            # complete is where the chunks of the last done document end in this batch
+            done = [record for record, end in doc_ends if end <= n]
+            complete = doc_ends[len(done) - 1][1] if done else 0
+            del doc_ends[:len(done)]
+            for d in doc_ends:
+                d[1] -= n
+            embeddings = embed_texts(chunks[:n]) if n else []
+            item = (done, complete, ids[:n], chunks[:n], metas[:n], embeddings)
+            del ids[:n]
+            del chunks[:n]
+            del metas[:n]
+            return _put(insert_q, item, stop)
+
+        while True:
+            item = _get(chunk_q, stop)
+            if item is _DONE:
+                break
+            record, doc_ids, doc_chunks, doc_metas = item
+            ids.extend(doc_ids)
+            chunks.extend(doc_chunks)
+            metas.extend(doc_metas)
+            doc_ends.append([record, len(chunks)])
+            while len(chunks) >= embed_batch_size:
+                if not flush(embed_batch_size):
+                    return
+        if (chunks or doc_ends) and not flush(len(chunks)):
+            return
+        _put(insert_q, _DONE, stop)
+
+    stages = [
+        _Stage("ingest-load", load_stage, errors, stop),
+        _Stage("ingest-chunk", chunk_stage, errors, stop),
+        _Stage("ingest-embed", embed_stage, errors, stop),
+    ]
+    start_time = time.perf_counter()
+    for t in stages:
+        t.start()
+
+    # Insert stage runs in the calling thread: ChromaDB gets a single writer
+    n_docs = 0
+    n_chunks = 0
+    n_embedded = 0
+    n_deleted = 0
+    buf_ids, buf_chunks, buf_metas, buf_embs, buf_docs = [], [], [], [], []
+    n_complete = 0  # leading buffered chunks that belong to documents done embedding
+
+    def insert_flush(n):
+        # Write the first n buffered chunks (whole documents) and finish the documents done so far
+        nonlocal n_docs, n_chunks, n_embedded, n_deleted, n_complete
+        if n:
+            # One contiguous float32 block per write; no per-value Python floats
+            embeddings = np.concatenate(buf_embs).astype(np.float32, copy=False)
+            collection.upsert(
+                embeddings=embeddings[:n],
+                documents=buf_chunks[:n],
+                metadatas=buf_metas[:n],
+                ids=buf_ids[:n]
+            )
+            if sparse_index is not None:
+                sparse_index.upsert(buf_ids[:n], buf_chunks[:n])
+            buf_embs[:] = [embeddings[n:]] if n < len(embeddings) else []
+        n_embedded += n
+        for record in buf_docs:
+            if record["update_ids"]:
+                collection.update(ids=record["update_ids"], metadatas=record["update_metas"])
+            if record["delete_ids"]:
+                collection.delete(ids=record["delete_ids"])
+                if sparse_index is not None:
+                    sparse_index.delete(record["delete_ids"])
+                n_deleted += len(record["delete_ids"])
+            n_docs += 1
+            n_chunks += record["count"]
+            if on_document_done is not None:
+                on_document_done(record["source"], record["count"])
+        del buf_ids[:n]
+        del buf_chunks[:n]
+        del buf_metas[:n]
+        buf_docs.clear()
+        n_complete = 0
+
+    try:
+        while True:
+            item = _get(insert_q, stop)
+            if item is _DONE:
+                break
+            done_docs, complete, ids, chunks, metas, embeddings = item
+            if done_docs:
+                n_complete = len(buf_ids) + complete
+            buf_ids.extend(ids)
+            buf_chunks.extend(chunks)
+            buf_metas.extend(metas)
+            if len(embeddings):
+                buf_embs.append(np.asarray(embeddings, dtype=np.float32))
+            buf_docs.extend(done_docs)
+            # A document bigger than the batch stays buffered until its last chunk is embedded
+            if len(buf_ids) >= insert_batch_size and buf_docs:
+                insert_flush(n_complete)
+                log.info("%s %d documents / %d chunks embedded", log_prefix, n_docs, n_embedded)
+        if not errors:
+            insert_flush(len(buf_ids))
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+    for t in stages:
+        t.join()
+    if errors:
+        raise errors[0]
+
+    seconds = time.perf_counter() - start_time
+    return {
+        "documents": n_docs,
+        "chunks": n_chunks,
+        "embedded": n_embedded,
+        "deleted": n_deleted,
+        "seconds": round(seconds, 3),
+        "chunks_per_sec": round(n_embedded / seconds, 1) if seconds > 0 else 0.0,
+    }
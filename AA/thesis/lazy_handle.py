@@ -0,0 +1,44 @@
+import threading
+
+# Module-level handles (vector store, sparse index, document store) that open on first use
+# instead of at import: importing the RAG module stays cheap and creates no files, for CLI
+# tools, tests and extraction workers that never touch the index.
+
+
+class LazyHandle:
+    """
+    Stand-in for the object that factory() returns, created on first use. Attribute access
+    and len() go to that object; open() creates it explicitly. set_factory() swaps in another
+    factory (tests, tools) and drops the object opened so far.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._target = None
+        self._open_lock = threading.Lock()
+
+    def set_factory(self, factory):
+        with self._open_lock:
+            self.factory = factory
+            self._target = None
+
+    @property
+    def is_open(self):
+        return self._target is not None
+
+    def open(self):
+        target = self._target
+        if target is None:
+            with self._open_lock:
+                if self._target is None:
+                    self._target = self.factory()
+                target = self._target
+        return target
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.open(), name)
+
+    def __len__(self):
+        return len(self.open())
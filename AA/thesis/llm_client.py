@@ -0,0 +1,326 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+# Shared HTTP client for Gemini calls.
+#   - one pooled requests.Session per API key (keep-alive, no new TLS handshake per prompt)
+#   - connect/read timeouts on every call
+#   - jittered exponential backoff on 429/5xx and connection errors (Retry-After is honoured)
+#   - token-bucket rate limiter sized to the API quota (requests per minute)
+#   - circuit breaker: after repeated failures calls fail fast with LLMUnavailable for a while,
+#     so /search can fall back to an extractive overview instead of waiting on a dead upstream
+#   - latency / error counters for /health
+# GEMINI_API_BASE can point at mock_gemini.py for local testing.
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.0-flash")
+GEMINI_CONNECT_TIMEOUT = float(os.environ.get("GEMINI_CONNECT_TIMEOUT", "5"))
+GEMINI_READ_TIMEOUT = float(os.environ.get("GEMINI_READ_TIMEOUT", "60"))
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", "3"))
+GEMINI_BACKOFF_BASE = float(os.environ.get("GEMINI_BACKOFF_BASE", "0.5"))
+GEMINI_BACKOFF_MAX = float(os.environ.get("GEMINI_BACKOFF_MAX", "8"))
+GEMINI_RATE_PER_MINUTE = float(os.environ.get("GEMINI_RATE_PER_MINUTE", "15"))
+GEMINI_RATE_BURST = int(os.environ.get("GEMINI_RATE_BURST", "5"))
+GEMINI_RATE_WAIT = float(os.environ.get("GEMINI_RATE_WAIT", "10"))  # max seconds to wait for a token
+GEMINI_BREAKER_FAILURES = int(os.environ.get("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_RESET = float(os.environ.get("GEMINI_BREAKER_RESET", "30"))
+GEMINI_POOL_SIZE = int(os.environ.get("GEMINI_POOL_SIZE", "16"))
+
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+LATENCY_WINDOW = 1000
+
+
+class LLMUnavailable(Exception):
+    """
+    Gemini could not be reached (breaker open, rate limit wait exceeded, or retries used up)
+    or its reply held no answer.
+    """
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take one token, waiting up to timeout seconds; returns False if none became available."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return True
+                wait = (1.0 - self._tokens) / self.rate if self.rate > 0 else float("inf")
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or wait > remaining:
+                    return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_running = False
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                # Let exactly one trial call through
+                self._trial_running = True
+                return True
+            return False
+
+    def release(self):
+        # An allowed call was not attempted after all; let another trial through
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+
+class GeminiClient:
+    def __init__(self, api_key, api_base=GEMINI_API_BASE, model=GEMINI_MODEL,
+                 timeout=(GEMINI_CONNECT_TIMEOUT, GEMINI_READ_TIMEOUT), max_retries=GEMINI_MAX_RETRIES,
+                 rate_per_minute=GEMINI_RATE_PER_MINUTE, burst=GEMINI_RATE_BURST, rate_wait=GEMINI_RATE_WAIT,
+                 breaker_failures=GEMINI_BREAKER_FAILURES, breaker_reset=GEMINI_BREAKER_RESET,
+                 pool_size=GEMINI_POOL_SIZE):
+        self.api_key = api_key
+        self.api_base = api_base.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate_wait = rate_wait
+        # requests is imported with the first client, not when the server module is imported
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Content-Type": "application/json", "X-goog-api-key": api_key})
+        self.limiter = TokenBucket(rate_per_minute / 60.0, burst)
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self._metrics_lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.successes = 0
+        self.retries = 0
+        self.errors = {}
+
+    def _url(self, stream):
+        method = "streamGenerateContent?alt=sse" if stream else "generateContent"
+        return f"{self.api_base}/models/{self.model}:{method}"
+
+    @staticmethod
+    def _body(prompt_text, temperature, max_output_tokens):
+        return {
+            "contents": [{"parts": [{"text": prompt_text}]}],
+            "generationConfig": {"temperature": temperature, "maxOutputTokens": max_output_tokens},
+        }
+
+    def _count_error(self, kind):
+        with self._metrics_lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def _backoff(self, attempt, response=None):
+        delay = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * (2 ** attempt)))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, min(GEMINI_BACKOFF_MAX, float(retry_after)))
+            except ValueError:
+                pass
+        with self._metrics_lock:
+            self.retries += 1
+        time.sleep(delay)
+
+    def _post(self, prompt_text, stream, temperature, max_output_tokens):
+        # Returns an open response with a 2xx status; retries transient failures
+        import requests
+        if not self.breaker.allow():
+            self._count_error("circuit_open")
+            raise LLMUnavailable("Gemini circuit breaker is open")
+        if not self.limiter.acquire(timeout=self.rate_wait):
+            self.breaker.release()
+            self._count_error("rate_limited")
+            raise LLMUnavailable("Gemini rate limit: no request token available")
+        with self._metrics_lock:
+            self.calls += 1
+        body = self._body(prompt_text, temperature, max_output_tokens)
+        last_error = None
+        attempts = 0
+        for attempt in range(self.max_retries + 1):
+            # Every attempt, retries included, spends a token: retries count against the quota too
+            if attempt and not self.limiter.acquire(timeout=self.rate_wait):
+                self._count_error("rate_limited")
+                break
+            attempts += 1
+            response = None
+            try:
+                response = self.session.post(self._url(stream), json=body, stream=stream, timeout=self.timeout)
+            except requests.Timeout as e:
+                self._count_error("timeout")
+                last_error = e
+            except requests.RequestException as e:
+                self._count_error("connection")
+                last_error = e
+            else:
+                if response.status_code < 400:
+                    return response
+                if response.status_code not in RETRY_STATUS:
+                    # Bad request / auth errors will not get better by retrying
+                    self._count_error(f"http_{response.status_code}")
+                    self.breaker.record_success()
+                    try:
+                        response.raise_for_status()
+                    finally:
+                        response.close()
+                self._count_error(f"http_{response.status_code}")
+                last_error = requests.HTTPError(f"{response.status_code} from Gemini", response=response)
+                response.close()
+            if attempt < self.max_retries:
+                self._backoff(attempt, response)
+        self.breaker.record_failure()
+        raise LLMUnavailable(f"Gemini unavailable after {attempts} attempt(s): {last_error}")
+
+    def _record_latency(self, seconds):
+        with self._metrics_lock:
+            self.successes += 1
+            self._latencies.append(seconds)
+
+    def generate(self, prompt_text, temperature=0.3, max_output_tokens=1600):
+        """Return the answer text for a single prompt."""
+        start = time.perf_counter()
+        response = self._post(prompt_text, False, temperature, max_output_tokens)
+        try:
+            text = response.json()['candidates'][0]['content']['parts'][0]['text']
+        except ValueError as e:
+            self._count_error("bad_response")
+            self.breaker.record_failure()
+            raise LLMUnavailable(f"Gemini returned invalid JSON: {e}")
+        except (KeyError, IndexError, TypeError) as e:
+            # e.g. a candidate without content (blocked by a safety filter) or no candidates at all
+            self._count_error("bad_response")
+            self.breaker.record_failure()
+            raise LLMUnavailable(f"Gemini reply has no answer text (missing {e})")
+        self.breaker.record_success()
+        self._record_latency(time.perf_counter() - start)
+        return text
+
+    def stream_generate(self, prompt_text, temperature=0.3, max_output_tokens=1600):
+        """Yield answer text pieces from the streaming endpoint as they arrive."""
+        import requests
+        start = time.perf_counter()
+        response = self._post(prompt_text, True, temperature, max_output_tokens)
+        try:
+            # chunk_size=None hands over each HTTP chunk as it arrives instead of waiting for 512 bytes
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                # SSE: one JSON GenerateContentResponse per "data:" line
+                if not line or not line.startswith("data:"):
+                    continue
+                event = json.loads(line[len("data:"):])
+                candidates = event.get("candidates") or [{}]
+                parts = candidates[0].get("content", {}).get("parts", [])
+                yield "".join(p.get("text", "") for p in parts)
+        except GeneratorExit:
+            # Caller stopped reading (client disconnected); upstream itself was fine
+            self.breaker.record_success()
+            raise
+        except (requests.RequestException, ValueError) as e:
+            self._count_error("stream_broken")
+            self.breaker.record_failure()
+            raise LLMUnavailable(f"Gemini stream failed: {e}")
+        finally:
+            response.close()
+        self.breaker.record_success()
+        self._record_latency(time.perf_counter() - start)
+
+    def stats(self):
+        with self._metrics_lock:
+            latencies = sorted(self._latencies)
+            errors = dict(self.errors)
+            calls, successes, retries = self.calls, self.successes, self.retries
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3) if latencies else None
+
+        return {
+            "model": self.model,
+            "calls": calls,
+            "successes": successes,
+            "retries": retries,
+            "errors": errors,
+            "latency_p50": pct(0.50),
+            "latency_p95": pct(0.95),
+            "latency_max": round(latencies[-1], 3) if latencies else None,
+            "breaker_state": self.breaker.state,
+            "breaker_opened": self.breaker.opened,
+        }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_rate_share = 1  # processes splitting the quota (pre-fork workers each have their own limiter)
+
+
+def set_rate_share(processes):
+    """Give this process 1/processes of the Gemini quota; call in each of `processes` workers."""
+    global _rate_share
+    with _clients_lock:
+        _rate_share = max(1, int(processes))
+        _clients.clear()  # clients inherited over fork were sized for the whole quota
+
+
+def get_gemini_client(api_key):
+    # One pooled client (and one rate limiter / breaker) per API key for the whole process
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = _clients[api_key] = GeminiClient(
+                api_key, rate_per_minute=GEMINI_RATE_PER_MINUTE / _rate_share,
+                burst=max(1, GEMINI_RATE_BURST // _rate_share))
+        return client
+
+
+def llm_stats():
+    with _clients_lock:
+        clients = list(_clients.values())
+    return [client.stats() for client in clients]
@@ -0,0 +1,115 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Gemini generateContent / streamGenerateContent endpoints.
+# Start it and point the RAG server at it:
+#   python mock_gemini.py --port 8090
+#   GEMINI_API_BASE=http://localhost:8090/v1beta GEMINI_API_KEY=test python multi_thesis_rag.py
+# Every call answers with the same canned overview; streaming splits it into small SSE chunks.
+# Failures can be injected to exercise the client's retries, rate limiting and circuit breaker:
+#   fail_statuses - status codes returned (in order) by the next calls, e.g. [503, 429]
+#   error_rate    - probability that a call fails with 503
+#   hang          - seconds to sleep before answering (to trigger client timeouts)
+#   drop_after    - streamed chunks sent before the connection is dropped (a broken stream)
+#   blocked       - answer with a candidate that has no content (as when a safety filter blocks it)
+DEFAULT_ANSWER = (
+    "The studies agree that water temperature drives growth rates [2]. Feeding schedules matter as well [3][2].\n\n"
+    "Soil amendments raised yields in the field trials [1].\n\n"
+    "In summary, management practice explains most of the differences between sites.\n\n"
+    "[2][3][1]"
+)
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # chunked transfer, like the real endpoint
+    answer = DEFAULT_ANSWER
+    chunk_chars = 12
+    delay = 0.02  # seconds between streamed chunks
+    fail_statuses = []
+    error_rate = 0.0
+    hang = 0.0
+    drop_after = None
+    blocked = False
+    calls = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        json.loads(body or b"{}")
+        type(self).calls += 1
+        if self.hang:
+            time.sleep(self.hang)
+        status = self.fail_statuses.pop(0) if self.fail_statuses else None
+        if status is None and self.error_rate and random.random() < self.error_rate:
+            status = 503
+        if status is not None:
+            payload = json.dumps({"error": {"code": status, "message": "injected failure"}}).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        if ":streamGenerateContent" in self.path:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for n, i in enumerate(range(0, len(self.answer), self.chunk_chars)):
+                if self.drop_after is not None and n >= self.drop_after:
+                    # No terminating chunk: the client sees the response end prematurely
+                    self.close_connection = True
+                    return
+                event = {"candidates": [{"content": {"parts": [{"text": self.answer[i:i + self.chunk_chars]}]}}]}
+                self._write_chunk(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+                time.sleep(self.delay)
+            self.wfile.write(b"0\r\n\r\n")
+        elif ":generateContent" in self.path:
+            candidate = {"finishReason": "SAFETY"} if self.blocked else {"content": {"parts": [{"text": self.answer}]}}
+            payload = json.dumps({"candidates": [candidate]}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_gemini(port=0, handler_class=MockGeminiHandler):
+    """Serve the mock in a daemon thread; returns the server (its port is server.server_address[1])."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler_class)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Gemini API for local testing")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--delay", type=float, default=MockGeminiHandler.delay)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--hang", type=float, default=0.0)
+    parser.add_argument("--drop-after", type=int, default=None)
+    args = parser.parse_args()
+    MockGeminiHandler.delay = args.delay
+    MockGeminiHandler.error_rate = args.error_rate
+    MockGeminiHandler.hang = args.hang
+    MockGeminiHandler.drop_after = args.drop_after
+    httpd = ThreadingHTTPServer(("", args.port), MockGeminiHandler)
+    print(f"Mock Gemini listening on http://localhost:{args.port}/v1beta")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,117 +1,165 @@
-import dotenv
-dotenv.load_dotenv()
+try:
+    import dotenv
+except ImportError:  # python-dotenv is optional: settings can come from the environment alone
+    dotenv = None
+if dotenv is not None:
+    dotenv.load_dotenv()
 
 
-def recover_chromadb_from_index(pdf_folder, chunk_size=500):
+def recover_chromadb_from_index(pdf_folder, chunk_size=None):
     """
     If ChromaDB is empty but indexed_files.json exists, re-embed and re-index all PDFs listed in indexed_files.json.
     """
     indexed_path = os.path.join(pdf_folder, "indexed_files.json")
     if not os.path.exists(indexed_path):
-        print("[RECOVERY] No indexed_files.json found. Skipping ChromaDB recovery.")
+        log.info("[RECOVERY] No indexed_files.json found. Skipping ChromaDB recovery.")
         return 0
-    with open(indexed_path, "r", encoding="utf-8") as f:
-        indexed_files = json.load(f)
+    indexed_files = IndexManifest(indexed_path).files
     if not indexed_files:
-        print("[RECOVERY] indexed_files.json is empty. Skipping ChromaDB recovery.")
+        log.info("[RECOVERY] indexed_files.json is empty. Skipping ChromaDB recovery.")
         return 0
-    embedder = SentenceTransformer('all-MiniLM-L6-v2')
-    from extract_metadata import extract_thesis_metadata
-    recovered_chunks = 0
+    embedder = get_embedder()
+    txt_paths = []
     for txt_path in indexed_files:
         if not os.path.exists(txt_path):
-            print(f"[RECOVERY] Missing .txt for {txt_path}, skipping.")
+            log.warning("[RECOVERY] Missing .txt for %s, skipping.", txt_path)
             continue
-        with open(txt_path, "r", encoding="utf-8") as f:
-            text = f.read()
-        meta = extract_thesis_metadata(text)
-        meta["file"] = os.path.basename(txt_path)  # Use .txt as the source
-        meta["pdf"] = os.path.basename(txt_path)   # Use .txt as the 'pdf' reference
-        meta["chunk_idx"] = 0  # Will be set per chunk
-        # Ensure 'subjects' is always a string
-        if "subjects" in meta and isinstance(meta["subjects"], list):
-            meta["subjects"] = ", ".join(str(s) for s in meta["subjects"])
-        # Ensure 'university' is present
-        if "university" not in meta:
-            meta["university"] = ""
-        chunks = sentence_chunking(text, chunk_size=chunk_size)
-        chunk_embeddings = embed_chunks(chunks, embedder)
-        chunk_metadatas = []
-        for idx, chunk in enumerate(chunks):
-            meta_copy = dict(meta)
-            meta_copy["chunk_idx"] = idx
-            if "subjects" in meta_copy and isinstance(meta_copy["subjects"], list):
-                meta_copy["subjects"] = ", ".join(str(s) for s in meta_copy["subjects"])
-            for k, v in meta_copy.items():
-                if v is None:
-                    meta_copy[k] = ""
-            # Ensure 'university' is present in each chunk
-            if "university" not in meta_copy:
-                meta_copy["university"] = ""
-            chunk_metadatas.append(meta_copy)
-        ids = [f"{os.path.basename(txt_path)}_chunk_{i}" for i in range(len(chunks))]
-        collection.add(
-            embeddings=[list(map(float, emb)) for emb in chunk_embeddings],
-            documents=chunks,
-            metadatas=chunk_metadatas,
-            ids=ids
+        txt_paths.append(txt_path)
+
+    load_docs, document_done = _document_tracking_loader(lambda paths: _load_thesis_docs(paths, pdf_ref=True))
+
+    def on_document_done(txt_path, n_chunks):
+        document_done(txt_path)
+        log.info("[RECOVERY] Re-indexed %s with %d chunks.", os.path.basename(txt_path), n_chunks)
+
+    try:
+        stats = run_ingest_pipeline(
+            txt_paths,
+            load_docs=load_docs,
+            chunk_text=lambda text: sentence_chunking(text, chunk_size=chunk_size),
+            embed_texts=lambda chunks: embed_chunks(chunks, embedder, show_progress_bar=False),
+            collection=collection,
+            on_document_done=on_document_done,
+            sparse_index=sparse_index,
+            doc_batch_size=METADATA_BATCH_SIZE,
+            log_prefix="[RECOVERY]",
         )
-        recovered_chunks += len(chunks)
-        print(f"[RECOVERY] Re-indexed {os.path.basename(txt_path)} with {len(chunks)} chunks.")
-    print(f"[RECOVERY] Total recovered chunks: {recovered_chunks}")
+    finally:
+        if collection.dirty:
+            collection.save()
+        if sparse_index.dirty:
+            sparse_index.save()
+    recovered_chunks = stats["chunks"]
+    record_index_run(stats)
+    bump_index_version()
+    refresh_corpus_stats(pdf_folder, changed=True)
+    log.info("[RECOVERY] Total recovered chunks: %d", recovered_chunks)
     return recovered_chunks
-def embed_chunks(chunks, embedder):
+def embed_chunks(chunks, embedder, show_progress_bar=True, model_name=None):
     # Returns a numpy array of embeddings for all chunks
-    return np.array(embedder.encode(chunks, show_progress_bar=True, convert_to_numpy=True))
+    # Chunks embedded before (by any run) come from the on-disk embedding cache, which is kept
+    # per model: model_name defaults to the name embedder was loaded under by get_embedder()
+    model_name = model_name or embedder_name(embedder)
+    if model_name is None:
+        # No name to key the cache by: encode everything
+        return np.asarray(embedder.encode(list(chunks), convert_to_numpy=True, show_progress_bar=show_progress_bar),
+                          dtype=np.float32)
+    return encode_with_cache(embedder, chunks, model_name, show_progress_bar=show_progress_bar)
 
 
-def build_chromadb_index(chunks, chunk_embeddings, metadata):
-    # Insert data into ChromaDB
-    ids = [f"chunk_{i}" for i in range(len(chunks))]
-    metadatas = []
-    for m in metadata:
-        subjects_val = m.get("subjects", [])
-        if isinstance(subjects_val, list):
-            subjects_str = ", ".join(subjects_val)
-        else:
-            subjects_str = str(subjects_val)
-        metadatas.append({
-            "file": m.get("file", m.get("pdf", "")),  # Use .txt as the source if available
-            "title": m["title"],
-            "author": m["author"],
-            "publication_year": m["publication_year"],
-            "chunk_idx": m["chunk_idx"],
-            "degree": m.get("degree", "Thesis"),
-            "call_no": m.get("call_no", ""),
-            "subjects": subjects_str,
-            "abstract": m.get("abstract", ""),
-            "university": m.get("university", "")
-        })
-    collection.add(
-        embeddings=[list(map(float, emb)) for emb in chunk_embeddings],
-        documents=chunks,
-        metadatas=metadatas,
-        ids=ids
-    )
-    return collection
+def _flatten_chunk_meta(meta):
+    # Normalized filter fields first: int 'year' and the subj_<code> flags (see facet_index.py)
+    add_filter_fields(meta)
+    # Ensure 'subjects' is always a string (kept for display)
+    if "subjects" in meta and isinstance(meta["subjects"], list):
+        meta["subjects"] = ", ".join(str(s) for s in meta["subjects"])
+    # Replace None values with empty string for all metadata fields
+    for k, v in meta.items():
+        if v is None:
+            meta[k] = ""
+    # Ensure 'university' is present
+    if "university" not in meta:
+        meta["university"] = ""
+    return meta
 
 
-def search_chromadb(query, embedder, collection, top_n=10, distance_threshold=1.5):
-    query_emb = embedder.encode([query], convert_to_numpy=True)[0].tolist()
-    results = collection.query(
-        query_embeddings=[query_emb],
-        n_results=top_n,
-        include=["documents", "metadatas", "distances"]
-    )
-    out = []
-    print(f"\n[DEBUG] Top {top_n} results for query: '{query}'")
+def _load_thesis_docs(txt_paths, pdf_ref=False):
+    # Ingest-pipeline loader: read a batch of .txt files and classify their metadata in one pass
+    from extract_metadata import extract_thesis_metadata_batch
+    texts = []
+    for txt_path in txt_paths:
+        with open(txt_path, "r", encoding="utf-8") as f:
+            texts.append(f.read())
+    docs = []
+    for txt_path, text, meta in zip(txt_paths, texts, extract_thesis_metadata_batch(texts)):
+        name = os.path.basename(txt_path)
+        meta["file"] = name  # Use .txt as the source
+        if pdf_ref:
+            meta["pdf"] = name  # Use .txt as the 'pdf' reference
+        # Chunks carry only the compact fields; the rest is stored once in the document store
+        meta = _flatten_chunk_meta(meta)
+        docs.append({"source": txt_path, "id_prefix": name, "text": text, "meta": chunk_metadata(meta),
+                     "doc_meta": meta})
+    return docs
+
+
+def _document_tracking_loader(load_docs):
+    # Wrap an ingest loader: write each document's metadata to the document store as it is loaded
+    # (before any of its chunks can turn up in a search) and add it to the facet index once the
+    # pipeline reports the document done. Returns (load_docs, on_done(txt_path)).
+    pending = {}
+
+    def load(txt_paths):
+        docs = load_docs(txt_paths)
+        doc_store.upsert_many((os.path.basename(doc["source"]), doc["doc_meta"]) for doc in docs)
+        for doc in docs:
+            pending[doc["source"]] = doc["doc_meta"]
+        return docs
+
+    def on_done(txt_path):
+        meta = pending.pop(txt_path, None)
+        if meta is not None:
+            facet_index.upsert(os.path.basename(txt_path), meta)
+
+    return load, on_done
+
+
+def search_chromadb(query, embedder, collection, top_n=10, distance_threshold=1.5, filters=None):
+    return search_chromadb_batch([query], embedder, collection, top_n=top_n, distance_threshold=distance_threshold,
+                                 filters=filters)[0]
+
+
+def search_chromadb_batch(queries, embedder, collection, top_n=10, distance_threshold=1.5, filters=None):
+    # search_chromadb for many queries with one batched encode and one collection.query
+    results = hybrid_query_batch(queries, embedder, collection, n_results=top_n, filters=filters)
+    selected = [_select_unique_chunks(query, r, top_n, distance_threshold) for query, r in zip(queries, results)]
+    with stage("doc_join"):
+        doc_metas = doc_store.get_many(_chunk_file(c["meta"]) for chunks in selected for c in chunks)
+    return [[dict(c, meta=_with_document_meta(c["meta"], doc_metas)) for c in chunks] for chunks in selected]
+
+
+def _chunk_file(meta):
+    return meta.get("file") or meta.get("pdf")
+
+
+def _with_document_meta(chunk_meta, doc_metas):
+    # Chunk metadata joined with its document's (a new dict: chunk metas may be cached results)
+    return {**doc_metas.get(_chunk_file(chunk_meta), {}), **chunk_meta}
+
+
+def _select_unique_chunks(query, results, top_n, distance_threshold):
+    debug = log.isEnabledFor(logging.DEBUG)
+    if debug:
+        log.debug("Top %d results for query: %r", top_n, query)
     # Collect top chunks, ensuring top 5 unique txt files are represented
     seen_files = set()
     unique_chunks = []
     for i in range(len(results["documents"][0])):
         meta = results["metadatas"][0][i]
         score = float(results["distances"][0][i])
-        print(f"  Rank {i+1}: Score={score:.4f}, Title={meta.get('title','')}, Author={meta.get('author','')}, Year={meta.get('publication_year','')}")
+        if debug:
+            log.debug("  Rank %d: Score=%.4f, File=%s, Chunk=%s", i + 1, score,
+                      _chunk_file(meta), meta.get('chunk_idx', ''))
         # Only include if score is below threshold (Euclidean: lower is better)
         if score < distance_threshold:
             file_id = meta.get("file") or meta.get("pdf")
@@ -142,413 +190,1185 @@ def search_chromadb(query, embedder, collection, top_n=10, distance_threshold=1.
                 break
     return unique_chunks
 
-def sentence_chunking(text, chunk_size=500):
-    # Sliding window chunking with overlap
-    sentences = text.split('. ')
-    # Re-add the period lost in split
-    sentences = [s.strip() + ('' if s.strip().endswith('.') else '.') for s in sentences if s.strip()]
-    chunks = []
-    window = []
-    window_len = 0
-    overlap = int(chunk_size * 0.2)  # 20% overlap by word count
-    i = 0
-    while i < len(sentences):
-        window = []
-        window_len = 0
-        j = i
-        while j < len(sentences) and window_len < chunk_size:
-            sent = sentences[j]
-            sent_len = len(sent.split())
-            if window_len + sent_len > chunk_size and window:
-                break
-            window.append(sent)
-            window_len += sent_len
-            j += 1
-        if window:
-            chunks.append(' '.join(window))
-        # Move window forward by (chunk_size - overlap) words
-        if window_len == 0:
-            i += 1
-        else:
-            step = max(1, window_len - overlap)
-            # Find the index to start next window
-            words_seen = 0
-            for k in range(i, len(sentences)):
-                words_seen += len(sentences[k].split())
-                if words_seen >= step:
-                    i = k + 1
-                    break
-            else:
-                break
-    return chunks
-# Prompt chaining for multi-step reasoning with Gemini
-def prompt_chain(top_chunks, prompts, api_key):
-    # If no relevant chunks or all are unknown, return a 'no results' message
-    if not top_chunks or all(
-        not c['chunk'].strip() or (
+def sentence_chunking(text, chunk_size=None, overlap=None):
+    # Sliding sentence windows of at most chunk_size embedder tokens (default: the model's limit)
+    # with about `overlap` tokens shared between neighbours; returns [(chunk, char_start, char_end)]
+    count_tokens, max_tokens = model_token_counter()
+    return chunk_sentences(text, count_tokens, max_tokens=min(chunk_size or CHUNK_MAX_TOKENS or max_tokens, max_tokens),
+                           overlap_tokens=CHUNK_OVERLAP_TOKENS if overlap is None else overlap)
+
+
+# Bump when the prompt text or post-processing changes, so cached overviews are not reused
+PROMPT_VERSION = 1
+
+
+def _no_usable_chunks(top_chunks):
+    # True if there are no chunks, or none with text and known metadata
+    return not top_chunks or all(
+        not (c['chunk'] or '').strip() or (
             c['meta'].get('title', '').strip() in ('', '[Unknown Title]') and
             c['meta'].get('author', '').strip() in ('', '[Unknown Author]') and
             c['meta'].get('publication_year', '').strip() in ('', '[Unknown Year]')
-        ) for c in top_chunks):
+        ) for c in top_chunks)
+
+
+# Instructions appended to the first prompt of a chain
+OVERVIEW_INSTRUCTIONS = (
+    "Synthesize the findings from the top 5 relevant theses in response to the following question. "
+    "Group your answer by key themes or outcomes relevant to the question. "
+    "Write in plain text, paragraph style, without bullet points, asterisks, or markdown formatting. "
+    "At the end of each paragraph, place in square brackets the number(s) of the most relevant thesis or theses (from the list above) that support the information in that paragraph, e.g., [1] or [2][3]. "
+    "Do not place references anywhere else. Do not default to [1] for every paragraph—use the correct number(s) for each paragraph based on the supporting evidence. "
+    "You must reference all top 5 unique theses at least once in your answer, distributing them across the overview. If a thesis is not referenced, add it to a relevant paragraph. "
+    "Conclude with a summary paragraph that synthesizes the findings. After the summary, concatenate all referenced thesis numbers in square brackets (e.g., [1][2][3][4][5]), with no explanatory sentence or line break. "
+    "Highlight relationships, causal links, and actionable insights. "
+)
+
+
+# Prompt chaining for multi-step reasoning with Gemini
+def prompt_chain(top_chunks, prompts, api_key):
+    # If no relevant chunks or all are unknown, return a 'no results' message
+    if _no_usable_chunks(top_chunks):
         return 'No results found for your query.'
-    context = ""
+    sources = SourceContext(top_chunks)
+    client = get_gemini_client(api_key)
+    context = sources.render() + OVERVIEW_INSTRUCTIONS
     answer = ""
     for idx, prompt_text in enumerate(prompts):
-        # For first prompt, build context from top_chunks
-        if idx == 0:
-            # Build metadata summary with numbering, only unique PDFs in order
-            doc_infos = []
-            seen_pdfs = []
-            pdf_to_number = {}
-            for i, c in enumerate(top_chunks):
-                meta = c['meta']
-                pdf_id = meta.get('pdf', meta.get('file', '[Unknown]'))
-                if pdf_id not in seen_pdfs:
-                    seen_pdfs.append(pdf_id)
-                    pdf_to_number[pdf_id] = len(seen_pdfs)
-                    doc_infos.append(f"[{len(seen_pdfs)}] Title: {meta.get('title','') or '[Unknown]'}\n    Author: {meta.get('author','') or '[Unknown]'}\n    Year: {meta.get('publication_year','') or '[Unknown]'}\n    File: {pdf_id}")
-                if len(doc_infos) >= 10:
-                    break
-            doc_info_str = "Top 10 relevant documents found (numbered for reference):\n" + "\n".join(doc_infos) + "\n\n"
-            # Only include chunks from the top unique PDFs, in order
-            chunk_context = "\n\n".join([
-                f"[{pdf_to_number[c['meta'].get('pdf', c['meta'].get('file', '[Unknown]'))]}] From {c['meta'].get('pdf', c['meta'].get('file', '[Unknown]'))} (chunk {c['meta']['chunk_idx']}): {c['chunk']}"
-                for c in top_chunks if c['meta'].get('pdf', c['meta'].get('file', '[Unknown]')) in pdf_to_number
-            ])
-            context = f"{doc_info_str}Context: {chunk_context}\n\nWhen answering, please reference the relevant thesis by its number in square brackets, e.g., [1], [2], etc., to indicate the source of each point.\n\n"
-            context += (
-                "Synthesize the findings from the top 5 relevant theses in response to the following question. "
-                "Group your answer by key themes or outcomes relevant to the question. "
-                "Write in plain text, paragraph style, without bullet points, asterisks, or markdown formatting. "
-                "At the end of each paragraph, place in square brackets the number(s) of the most relevant thesis or theses (from the list above) that support the information in that paragraph, e.g., [1] or [2][3]. "
-                "Do not place references anywhere else. Do not default to [1] for every paragraph—use the correct number(s) for each paragraph based on the supporting evidence. "
-                "You must reference all top 5 unique theses at least once in your answer, distributing them across the overview. If a thesis is not referenced, add it to a relevant paragraph. "
-                "Conclude with a summary paragraph that synthesizes the findings. After the summary, concatenate all referenced thesis numbers in square brackets (e.g., [1][2][3][4][5]), with no explanatory sentence or line break. "
-                "Highlight relationships, causal links, and actionable insights. "
-            )
-        # Build prompt for Gemini
         full_prompt = f"{context}Question: {prompt_text}\nAnswer: "
-        url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
-        headers = {
-            "Content-Type": "application/json",
-            "X-goog-api-key": api_key
-        }
-        data = {
-            "contents": [
-                {
-                    "parts": [
-                        {"text": full_prompt}
-                    ]
-                }
-            ],
-            "generationConfig": {
-                "temperature": 0.3,
-                "maxOutputTokens": 1600
-            }
-        }
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        result = response.json()
-        raw_answer = result['candidates'][0]['content']['parts'][0]['text'].strip()
-        import re
-        # --- Rearrangement logic ---
-        ref_pattern = re.compile(r'\[(\d+)\]')
-        # Find order of first appearance of each reference in Gemini output
-        paragraphs = re.split(r'\n\s*\n', raw_answer)
-        ref_order = []
-        for para in paragraphs:
-            for ref in ref_pattern.findall(para):
-                if ref not in ref_order:
-                    ref_order.append(ref)
-        # Map old number to new number based on first appearance
-        # Only consider numbers that are in allowed range
-        allowed_numbers = [str(n) for n in range(1, len(seen_pdfs)+1)]
-        ref_order = [r for r in ref_order if r in allowed_numbers]
-        # If fewer than 5, fill in with missing numbers in original order
-        for n in allowed_numbers:
-            if n not in ref_order:
-                ref_order.append(n)
-        # Build mapping: old_num -> new_num
-        old_to_new = {old: str(i+1) for i, old in enumerate(ref_order)}
-        # Rearrange seen_pdfs and doc_infos to match new order
-        seen_pdfs_new = [seen_pdfs[int(old)-1] for old in ref_order]
-        doc_infos_new = []
-        for i, pdf_id in enumerate(seen_pdfs_new):
-            meta = None
-            for c in top_chunks:
-                meta_c = c['meta']
-                pdf_id_c = meta_c.get('pdf', meta_c.get('file', '[Unknown]'))
-                if pdf_id_c == pdf_id:
-                    meta = meta_c
-                    break
-            doc_infos_new.append(f"[{i+1}] Title: {meta.get('title','') or '[Unknown]'}\n    Author: {meta.get('author','') or '[Unknown]'}\n    Year: {meta.get('publication_year','') or '[Unknown]'}\n    File: {pdf_id}")
-        doc_info_str_new = "Top 10 relevant documents found (numbered for reference):\n" + "\n".join(doc_infos_new) + "\n\n"
-        # Update chunk_context as well
-        pdf_to_number_new = {pdf_id: i+1 for i, pdf_id in enumerate(seen_pdfs_new)}
-        chunk_context_new = "\n\n".join([
-            f"[{pdf_to_number_new[c['meta'].get('pdf', c['meta'].get('file', '[Unknown]'))]}] From {c['meta'].get('pdf', c['meta'].get('file', '[Unknown]'))} (chunk {c['meta']['chunk_idx']}): {c['chunk']}"
-            for c in top_chunks if c['meta'].get('pdf', c['meta'].get('file', '[Unknown]')) in pdf_to_number_new
-        ])
-        # Replace all references in raw_answer according to old_to_new
-        def replace_refs(text):
-            return ref_pattern.sub(lambda m: f"[{old_to_new.get(m.group(1), m.group(1))}]", text)
-        raw_answer_new = replace_refs(raw_answer)
-        # Post-process: move all references to end of each paragraph (as before)
-        def process_paragraphs(text):
-            allowed_numbers_new = set(str(n) for n in range(1, len(seen_pdfs_new)+1))
-            paragraphs = re.split(r'\n\s*\n', text)
-            ref_pattern2 = re.compile(r'\[(\d+)\]')
-            processed = []
-            assigned_refs = []
-            # Remove trailing reference-only paragraph if present
-            if paragraphs and ref_pattern2.findall(paragraphs[-1]) and not re.search(r'[a-zA-Z]', paragraphs[-1]):
-                paragraphs = paragraphs[:-1]
-
-            n_body = max(1, len(paragraphs)-1)  # Exclude summary
-            for i, para in enumerate(paragraphs):
-                refs = [r for r in ref_pattern2.findall(para) if r in allowed_numbers_new]
-                # Only keep up to 2 unique references per paragraph
-                unique_refs = []
-                for r in refs:
-                    if r not in unique_refs:
-                        unique_refs.append(r)
-                    if len(unique_refs) == 2:
-                        break
-                para_clean = ref_pattern2.sub('', para).strip()
-                para_clean = re.sub(r'\s+\.$', '.', para_clean)
-                if i < n_body and unique_refs:
-                    for r in unique_refs:
-                        para_clean += f'[{r}]'
-                        assigned_refs.append(r)
-                processed.append(para_clean)
-            # For the last paragraph (summary), append only unique refs actually assigned to body paragraphs
-            if processed:
-                summary_refs = []
-                for r in assigned_refs:
-                    if r not in summary_refs:
-                        summary_refs.append(r)
-                processed[-1] = re.sub(r'\s+\.$', '.', processed[-1])
-                end_refs = re.findall(r'(\[\d+\])', processed[-1].split('.')[-1])
-                end_refs_set = set([ref.strip('[]') for ref in end_refs])
-                for r in summary_refs:
-                    if r not in end_refs_set:
-                        processed[-1] += f'[{r}]'
-            return '\n\n'.join(processed)
-        answer = process_paragraphs(raw_answer_new)
-        # Update context for next step (with new doc_info_str and chunk_context)
-        context = f"{doc_info_str_new}Context: {chunk_context_new}\n\nWhen answering, please reference the relevant thesis by its number in square brackets, e.g., [1], [2], etc., to indicate the source of each point.\n\n{answer}\n\n"
+        with stage("gemini"):
+            raw_answer = client.generate(full_prompt).strip()
+        # Renumber references by first appearance and move them to the paragraph ends
+        with stage("postprocess"):
+            answer, ref_order = renumber_answer(raw_answer, len(sources))
+        if idx + 1 < len(prompts):
+            # Next step sees the sources in the new numbering, followed by this answer
+            sources.reorder(ref_order)
+            context = f"{sources.render()}{answer}\n\n"
     return answer
 
 
+def stream_overview(top_chunks, question, api_key):
+    """
+    Single-prompt prompt_chain over Gemini's streaming endpoint.
+    Yields ("paragraph", text) as soon as each paragraph is final (references already renumbered)
+    and then ("done", {"overview", "references"}), where references[n-1] is the file of source [n].
+    """
+    if _no_usable_chunks(top_chunks):
+        yield ("paragraph", 'No results found for your query.')
+        yield ("done", {"overview": 'No results found for your query.', "references": []})
+        return
+    sources = SourceContext(top_chunks)
+    context = sources.render() + OVERVIEW_INSTRUCTIONS
+    renumberer = CitationRenumberer(len(sources))
+    paragraphs = []
+    # Time spent waiting on Gemini and renumbering, excluding the time the caller spends sending
+    gemini_seconds = post_seconds = 0.0
+    pieces = get_gemini_client(api_key).stream_generate(f"{context}Question: {question}\nAnswer: ")
+    try:
+        while True:
+            start = time.perf_counter()
+            text = next(pieces, None)
+            gemini_seconds += time.perf_counter() - start
+            if text is None:
+                break
+            start = time.perf_counter()
+            finished = renumberer.feed(text)
+            post_seconds += time.perf_counter() - start
+            for para in finished:
+                paragraphs.append(para)
+                yield ("paragraph", para)
+        start = time.perf_counter()
+        finished = renumberer.finish()
+        sources.reorder(renumberer.ref_order())
+        post_seconds += time.perf_counter() - start
+    finally:
+        pieces.close()
+        observe_stage("gemini", gemini_seconds)
+        observe_stage("postprocess", post_seconds)
+    for para in finished:
+        paragraphs.append(para)
+        yield ("paragraph", para)
+    references = list(sources.sources)
+    yield ("done", {"overview": '\n\n'.join(paragraphs), "references": references})
+
+
 import os
 import glob
 import re
-import requests
 import json
+import contextvars
+import logging
 import numpy as np
-from PyPDF2 import PdfReader
-from sentence_transformers import SentenceTransformer
-from rank_bm25 import BM25Okapi
+from embedder_registry import get_embedder, embedder_name, embedder_stats
+from embedding_cache import encode_with_cache
+from ingest_pipeline import run_ingest_pipeline
+from index_manifest import CHUNK_META_KEYS, IndexManifest
+from pdf_extraction import (extract_pdfs_parallel, load_retry_list, save_retry_list,
+                            MAX_EXTRACT_ATTEMPTS, RETRY_LIST_NAME)
+from sparse_index import SparseIndex, tokenize
+from chunking import (chunk_sentences, model_token_counter, CHUNKER_VERSION, CHUNK_MAX_TOKENS,
+                      CHUNK_OVERLAP_TOKENS)
+from citations import CitationRenumberer, SourceContext, renumber_answer
+from llm_client import get_gemini_client, llm_stats, set_rate_share, LLMUnavailable
+from query_cache import (query_embeddings, retrieval_results, overviews, normalize_question,
+                         index_version, bump_index_version, cache_stats)
+from concurrent.futures import ThreadPoolExecutor
+from corpus_stats import corpus_stats
+from facet_index import FacetIndex, add_filter_fields, build_where, filters_key, parse_filters
+from vector_store import VECTOR_BACKEND, LazyVectorStore, open_vector_store
+from lazy_handle import LazyHandle
+from doc_store import DOC_STORE_VERSION, DocumentStore, chunk_metadata, is_chunk_field
+from metrics import (CallbackMetric, ERRORS, INDEX_CHUNKS, INDEX_CHUNKS_PER_SEC, INDEX_RUNS, IN_FLIGHT,
+                     REQUESTS, REQUEST_SECONDS, configure_logging, end_trace, observe_stage, render_metrics,
+                     stage, start_trace)
 
+log = logging.getLogger("multi_thesis_rag")
+LOG_LEVEL = os.environ.get("RAG_LOG_LEVEL", "INFO").upper()
 
-# ChromaDB setup
-import chromadb
-import os
+# Number of theses read and metadata-classified per ingest-pipeline batch
+METADATA_BATCH_SIZE = 64
+
+
+# Vector store setup: ChromaDB, or the in-process ANN index (RAG_VECTOR_BACKEND=local, see vector_store.py)
 chromadb_persist_dir = os.path.abspath("RAG/chromadb_data")
-print(f"[DEBUG] ChromaDB persistent directory (absolute): {chromadb_persist_dir}")
-# Use PersistentClient API for ChromaDB >=1.1.0
-chroma_client = chromadb.PersistentClient(path="RAG/chromadb_data")
+VECTOR_STORE_DIR = os.path.join("RAG", "vector_store")
 COLLECTION_NAME = "thesis_chunks"
-collection = chroma_client.get_or_create_collection(COLLECTION_NAME)
+log.debug("Vector backend: %s (ChromaDB directory %s)", VECTOR_BACKEND, chromadb_persist_dir)
 
 
-# 1. Extract and chunk text from all PDFs in a folder
-def extract_and_chunk_pdfs(pdf_folder, chunk_size=500):
-    # Load or create persistent index of already-processed files
-    indexed_path = os.path.join(pdf_folder, "indexed_files.json")
-    if os.path.exists(indexed_path):
-        with open(indexed_path, "r", encoding="utf-8") as f:
-            indexed_files = json.load(f)
+def default_vector_store():
+    return open_vector_store(VECTOR_BACKEND, chroma_path="RAG/chromadb_data", local_path=VECTOR_STORE_DIR,
+                             collection_name=COLLECTION_NAME)
+
+
+# Opened on first use, not at import; set_vector_store_factory() injects another store
+collection = LazyVectorStore(default_vector_store)
+
+
+def set_vector_store_factory(factory):
+    collection.set_factory(factory)
+
+# Lexical (BM25) index over the same chunks, maintained by the indexer (see sparse_index.py)
+SPARSE_INDEX_DIR = os.path.join("RAG", "cache", "bm25")
+
+
+def default_sparse_index():
+    return SparseIndex.load(SPARSE_INDEX_DIR)
+
+
+# Document-level metadata (title, author, abstract, ...), one row per thesis (see doc_store.py)
+DOC_STORE_PATH = os.path.join("RAG", "documents.db")
+
+
+def default_document_store():
+    return DocumentStore(DOC_STORE_PATH)
+
+
+# Both are loaded on first use like the vector store: importing this module creates no files
+sparse_index = LazyHandle(default_sparse_index)
+doc_store = LazyHandle(default_document_store)
+
+# Document-level year / subject / university / degree index for facet counts and filtered BM25,
+# built from the document store by sync_document_store()
+facet_index = FacetIndex()
+
+# Hybrid retrieval settings: dense and lexical rankings are merged with reciprocal-rank fusion
+HYBRID_ENABLED = os.environ.get("RAG_HYBRID", "1") != "0"
+RRF_K = 60
+HYBRID_DENSE_WEIGHT = float(os.environ.get("RAG_HYBRID_DENSE_WEIGHT", "1.0"))
+HYBRID_SPARSE_WEIGHT = float(os.environ.get("RAG_HYBRID_SPARSE_WEIGHT", "1.0"))
+_retrieval_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("RAG_RETRIEVAL_THREADS", "4")),
+                                     thread_name_prefix="rag-retrieval")
+
+# /search/batch limits: questions per request, and overviews generated at the same time per request
+BATCH_MAX_QUESTIONS = int(os.environ.get("RAG_BATCH_MAX_QUESTIONS", "256"))
+BATCH_OVERVIEW_CONCURRENCY = int(os.environ.get("RAG_BATCH_OVERVIEW_CONCURRENCY", "4"))
+
+
+def sync_sparse_index(page_size=5000):
+    # Rebuild the BM25 index from ChromaDB when it is missing or out of step with the collection
+    total = collection.count()
+    if len(sparse_index) == total:
+        return
+    log.info("Rebuilding sparse index (%d vs %d chunks in ChromaDB)...", len(sparse_index), total)
+    sparse_index.delete(list(sparse_index.doc_ids))
+    for offset in range(0, total, page_size):
+        page = collection.get(include=["documents"], limit=page_size, offset=offset)
+        sparse_index.upsert(page["ids"], page["documents"])
+    sparse_index.save()
+    bump_index_version()
+    corpus_stats.update(sparse_chunks=len(sparse_index))
+    log.info("Sparse index rebuilt with %d chunks", len(sparse_index))
+
+
+def sync_document_store(pdf_folder, page_size=5000):
+    """
+    Bring the document store in step with the collection and the manifest, then rebuild the
+    facet index from it. Collections indexed before the store existed carry the whole document
+    metadata on every chunk: it is moved to the store and the chunks are slimmed down once.
+    Indexed theses missing from the store (e.g. documents.db was deleted) get their metadata
+    classified again from the .txt files; nothing is re-embedded.
+    """
+    total = collection.count()
+    if total and doc_store.get_info("chunk_schema") != str(DOC_STORE_VERSION):
+        _move_document_metadata(total, page_size)
+    doc_store.set_info("chunk_schema", DOC_STORE_VERSION)
+    known = set(doc_store.ids())
+    manifest = IndexManifest(os.path.join(pdf_folder, "indexed_files.json"))
+    missing = [p for p in manifest.files if os.path.basename(p) not in known and os.path.exists(p)]
+    if missing:
+        log.info("Reading metadata of %d indexed theses missing from the document store...", len(missing))
+        for i in range(0, len(missing), METADATA_BATCH_SIZE):
+            docs = _load_thesis_docs(missing[i:i + METADATA_BATCH_SIZE])
+            doc_store.upsert_many((os.path.basename(doc["source"]), doc["doc_meta"]) for doc in docs)
+    facet_index.replace_all(doc_store.items())
+    log.info("Document store: %d documents", len(facet_index))
+
+
+def _move_document_metadata(total, page_size):
+    # One-time migration: document fields go to the store, chunks keep CHUNK_FIELDS and get a
+    # subj_<code> flag per subject in place of the subject_list array (schema 1)
+    # (ChromaDB's update deletes a metadata key whose new value is None)
+    log.info("Moving document metadata of %d chunks to the document store...", total)
+    known = set(doc_store.ids())
+    documents = {}
+    slimmed = 0
+    for offset in range(0, total, page_size):
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        update_ids, update_metas = [], []
+        for chunk_id, meta in zip(page["ids"], page["metadatas"]):
+            if not meta or all(is_chunk_field(k) for k in meta):
+                continue
+            full = add_filter_fields(dict(meta))
+            file_name = _chunk_file(full)
+            has_document = any(not is_chunk_field(k) and k != "subject_list" for k in meta)
+            if has_document and file_name and file_name not in known and file_name not in documents:
+                documents[file_name] = {k: v for k, v in full.items() if k not in CHUNK_META_KEYS}
+            update_ids.append(chunk_id)
+            update_metas.append({**{k: None for k in meta}, **chunk_metadata(full)})
+        if update_ids:
+            collection.update(ids=update_ids, metadatas=update_metas)
+            slimmed += len(update_ids)
+    doc_store.upsert_many(documents.items())
+    if collection.dirty:
+        collection.save()
+    if slimmed:
+        bump_index_version()
+    log.info("Moved metadata of %d documents; %d chunks slimmed", len(documents), slimmed)
+
+
+def hybrid_query(question, embedder, collection, n_results=50, filters=None):
+    """
+    Retrieve n_results chunks for question, in collection.query's result layout.
+    Lexical BM25 search runs in parallel with the embedding + vector query; the two rankings
+    are fused with weighted reciprocal-rank fusion. Every returned chunk carries its vector
+    distance, so callers keep applying the same distance threshold.
+    filters (see facet_index.parse_filters) restrict both searches before ranking.
+    """
+    return hybrid_query_batch([question], embedder, collection, n_results=n_results, filters=filters)[0]
+
+
+def hybrid_query_batch(questions, embedder, collection, n_results=50, filters=None):
+    """
+    hybrid_query for many questions: one batched encode and one multi-vector collection.query
+    for all questions not in the retrieval cache. Returns one result set per question, in order.
+    """
+    # Results are cached per index version, embedding model and store; callers must treat them
+    # as read-only. An embedder or store without a stable identity is not cached.
+    version = index_version()
+    filter_key = filters_key(filters)
+    model_name = embedder_name(embedder)
+    store_key = getattr(collection, "cache_key", None)
+    cacheable = model_name is not None and store_key is not None
+    out = [None] * len(questions)
+    todo = {}  # cache key -> positions of the questions that need it
+    for pos, question in enumerate(questions):
+        cache_key = (normalize_question(question), n_results, HYBRID_ENABLED, filter_key, version, model_name,
+                     store_key)
+        cached = retrieval_results.get(cache_key) if cacheable else None
+        if cached is not None:
+            out[pos] = cached
+        else:
+            todo.setdefault(cache_key, []).append(pos)
+    if not todo:
+        return out
+    keys = list(todo)
+    pending = [questions[todo[key][0]] for key in keys]
+    # Filters run inside both searches: a where clause for ChromaDB, an allowed-file set for BM25
+    where = build_where(filters)
+    allow = None
+    if filters:
+        allowed_files = facet_index.matching_files(filters)
+        # Chunk ids are "<file>_chunk_<n>" (ingest_pipeline), the only id scheme in the index
+        allow = lambda chunk_id: chunk_id.rsplit("_chunk_", 1)[0] in allowed_files  # noqa: E731
+    lexical_futures = None
+    if HYBRID_ENABLED and len(sparse_index):
+        lexical_futures = [_retrieval_pool.submit(sparse_index.search, q, n_results, allow) for q in pending]
+    with stage("embed"):
+        query_embs = embed_queries(pending, embedder)
+    with stage("vector_query"):
+        dense = collection.query(
+            query_embeddings=query_embs,
+            n_results=n_results,
+            where=where,
+            include=["documents", "metadatas", "distances"]
+        )
+    dense = _drop_missing_documents(dense)
+    if lexical_futures is None:
+        results = [{field: [dense[field][i]] for field in ("ids", "documents", "metadatas", "distances")}
+                   for i in range(len(pending))]
     else:
-        indexed_files = {}
+        with stage("lexical_wait"):
+            lexical = [f.result() for f in lexical_futures]
+        with stage("fusion"):
+            results = _fuse_rankings(dense, lexical, query_embs, collection, n_results)
+    for key, result in zip(keys, results):
+        if cacheable:
+            retrieval_results.put(key, result)
+        for pos in todo[key]:
+            out[pos] = result
+    return out
 
-    pdf_files = glob.glob(os.path.join(pdf_folder, '*.pdf'))
-    txt_files = [os.path.splitext(p)[0] + ".txt" for p in pdf_files if os.path.exists(os.path.splitext(p)[0] + ".txt")]
-    print(f"[DEBUG] ChromaDB persistent directory: {os.path.abspath('./chromadb_data')}")
-    print(f"[DEBUG] indexed_files.json path: {os.path.abspath(os.path.join(pdf_folder, 'indexed_files.json'))}")
-    print(f"[DEBUG] ChromaDB collection count before indexing: {collection.count()}")
-    # Only index files that are new or updated
-    to_index = []
-    for pdf_path, txt_path in zip(pdf_files, txt_files):
-        mtime = os.path.getmtime(txt_path)
-        if txt_path not in indexed_files or indexed_files[txt_path] != mtime:
-            to_index.append((pdf_path, txt_path, mtime))
-
-    if not to_index:
-        print("[DEBUG] No new or changed PDFs to index. Skipping embedding and appending.")
-    import pytesseract
-    from pdf2image import convert_from_path
-    import importlib.util
-    from extract_metadata import extract_thesis_metadata
 
+def _drop_missing_documents(results):
+    # Hits whose chunk row is gone (a store the indexer changed under an older index) are skipped
+    if all(doc is not None for docs in results["documents"] for doc in docs):
+        return results
+    fields = ("ids", "documents", "metadatas", "distances")
+    out = {field: [] for field in fields}
+    for i, docs in enumerate(results["documents"]):
+        keep = [j for j, doc in enumerate(docs) if doc is not None]
+        for field in fields:
+            out[field].append([results[field][i][j] for j in keep])
+    return out
+
+
+def _fuse_rankings(dense, lexical, query_embs, collection, n_results):
+    # Weighted reciprocal-rank fusion of each question's dense and lexical rankings
+    rows = {}
+    orders = []
+    for i, ranking in enumerate(lexical):
+        fused = {}
+        for rank, chunk_id in enumerate(dense["ids"][i]):
+            rows[chunk_id] = (dense["documents"][i][rank], dense["metadatas"][i][rank])
+            fused[chunk_id] = HYBRID_DENSE_WEIGHT / (RRF_K + rank + 1)
+        for rank, (chunk_id, _) in enumerate(ranking):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + HYBRID_SPARSE_WEIGHT / (RRF_K + rank + 1)
+        orders.append(sorted(fused, key=fused.get, reverse=True)[:n_results])
+
+    # Lexical-only hits of all questions are fetched together; their distance is the same
+    # squared L2 ChromaDB reports, computed against each question's own embedding
+    dense_distances = [dict(zip(dense["ids"][i], dense["distances"][i])) for i in range(len(orders))]
+    missing = {chunk_id for order, known in zip(orders, dense_distances) for chunk_id in order if chunk_id not in known}
+    embeddings = {}
+    if missing:
+        got = collection.get(ids=list(missing), include=["documents", "metadatas", "embeddings"])
+        for chunk_id, doc, meta, emb in zip(got["ids"], got["documents"], got["metadatas"], got["embeddings"]):
+            if doc is None:
+                continue
+            rows[chunk_id] = (doc, meta)
+            embeddings[chunk_id] = np.asarray(emb, dtype=np.float32)
+    results = []
+    for i, order in enumerate(orders):
+        known = dense_distances[i]
+        order = [chunk_id for chunk_id in order if chunk_id in known or chunk_id in embeddings]
+        distances = []
+        for chunk_id in order:
+            distance = known.get(chunk_id)
+            if distance is None:
+                diff = embeddings[chunk_id] - query_embs[i]
+                distance = float(np.dot(diff, diff))
+            distances.append(distance)
+        results.append({
+            "ids": [order],
+            "documents": [[rows[c][0] for c in order]],
+            "metadatas": [[rows[c][1] for c in order]],
+            "distances": [distances],
+        })
+    return results
+
+
+def embed_query(question, embedder):
+    return embed_queries([question], embedder)[0]
+
+
+def embed_queries(questions, embedder):
+    # Query vectors depend only on the question text and the model, not on the index; misses
+    # are encoded in one batch. An embedder not loaded through get_embedder() is not cached.
+    model_name = embedder_name(embedder)
+    keys = [(model_name, normalize_question(q)) for q in questions]
+    embs = [query_embeddings.get(key) if model_name is not None else None for key in keys]
+    missing = {}
+    for pos, (key, emb) in enumerate(zip(keys, embs)):
+        if emb is None:
+            missing.setdefault(key, []).append(pos)
+    if missing:
+        fresh = embedder.encode([questions[positions[0]] for positions in missing.values()], convert_to_numpy=True)
+        for (key, positions), emb in zip(missing.items(), fresh):
+            emb.setflags(write=False)
+            if model_name is not None:
+                query_embeddings.put(key, emb)
+            for pos in positions:
+                embs[pos] = emb
+    return np.stack(embs)
+
+
+# 1. Extract and chunk text from all PDFs in a folder
+def extract_and_chunk_pdfs(pdf_folder, chunk_size=None, progress=None):
+    # progress(phase, done, total), if given, is called as text extraction and indexing advance
     pdf_files = glob.glob(os.path.join(pdf_folder, '*.pdf'))
     # Show which PDFs are new (no .txt yet)
     new_pdfs = [p for p in pdf_files if not os.path.exists(os.path.splitext(p)[0] + ".txt")]
-    print(f"[DEBUG] PDFs needing text extraction: {len(new_pdfs)}")
+    log.info("PDFs needing text extraction: %d", len(new_pdfs))
     for p in new_pdfs:
-        print(f"    {os.path.basename(p)}")
-
-    # Load or create persistent index of already-processed files
-    indexed_path = os.path.join(pdf_folder, "indexed_files.json")
-    if os.path.exists(indexed_path):
-        with open(indexed_path, "r", encoding="utf-8") as f:
-            indexed_files = json.load(f)
-    else:
-        indexed_files = {}
+        log.debug("    %s", os.path.basename(p))
 
-    # Extract text from new PDFs and save as .txt
+    # Extract text from new PDFs in parallel and save as .txt
+    # Files that keep failing are parked in extraction_failures.json instead of being retried forever
+    retry_list = load_retry_list(pdf_folder)
+    to_extract = []
     for pdf_path in new_pdfs:
-        txt_path = os.path.splitext(pdf_path)[0] + ".txt"
-        try:
-            reader = PdfReader(pdf_path)
-            text = "\n".join(page.extract_text() or "" for page in reader.pages)
-            # If text is too short, fallback to OCR
-            if len(text.strip()) < 100:
-                print(f"[DEBUG] Fallback to OCR for {os.path.basename(pdf_path)}")
-                images = convert_from_path(pdf_path)
-                text = "\n".join(pytesseract.image_to_string(img) for img in images)
-            with open(txt_path, "w", encoding="utf-8") as f:
-                f.write(text)
-            print(f"[DEBUG] Extracted text for {os.path.basename(pdf_path)}")
-        except Exception as e:
-            print(f"[ERROR] Failed to extract {os.path.basename(pdf_path)}: {e}")
+        attempts = retry_list.get(pdf_path, {}).get("attempts", 0)
+        if attempts >= MAX_EXTRACT_ATTEMPTS:
+            log.warning("Skipping %s: extraction failed %d times (see %s)", os.path.basename(pdf_path), attempts, RETRY_LIST_NAME)
             continue
+        to_extract.append(pdf_path)
+    if progress is not None:
+        progress("extracting", 0, len(to_extract))
+    extracted, failures = extract_pdfs_parallel(to_extract)
+    if progress is not None:
+        progress("extracting", len(to_extract), len(to_extract))
+    for txt_path in extracted:
+        retry_list.pop(os.path.splitext(txt_path)[0] + ".pdf", None)
+    for pdf_path, error in failures.items():
+        entry = retry_list.setdefault(pdf_path, {"attempts": 0})
+        entry["attempts"] += 1
+        entry["error"] = error
+    save_retry_list(pdf_folder, retry_list)
+    if failures:
+        log.warning("%d PDF(s) failed extraction and were added to %s", len(failures), RETRY_LIST_NAME)
 
     # Find all .txt files corresponding to PDFs
     txt_files = [os.path.splitext(p)[0] + ".txt" for p in pdf_files if os.path.exists(os.path.splitext(p)[0] + ".txt")]
 
-    # Only index files that are new or updated
-    to_index = []
-    for pdf_path, txt_path in zip(pdf_files, txt_files):
-        mtime = os.path.getmtime(txt_path)
-        if pdf_path not in indexed_files or indexed_files[pdf_path] != mtime:
-            to_index.append((pdf_path, txt_path, mtime))
-
-    print(f"[DEBUG] PDFs to be indexed: {len(to_index)}")
-    for pdf_path, txt_path, _ in to_index:
-        print(f"    {os.path.basename(pdf_path)}")
-
-    # Only embed and index new/changed files, append to ChromaDB
-    embedder = SentenceTransformer('all-MiniLM-L6-v2')
-    appended_chunks = []
-    appended_metadata = []
-    for pdf_path, txt_path, mtime in to_index:
-        print(f"[DEBUG] Indexing: {os.path.basename(pdf_path)}")
-        with open(txt_path, "r", encoding="utf-8") as f:
-            text = f.read()
-        meta = extract_thesis_metadata(text)
-        meta["file"] = os.path.basename(txt_path)  # Use .txt as the source
-        meta["chunk_idx"] = 0  # Will be set per chunk
-        # Ensure 'university' is present
-        if "university" not in meta:
-            meta["university"] = ""
-        chunks = sentence_chunking(text, chunk_size=chunk_size)
-        chunk_embeddings = embed_chunks(chunks, embedder)
-        chunk_metadatas = []
-        for idx, chunk in enumerate(chunks):
-            meta_copy = dict(meta)
-            meta_copy["chunk_idx"] = idx
-            # Ensure 'subjects' is always a string (ChromaDB does not allow lists)
-            if "subjects" in meta_copy and isinstance(meta_copy["subjects"], list):
-                meta_copy["subjects"] = ", ".join(str(s) for s in meta_copy["subjects"])
-            # Replace None values with empty string for all metadata fields
-            for k, v in meta_copy.items():
-                if v is None:
-                    meta_copy[k] = ""
-            # Ensure 'university' is present in each chunk
-            if "university" not in meta_copy:
-                meta_copy["university"] = ""
-            chunk_metadatas.append(meta_copy)
-        # Append to ChromaDB (do not clear existing)
-        ids = [f"{os.path.basename(txt_path)}_chunk_{i}" for i in range(len(chunks))]
-        collection.add(
-            embeddings=[list(map(float, emb)) for emb in chunk_embeddings],
-            documents=chunks,
-            metadatas=chunk_metadatas,
-            ids=ids
+    # Only index files whose content changed since the last run (see index_manifest.py)
+    indexed_path = os.path.join(pdf_folder, "indexed_files.json")
+    manifest = IndexManifest(indexed_path, chunker=CHUNKER_VERSION)
+    changed = manifest.scan(txt_files)
+    removed = manifest.removed(txt_files)
+    stats = {"documents": 0, "chunks": 0, "embedded": 0, "deleted": 0, "seconds": 0.0, "chunks_per_sec": 0.0}
+    if not changed and not removed:
+        if manifest.dirty:
+            manifest.save()  # refreshed stat info of touched-but-identical files
+        refresh_corpus_stats(pdf_folder, manifest)
+        log.info("No new or changed PDFs to index. Skipping embedding and appending.")
+        return stats
+
+    log.debug("ChromaDB collection count before indexing: %d", collection.count())
+    # Drop chunks of theses whose .txt was removed
+    for txt_path in removed:
+        stale_ids = manifest.forget(txt_path) or _existing_chunk_ids(txt_path)
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+            sparse_index.delete(stale_ids)
+            stats["deleted"] += len(stale_ids)
+        doc_store.delete([os.path.basename(txt_path)])
+        facet_index.remove(os.path.basename(txt_path))
+        log.info("Removed %s (%d chunks)", os.path.basename(txt_path), len(stale_ids))
+
+    log.info("Files to be indexed: %d", len(changed))
+    n_done = 0
+    if progress is not None:
+        progress("indexing", 0, len(changed))
+    for txt_path, digest, st in changed:
+        manifest.begin(txt_path, digest, st)
+        log.debug("    %s", os.path.basename(txt_path))
+
+    # Re-embed only changed chunks of new/changed files and delete their orphaned chunks
+    # Reading, chunking, embedding and inserting run as a streaming pipeline
+    embedder = get_embedder()
+
+    def plan_document(txt_path, ids, chunks, metas):
+        return manifest.plan(txt_path, ids, chunks, metas, existing_ids=lambda: _existing_chunk_ids(txt_path))
+
+    load_docs, document_done = _document_tracking_loader(_load_thesis_docs)
+
+    def on_document_done(txt_path, n_chunks):
+        nonlocal n_done
+        manifest.commit(txt_path)
+        document_done(txt_path)
+        n_done += 1
+        if progress is not None:
+            progress("indexing", n_done, len(changed))
+        log.debug("Indexed: %s (%d chunks)", os.path.basename(txt_path), n_chunks)
+
+    try:
+        pipeline_stats = run_ingest_pipeline(
+            [txt_path for txt_path, _, _ in changed],
+            load_docs=load_docs,
+            chunk_text=lambda text: sentence_chunking(text, chunk_size=chunk_size),
+            embed_texts=lambda chunks: embed_chunks(chunks, embedder, show_progress_bar=False),
+            collection=collection,
+            on_document_done=on_document_done,
+            plan_document=plan_document,
+            sparse_index=sparse_index,
+            doc_batch_size=METADATA_BATCH_SIZE,
         )
-        appended_chunks.extend(chunks)
-        appended_metadata.extend(chunk_metadatas)
-        indexed_files[txt_path] = mtime
-
-    # Save updated index
-    with open(indexed_path, "w", encoding="utf-8") as f:
-        json.dump(indexed_files, f, indent=2)
-
-    print(f"[DEBUG] ChromaDB collection count after indexing: {collection.count()}")
-    return appended_chunks, appended_metadata
-    import pytesseract
-    from pdf2image import convert_from_path
-    import importlib.util
-    pdf_files = glob.glob(os.path.join(pdf_folder, '*.pdf'))
-    print(f"[DEBUG] Scanning for PDFs in: {pdf_folder}")
-    print(f"[DEBUG] Found {len(pdf_files)} PDF(s):")
-    for p in pdf_files:
-        print(f"    {os.path.basename(p)}")
-    # Show which PDFs are new (no .txt yet)
-    new_pdfs = [p for p in pdf_files if not os.path.exists(os.path.splitext(p)[0] + ".txt")]
-    print(f"[DEBUG] PDFs needing text extraction: {len(new_pdfs)}")
-    for p in new_pdfs:
-        print(f"    {os.path.basename(p)}")
-    # Show which .txt files will be indexed (not in indexed_files or updated)
-    # (Move this block after indexed_files is loaded)
+    finally:
+        # Save the manifest also after a failure, so finished documents are not re-embedded
+        if manifest.dirty:
+            manifest.save()
+        if collection.dirty:
+            collection.save()
+        if sparse_index.dirty:
+            sparse_index.save()
+        # Cached retrieval results and overviews refer to the old index
+        bump_index_version()
+        refresh_corpus_stats(pdf_folder, manifest, changed=True)
+    pipeline_stats["deleted"] += stats["deleted"]
+    stats = pipeline_stats
+    record_index_run(stats)
+    log.info("Indexed %d documents: %d of %d chunks embedded, %d stale chunks deleted in %ss (%s chunks/s)",
+             stats['documents'], stats['embedded'], stats['chunks'], stats['deleted'], stats['seconds'], stats['chunks_per_sec'])
+    log.debug("ChromaDB collection count after indexing: %d", collection.count())
+    return stats
+
+
+def index_folder(pdf_folder, progress=None):
+    """
+    One run of the background indexer: ingest new and changed theses, recover an empty collection
+    from the manifest, and bring the BM25 index and the document store in step with the collection.
+    stats["changed"] tells whether the published index changed.
+    """
+    version = index_version()
+    stats = extract_and_chunk_pdfs(pdf_folder, progress=progress)
+    if collection.count() == 0:
+        log.info("[RECOVERY] Collection is empty. Attempting to recover from indexed_files.json...")
+        recover_chromadb_from_index(pdf_folder)
+        log.info("[RECOVERY] Collection count after recovery: %d", collection.count())
+    sync_sparse_index()
+    sync_document_store(pdf_folder)
+    stats["changed"] = index_version() != version
+    return stats
+
+
+def record_index_run(stats):
+    # Indexing throughput for /metrics
+    INDEX_RUNS.inc()
+    INDEX_CHUNKS.inc(stats["embedded"])
+    INDEX_CHUNKS_PER_SEC.set(stats["chunks_per_sec"])
+
+
+def _existing_chunk_ids(txt_path):
+    # Chunk ids already stored for a file that predates chunk tracking in the manifest
+    try:
+        return collection.get(where={"file": os.path.basename(txt_path)}, include=[])["ids"]
+    except Exception:
+        return []
+
+
+def refresh_corpus_stats(pdf_folder, manifest=None, changed=False):
+    # Cheap numbers only: the manifest is in memory and the store's stats() does not read chunks
+    if manifest is None:
+        manifest = IndexManifest(os.path.join(pdf_folder, "indexed_files.json"))
+    store_stats = collection.stats()
+    fields = {
+        "documents": len(manifest.files),
+        "chunks": store_stats["chunks"],
+        "vector_store": store_stats,
+        "txt_files": len(glob.glob(os.path.join(pdf_folder, '*.txt'))),
+        "sparse_chunks": len(sparse_index),
+    }
+    if changed:
+        fields["last_indexed_at"] = time.time()
+    elif corpus_stats.last_indexed_at is None and os.path.exists(manifest.path):
+        fields["last_indexed_at"] = os.path.getmtime(manifest.path)
+    corpus_stats.update(**fields)
+
+
+def deep_health_check(pdf_folder, page_size=5000):
+    """Re-derive the corpus statistics from ChromaDB, the manifest and the files on disk and compare."""
+    start = time.perf_counter()
+    total_chunks = collection.count()
+    files = set()
+    for offset in range(0, total_chunks, page_size):
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        files.update(m.get("file") or m.get("pdf") for m in page["metadatas"] if m)
+    files.discard(None)
+    txt_files = glob.glob(os.path.join(pdf_folder, '*.txt'))
+    manifest = IndexManifest(os.path.join(pdf_folder, "indexed_files.json"))
+    indexed = {os.path.basename(p) for p in manifest.files}
+    stored = set(doc_store.ids())
+    stats = corpus_stats.snapshot()
+    problems = []
+    if total_chunks != stats["total_chunks"]:
+        problems.append(f"collection has {total_chunks} chunks, /health reports {stats['total_chunks']}")
+    if len(sparse_index) != total_chunks:
+        problems.append(f"sparse index has {len(sparse_index)} chunks, collection has {total_chunks}")
+    missing = sorted(indexed - files)
+    if missing:
+        problems.append(f"{len(missing)} indexed file(s) have no chunks in the collection: {missing[:10]}")
+    unknown = sorted(files - indexed)
+    if unknown:
+        problems.append(f"{len(unknown)} file(s) in the collection are not in the manifest: {unknown[:10]}")
+    no_metadata = sorted(indexed - stored)
+    if no_metadata:
+        problems.append(f"{len(no_metadata)} indexed file(s) are missing from the document store: {no_metadata[:10]}")
+    return {
+        "status": "healthy" if not problems else "degraded",
+        "documents_in_collection": len(files),
+        "chunks_in_collection": total_chunks,
+        "documents_in_manifest": len(manifest.files),
+        "documents_in_store": len(stored),
+        "txt_files": len(txt_files),
+        "sparse_chunks": len(sparse_index),
+        "reported": stats,
+        "problems": problems,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def retrieve_for_question(question, n_results=50, distance_threshold=1.5, filters=None):
+    """
+    Retrieve chunks for /search. Returns (documents, relevant_chunks, chunks_for_overview):
+    up to 10 unique source documents, the chunks under the distance threshold, and the
+    relevant chunks from the first 5 unique sources (the Gemini context).
+    """
+    return retrieve_for_questions([question], n_results=n_results, distance_threshold=distance_threshold,
+                                  filters=filters)[0]
+
+
+def retrieve_for_questions(questions, n_results=50, distance_threshold=1.5, filters=None):
+    # retrieve_for_question for many questions with one batched encode and one collection.query
+    results = hybrid_query_batch(
+        questions, get_embedder(), collection,
+        n_results=n_results,  # Get more chunks to ensure enough unique PDFs
+        filters=filters
+    )
+    return [_select_for_search(r, distance_threshold) for r in results]
+
+
+def _select_for_search(results, distance_threshold):
+    with stage("filtering"):
+        # Prepare top chunks for Gemini and filter by distance threshold
+        top_chunks = []
+        seen_files = set()
+        top_files = []
+        for i in range(len(results["documents"][0])):
+            meta = results["metadatas"][0][i]
+            file_name = meta.get("file", meta.get("pdf", ""))
+            score = float(results["distances"][0][i])
+            top_chunks.append({
+                "id": results["ids"][0][i],
+                "chunk": results["documents"][0][i],
+                "meta": meta,
+                "score": score
+            })
+            if score < distance_threshold and file_name and file_name not in seen_files:
+                top_files.append((file_name, meta))
+                seen_files.add(file_name)
+            if len(top_files) >= 10:
+                break
+        relevant_chunks = [c for c in top_chunks if c["score"] < distance_threshold]
+        # Build context from up to 5 unique theses (by file/pdf)
+        unique_files = []
+        chunks_for_overview = []
+        for c in relevant_chunks:
+            file_name = c["meta"].get("file", c["meta"].get("pdf", ""))
+            if file_name and file_name not in unique_files:
+                unique_files.append(file_name)
+            if file_name in unique_files[:5]:
+                chunks_for_overview.append(c)
+            # Stop collecting if we have 5 unique sources
+            if len(unique_files) >= 5:
+                break
+        # Only keep chunks from the first 5 unique sources
+        chunks_for_overview = [c for c in chunks_for_overview if c["meta"].get("file", c["meta"].get("pdf", "")) in unique_files[:5]]
+    # Document metadata is looked up for the returned documents only (the overview sources are among them)
+    with stage("doc_join"):
+        doc_metas = doc_store.get_many(file_name for file_name, _ in top_files)
+        documents = []
+        for file_name, chunk_meta in top_files:
+            meta = _with_document_meta(chunk_meta, doc_metas)
+            documents.append({
+                "title": meta.get("title", "[Unknown Title]"),
+                "author": meta.get("author", "[Unknown Author]"),
+                "publication_year": meta.get("publication_year", "[Unknown Year]"),
+                "abstract": meta.get("abstract", ""),
+                "file": file_name,
+                "degree": meta.get("degree", "Thesis"),
+                "call_no": meta.get("call_no", ""),
+                "subjects": meta.get("subjects", ""),
+                "university": meta.get("university", "")
+            })
+        chunks_for_overview = [dict(c, meta=_with_document_meta(c["meta"], doc_metas)) for c in chunks_for_overview]
+    return documents, relevant_chunks, chunks_for_overview
+
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def extractive_overview(top_chunks, question, sentences_per_source=2):
+    """
+    Overview without Gemini, used while the LLM is unavailable: for each source (numbered as in
+    prompt_chain) the sentences of its chunks that share the most terms with the question.
+    """
+    if _no_usable_chunks(top_chunks):
+        return 'No results found for your query.'
+    terms = set(tokenize(question))
+    by_source = {}
+    for c in top_chunks:
+        by_source.setdefault(c['meta'].get('pdf', c['meta'].get('file', '[Unknown]')), []).append(c['chunk'])
+    paragraphs = []
+    for number, chunks in enumerate(list(by_source.values())[:10], start=1):
+        sentences = [s.strip() for chunk in chunks for s in _SENTENCE_END.split(chunk) if len(s.split()) >= 5]
+        if not sentences:
+            continue
+        overlap = [len(terms & set(tokenize(s))) for s in sentences]
+        best = sorted(sorted(range(len(sentences)), key=lambda i: -overlap[i])[:sentences_per_source])
+        paragraphs.append(" ".join(sentences[i] for i in best) + f"[{number}]")
+    return "\n\n".join(paragraphs) or 'No results found for your query.'
+
+
+def _overview_key(question, chunks_for_overview):
+    # Same question over the same retrieved chunks -> same overview
+    return (normalize_question(question), tuple(c["id"] for c in chunks_for_overview), PROMPT_VERSION)
+
+
+def search_response(question, documents, relevant_chunks, chunks_for_overview):
+    """The /search response body for retrieved chunks: overview (cached, Gemini or extractive) and sources."""
+    # Call Gemini overview as long as there is at least 1 relevant chunk
+    overview_msg = "No overview available."
+    if relevant_chunks:
+        api_key = os.environ.get("GEMINI_API_KEY", "")
+        # Same question over the same retrieved chunks -> reuse the previous overview
+        overview_key = _overview_key(question, chunks_for_overview)
+        cached_overview = overviews.get(overview_key)
+        if cached_overview is not None:
+            overview_msg = cached_overview
+        elif api_key:
+            try:
+                prompts = [question]
+                overview_msg = prompt_chain(chunks_for_overview, prompts, api_key)
+                overviews.put(overview_key, overview_msg)
+            except LLMUnavailable as e:
+                ERRORS.inc(kind="llm_unavailable")
+                log.warning("%s; using extractive overview", e)
+                overview_msg = extractive_overview(chunks_for_overview, question)
+            except Exception as e:
+                ERRORS.inc(kind="gemini")
+                log.exception("Gemini overview failed")
+                overview_msg = f"[Gemini error: {e}]"
+        else:
+            overview_msg = "No Gemini API key configured."
+    else:
+        overview_msg = "No relevant information found for your query."
+
+    # If no relevant chunks, also ensure no sources and clean up overview
+    if not relevant_chunks:
+        documents = []
+        overview_msg = re.sub(r"\\[\\d+\\]", "", overview_msg)
+
+    return {
+        "overview": overview_msg,
+        "documents": documents,
+        "related_questions": []  # Placeholder
+    }
+
+
+def search_batch(questions, with_overview=True, max_parallel=None, filters=None):
+    """
+    Answer many questions like /search: retrieval for all of them runs as one batched encode
+    and one multi-vector collection.query; overviews run concurrently, at most max_parallel
+    (capped by BATCH_OVERVIEW_CONCURRENCY) at a time. Returns one response per question.
+    """
+    retrieved = retrieve_for_questions(questions, filters=filters)
+    if not with_overview:
+        return [{"overview": None, "documents": documents if relevant_chunks else [], "related_questions": []}
+                for documents, relevant_chunks, _ in retrieved]
+    workers = max(1, min(max_parallel or BATCH_OVERVIEW_CONCURRENCY, BATCH_OVERVIEW_CONCURRENCY, len(questions)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-batch-overview") as pool:
+        # Each task runs in a copy of the caller's context, so its stage timings join the request trace
+        futures = [pool.submit(contextvars.copy_context().run, search_response, question, *r)
+                   for question, r in zip(questions, retrieved)]
+        return [f.result() for f in futures]
 
 
 # --- Minimal HTTP Server for Multi-Thesis RAG ---
+import queue
+import signal
 import socketserver
+import sys
+import threading
+import time
+import urllib.parse
 from http.server import BaseHTTPRequestHandler
+from background_indexer import BackgroundIndexer, read_status
+from prefork import PreforkSupervisor
+
+THESIS_DIR = os.path.join("RAG", "theses")
+_deep_check_lock = threading.Lock()
+
+# Paths reported as their own label in request metrics; anything else counts as "other"
+METRIC_PATHS = frozenset({"/search", "/search/batch", "/facets", "/health", "/health/deep", "/metrics",
+                          "/index/status", "/index/reindex"})
+
+# Numbers other modules already keep, read when /metrics is scraped
+CallbackMetric("rag_cache_hits_total", "Cache hits", "counter",
+               lambda: [({"cache": name}, s["hits"]) for name, s in cache_stats().items() if isinstance(s, dict)],
+               ("cache",))
+CallbackMetric("rag_cache_misses_total", "Cache misses", "counter",
+               lambda: [({"cache": name}, s["misses"]) for name, s in cache_stats().items() if isinstance(s, dict)],
+               ("cache",))
+CallbackMetric("rag_index_version", "Index version (bumped whenever the collection changes)", "gauge",
+               lambda: [({}, index_version())])
+CallbackMetric("rag_corpus_chunks", "Chunks in the collection", "gauge",
+               lambda: [({}, corpus_stats.snapshot()["total_chunks"])])
+CallbackMetric("rag_gemini_calls_total", "Gemini calls attempted", "counter",
+               lambda: [({}, sum(c["calls"] for c in llm_stats()))])
+CallbackMetric("rag_gemini_retries_total", "Gemini call retries", "counter",
+               lambda: [({}, sum(c["retries"] for c in llm_stats()))])
+CallbackMetric("rag_gemini_errors_total", "Gemini errors by kind", "counter",
+               lambda: [({"kind": kind}, n) for c in llm_stats() for kind, n in sorted(c["errors"].items())],
+               ("kind",))
+
+# Concurrency settings for the threaded server (overridable via .env)
+SERVER_MODE = os.environ.get("RAG_SERVER_MODE", "threaded")  # "threaded", "single" or "prefork"
+SERVER_WORKERS = int(os.environ.get("RAG_SERVER_WORKERS", "8"))
+SERVER_QUEUE_SIZE = int(os.environ.get("RAG_SERVER_QUEUE_SIZE", "32"))
+SERVER_DRAIN_TIMEOUT = float(os.environ.get("RAG_SERVER_DRAIN_TIMEOUT", "30"))
+# "prefork" mode: worker processes, each running the threaded server above (see prefork.py)
+SERVER_PROCESSES = int(os.environ.get("RAG_SERVER_PROCESSES", str(os.cpu_count() or 1)))
+
+# Background indexer of THESIS_DIR (see background_indexer.py); started by the __main__ block
+INDEX_STATUS_PATH = os.path.join("RAG", "cache", "index_status.json")
+indexer = None
+_supervisor_pid = None  # set in pre-fork mode, where the indexer runs in the supervisor process
+
+
+class BoundedThreadPoolServer(socketserver.TCPServer):
+    """
+    TCPServer that hands accepted connections to a fixed pool of worker threads
+    through a bounded queue. When the queue is full the connection is answered
+    with 503 immediately instead of waiting behind slow Gemini calls.
+    """
+    allow_reuse_address = True
+    request_queue_size = 128  # listen() backlog
+
+    def __init__(self, server_address, handler_class, workers=SERVER_WORKERS,
+                 queue_size=SERVER_QUEUE_SIZE, drain_timeout=SERVER_DRAIN_TIMEOUT, bind_and_activate=True):
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self.workers = max(1, int(workers))
+        self.drain_timeout = drain_timeout
+        self._pending = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+        self.process_info = None  # set in pre-fork workers
+        self._threads = []
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"rag-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def process_request(self, request, client_address):
+        try:
+            self._pending.put_nowait((request, client_address))
+        except queue.Full:
+            self._reject(request)
+
+    def _reject(self, request):
+        with self._stats_lock:
+            self.rejected += 1
+        ERRORS.inc(kind="server_busy")
+        body = json.dumps({"error": "Server busy, please retry"}).encode("utf-8")
+        head = (
+            "HTTP/1.0 503 Service Unavailable\r\n"
+            "Content-type: application/json\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            "Retry-After: 1\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("latin-1")
+        try:
+            request.sendall(head + body)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _worker_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                self._pending.task_done()
+                return
+            request, client_address = item
+            with self._stats_lock:
+                self.in_flight += 1
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._stats_lock:
+                    self.in_flight -= 1
+                self._pending.task_done()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "mode": "threaded",
+                "workers": self.workers,
+                "queued": self._pending.qsize(),
+                "queue_capacity": self._pending.maxsize,
+                "in_flight": self.in_flight,
+                "rejected": self.rejected,
+                **(self.process_info or {}),
+            }
+
+    def server_close(self):
+        # Stop accepting, then let queued and running requests finish before exiting
+        super().server_close()
+        deadline = time.monotonic() + self.drain_timeout
+        for _ in self._threads:
+            try:
+                self._pending.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for t in self._threads:
+            t.join(timeout=max(0.0, deadline - time.monotonic()))
+        still_running = sum(1 for t in self._threads if t.is_alive())
+        if still_running:
+            log.warning("%d worker(s) still busy after %ss drain timeout", still_running, self.drain_timeout)
+
+
+def _reopen_indexes():
+    """
+    Open this process's own handles on the index as it is on disk now. Runs in pre-fork workers
+    and the indexer process right after fork: SQLite connections and thread pools do not survive
+    fork, and a new worker generation has to see what the indexer published since the
+    supervisor started.
+    """
+    global collection, sparse_index, doc_store, facet_index, _retrieval_pool
+    # Keep the parent's handles referenced: closing an inherited SQLite connection is unsafe.
+    # (The supervisor forks only while single-threaded, so no inherited lock is held.)
+    _inherited_handles.append((collection, sparse_index, doc_store, facet_index, _retrieval_pool))
+    collection = LazyVectorStore(collection.factory)
+    collection.open()
+    sparse_index = LazyHandle(sparse_index.factory)
+    sparse_index.open()
+    doc_store = LazyHandle(doc_store.factory)
+    doc_store.open()
+    facet_index = FacetIndex()
+    facet_index.replace_all(doc_store.items())
+    _retrieval_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("RAG_RETRIEVAL_THREADS", "4")),
+                                         thread_name_prefix="rag-retrieval")
+    bump_index_version()
+    refresh_corpus_stats(THESIS_DIR)
+
+
+_inherited_handles = []
+
+
+def _serve_prefork_worker(sock, ready, generation):
+    _reopen_indexes()
+    # Each worker has its own Gemini rate limiter; together they must stay within the quota
+    set_rate_share(SERVER_PROCESSES)
+    if "torch" in sys.modules:
+        # Split the cores between the workers instead of every worker using all of them
+        sys.modules["torch"].set_num_threads(max(1, (os.cpu_count() or 1) // SERVER_PROCESSES))
+    httpd = BoundedThreadPoolServer(sock.getsockname(), MultiThesisRAGHTTPRequestHandler, bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = sock
+    httpd.process_info = {"process": os.getpid(), "generation": generation}
+    ready()
+    with httpd:
+        httpd.serve_forever()
+
+
+def serve_prefork(server_address, processes=SERVER_PROCESSES):
+    """
+    Serve with `processes` worker processes sharing the listening socket, the embedder weights
+    (loaded before the fork) and the memory-mapped index. The background indexer runs in a
+    companion process, so the supervisor stays single-threaded and safe to fork from; SIGHUP
+    (or /index/reindex on any worker) starts a run, and every run that changed the index swaps
+    the workers to the new generation.
+    """
+    global _supervisor_pid
+    if VECTOR_BACKEND != "local":
+        raise SystemExit("RAG_SERVER_MODE=prefork needs RAG_VECTOR_BACKEND=local: "
+                         "a ChromaDB client cannot be used in forked worker processes")
+    _supervisor_pid = os.getpid()
+
+    def run_indexer(request_reload):
+        _reopen_indexes()
+        background = BackgroundIndexer(THESIS_DIR, lambda progress: index_folder(THESIS_DIR, progress),
+                                       on_published=lambda stats: request_reload(),
+                                       status_path=INDEX_STATUS_PATH)
+        signal.signal(signal.SIGHUP, lambda signum, frame: background.reindex())
+        background.start()
+        while True:
+            time.sleep(3600)
+
+    supervisor = PreforkSupervisor(server_address, _serve_prefork_worker, processes,
+                                   drain_timeout=SERVER_DRAIN_TIMEOUT, companion=run_indexer)
+    if threading.active_count() > 1:
+        log.warning("Pre-fork supervisor has %d threads; forking workers from it is not safe",
+                    threading.active_count())
+    supervisor.serve_forever()
+
+
+def index_status():
+    if indexer is not None:
+        return indexer.status()
+    # Pre-fork worker: the indexer runs in the supervisor, which keeps its status in a file
+    return read_status(INDEX_STATUS_PATH)
+
+
+def request_reindex():
+    if indexer is not None:
+        return indexer.reindex()
+    if _supervisor_pid is not None:
+        os.kill(_supervisor_pid, signal.SIGHUP)
+        return {**(read_status(INDEX_STATUS_PATH) or {}), "reindex_requested": True}
+    return None
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    # Treat SIGTERM like Ctrl+C so the server drains the same way
+    raise KeyboardInterrupt
 
 class MultiThesisRAGHTTPRequestHandler(BaseHTTPRequestHandler):
+    _trace = None
+    _status = None
+
     def _set_headers(self, status=200, content_type="application/json"):
         self.send_response(status)
         self.send_header('Content-type', content_type)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Request-Id')
+        if self._trace is not None:
+            self.send_header('X-Request-Id', self._trace.trace_id)
         self.end_headers()
 
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def _traced(self, handle):
+        # One trace per request: the id comes from X-Request-Id or is generated, stage timings
+        # are collected while handling, and one structured log line is written at the end
+        trace, token = start_trace(self.headers.get("X-Request-Id"))
+        self._trace = trace
+        self._status = None
+        path = self.path.split("?", 1)[0]
+        path = path if path in METRIC_PATHS else "other"
+        IN_FLIGHT.inc()
+        try:
+            handle()
+        finally:
+            IN_FLIGHT.dec()
+            seconds = trace.elapsed()
+            status = self._status or 0
+            REQUESTS.inc(path=path, status=status)
+            REQUEST_SECONDS.observe(seconds, path=path)
+            if path != "/metrics":
+                log.info(json.dumps({
+                    "event": "request",
+                    "trace_id": trace.trace_id,
+                    "method": self.command,
+                    "path": self.path,
+                    "status": status,
+                    "duration_ms": round(seconds * 1000, 1),
+                    "stages_ms": {name: round(t * 1000, 1) for name, t in trace.stages.items()},
+                }))
+            end_trace(token)
+            self._trace = None
+
+    def log_message(self, format, *args):
+        # Access log at debug level; the structured request line above replaces it
+        log.debug("%s - %s", self.address_string(), format % args)
+
     def do_OPTIONS(self):
         self._set_headers()
 
     def do_GET(self):
-        if self.path == "/health":
-            # Return health and index info
-            total_chunks = collection.count()
-            # Try to count unique documents
+        self._traced(self._handle_get)
+
+    def do_POST(self):
+        self._traced(self._handle_post)
+
+    def _handle_get(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/facets":
+            # Facet counts from the document-level index; filters as query parameters
+            # (/facets?year_min=2015&subjects=Agriculture&subjects=Fisheries)
+            query = urllib.parse.parse_qs(url.query)
             try:
-                all_meta = collection.get()["metadatas"]
-                unique_pdfs = set(m["pdf"] for m in all_meta if "pdf" in m)
-            except Exception:
-                unique_pdfs = set()
-            # Count .txt files in RAG/theses (excluding non-thesis files)
-            import glob
-            import os
-            thesis_dir = os.path.join("RAG", "theses")
-            txt_files = [f for f in glob.glob(os.path.join(thesis_dir, '*.txt')) if os.path.isfile(f)]
+                filters = parse_filters({k: v if k in ("subjects", "university", "degree") else v[-1]
+                                         for k, v in query.items()})
+            except ValueError as e:
+                self._set_headers(400)
+                self.wfile.write(json.dumps({"error": str(e)}).encode("utf-8"))
+                return
+            self._set_headers()
+            self.wfile.write(json.dumps(facet_index.counts(facet_index.canonical(filters))).encode("utf-8"))
+        elif self.path == "/metrics":
+            body = render_metrics().encode("utf-8")
+            self._set_headers(content_type="text/plain; version=0.0.4; charset=utf-8")
+            self.wfile.write(body)
+        elif self.path == "/health":
+            # Served from statistics the indexer keeps up to date; the vector store is not opened
+            # or counted per probe
             resp = {
                 "status": "healthy",
-                "total_documents": len(unique_pdfs),
-                "total_chunks": total_chunks,
-                "total_txt_files": len(txt_files)
+                **corpus_stats.snapshot(),
+                "index_version": index_version(),
+                "embedders": embedder_stats(),
+                "caches": cache_stats(),
+                "llm": llm_stats()
             }
+            if hasattr(self.server, "stats"):
+                resp["server"] = self.server.stats()
             self._set_headers()
             self.wfile.write(json.dumps(resp).encode("utf-8"))
+        elif self.path == "/index/status":
+            status = index_status()
+            if status is None:
+                self._set_headers(503)
+                self.wfile.write(json.dumps({"error": "Background indexer is not running"}).encode("utf-8"))
+                return
+            self._set_headers()
+            self.wfile.write(json.dumps(status).encode("utf-8"))
+        elif self.path == "/health/deep":
+            # Expensive verification (scans every chunk's metadata); one at a time
+            if not _deep_check_lock.acquire(blocking=False):
+                self._set_headers(429)
+                self.wfile.write(json.dumps({"error": "Deep health check already running"}).encode("utf-8"))
+                return
+            try:
+                resp = deep_health_check(THESIS_DIR)
+            finally:
+                _deep_check_lock.release()
+            self._set_headers(200 if resp["status"] == "healthy" else 503)
+            self.wfile.write(json.dumps(resp).encode("utf-8"))
         else:
             self._set_headers(404)
             self.wfile.write(json.dumps({"error": "Not found"}).encode("utf-8"))
 
-    def do_POST(self):
-        if self.path == "/search":
+    def _handle_post(self):
+        if self.path == "/index/reindex":
+            status = request_reindex()
+            if status is None:
+                self._set_headers(503)
+                self.wfile.write(json.dumps({"error": "Background indexer is not running"}).encode("utf-8"))
+                return
+            self._set_headers(202)
+            self.wfile.write(json.dumps(status).encode("utf-8"))
+        elif self.path == "/search":
             content_length = int(self.headers.get('Content-Length', 0))
             post_data = self.rfile.read(content_length)
             try:
@@ -556,112 +1376,143 @@ class MultiThesisRAGHTTPRequestHandler(BaseHTTPRequestHandler):
                 question = req.get("question", "")
                 if not question.strip():
                     raise ValueError("Missing question")
-                embedder = SentenceTransformer('all-MiniLM-L6-v2')
-                results = collection.query(
-                    query_embeddings=[embedder.encode([question], convert_to_numpy=True)[0].tolist()],
-                    n_results=50,  # Get more chunks to ensure enough unique PDFs
-                    include=["documents", "metadatas", "distances"]
-                )
-                # Prepare top chunks for Gemini and filter by distance threshold
-                top_chunks = []
-                seen_files = set()
-                documents = []
-                DISTANCE_THRESHOLD = 1.5  # Lower means stricter relevance
-                for i in range(len(results["documents"][0])):
-                    meta = results["metadatas"][0][i]
-                    file_name = meta.get("file", meta.get("pdf", ""))
-                    score = float(results["distances"][0][i])
-                    top_chunks.append({
-                        "chunk": results["documents"][0][i],
-                        "meta": meta,
-                        "score": score
-                    })
-                    if score < DISTANCE_THRESHOLD and file_name and file_name not in seen_files:
-                        doc = {
-                            "title": meta.get("title", "[Unknown Title]"),
-                            "author": meta.get("author", "[Unknown Author]"),
-                            "publication_year": meta.get("publication_year", "[Unknown Year]"),
-                            "abstract": meta.get("abstract", ""),
-                            "file": file_name,
-                            "degree": meta.get("degree", "Thesis"),
-                            "call_no": meta.get("call_no", ""),
-                            "subjects": meta.get("subjects", ""),
-                            "university": meta.get("university", "")
-                        }
-                        documents.append(doc)
-                        seen_files.add(file_name)
-                    if len(documents) >= 10:
-                        break
-
-
-                # Call Gemini overview as long as there is at least 1 relevant chunk
-                relevant_chunks = [c for c in top_chunks if c["score"] < DISTANCE_THRESHOLD]
-                import os
-                overview_msg = "No overview available."
-                if relevant_chunks:
-                    # Build context from up to 5 unique theses (by file/pdf)
-                    unique_files = []
-                    chunks_for_overview = []
-                    for c in relevant_chunks:
-                        file_name = c["meta"].get("file", c["meta"].get("pdf", ""))
-                        if file_name and file_name not in unique_files:
-                            unique_files.append(file_name)
-                        if file_name in unique_files[:5]:
-                            chunks_for_overview.append(c)
-                        # Stop collecting if we have 5 unique sources
-                        if len(unique_files) >= 5:
-                            break
-                    # Only keep chunks from the first 5 unique sources
-                    chunks_for_overview = [c for c in chunks_for_overview if c["meta"].get("file", c["meta"].get("pdf", "")) in unique_files[:5]]
-                    api_key = os.environ.get("GEMINI_API_KEY", "")
-                    if api_key:
-                        try:
-                            prompts = [question]
-                            overview_msg = prompt_chain(chunks_for_overview, prompts, api_key)
-                        except Exception as e:
-                            overview_msg = f"[Gemini error: {e}]"
-                    else:
-                        overview_msg = "No Gemini API key configured."
-                else:
-                    overview_msg = "No relevant information found for your query."
-
-                # If no relevant chunks, also ensure no sources and clean up overview
-                if not relevant_chunks:
-                    documents = []
-                    import re
-                    overview_msg = re.sub(r"\\[\\d+\\]", "", overview_msg)
-
-                resp = {
-                    "overview": overview_msg,
-                    "documents": documents,
-                    "related_questions": []  # Placeholder
-                }
+                stream = bool(req.get("stream")) or "text/event-stream" in self.headers.get("Accept", "")
+                filters = facet_index.canonical(parse_filters(req.get("filters")))
+                facets = facet_index.counts(filters) if req.get("facets") else None
+                documents, relevant_chunks, chunks_for_overview = retrieve_for_question(question, filters=filters)
+                if stream:
+                    self._stream_search(question, documents, relevant_chunks, chunks_for_overview, facets)
+                    return
+                resp = search_response(question, documents, relevant_chunks, chunks_for_overview)
+                if facets is not None:
+                    resp["facets"] = facets
                 self._set_headers()
                 self.wfile.write(json.dumps(resp).encode("utf-8"))
             except Exception as e:
+                ERRORS.inc(kind="bad_request")
+                log.debug("Bad /search request: %s", e)
                 self._set_headers(400)
                 self.wfile.write(json.dumps({"error": str(e)}).encode("utf-8"))
+        elif self.path == "/search/batch":
+            content_length = int(self.headers.get('Content-Length', 0))
+            try:
+                req = json.loads(self.rfile.read(content_length))
+                questions = req.get("questions")
+                if not isinstance(questions, list) or not questions:
+                    raise ValueError("Missing questions")
+                if len(questions) > BATCH_MAX_QUESTIONS:
+                    raise ValueError(f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+                if not all(isinstance(q, str) and q.strip() for q in questions):
+                    raise ValueError("Every question must be a non-empty string")
+                max_parallel = req.get("max_parallel")
+                if max_parallel is not None and (not isinstance(max_parallel, int) or max_parallel < 1):
+                    raise ValueError("max_parallel must be a positive integer")
+                with_overview = req.get("overview", True)
+                if not isinstance(with_overview, bool):
+                    raise ValueError("overview must be true or false")
+                filters = facet_index.canonical(parse_filters(req.get("filters")))
+            except Exception as e:
+                ERRORS.inc(kind="bad_request")
+                self._set_headers(400)
+                self.wfile.write(json.dumps({"error": str(e)}).encode("utf-8"))
+                return
+            try:
+                results = search_batch(questions, with_overview=with_overview, max_parallel=max_parallel,
+                                       filters=filters)
+            except Exception as e:
+                ERRORS.inc(kind="internal")
+                log.exception("/search/batch failed")
+                self._set_headers(500)
+                self.wfile.write(json.dumps({"error": f"Search failed: {e}"}).encode("utf-8"))
+                return
+            self._set_headers()
+            self.wfile.write(json.dumps({
+                "results": [dict(r, question=q) for q, r in zip(questions, results)]
+            }).encode("utf-8"))
         else:
             self._set_headers(404)
             self.wfile.write(json.dumps({"error": "Not found"}).encode("utf-8"))
 
+    def _send_event(self, event, payload):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _stream_search(self, question, documents, relevant_chunks, chunks_for_overview, facets=None):
+        # Server-sent events: "documents" right after retrieval, one "overview" event per finished
+        # paragraph, then "done" with the full overview and the file behind each reference number
+        self._set_headers(content_type="text/event-stream")
+        first = {"documents": documents if relevant_chunks else []}
+        if facets is not None:
+            first["facets"] = facets
+        self._send_event("documents", first)
+        if not relevant_chunks:
+            overview_msg = "No relevant information found for your query."
+            self._send_event("overview", {"text": overview_msg})
+            self._send_event("done", {"overview": overview_msg, "references": [], "related_questions": []})
+            return
+        overview_key = _overview_key(question, chunks_for_overview)
+        cached_overview = overviews.get(overview_key)
+        api_key = os.environ.get("GEMINI_API_KEY", "")
+        if cached_overview is not None or not api_key:
+            overview_msg = cached_overview if cached_overview is not None else "No Gemini API key configured."
+            self._send_event("overview", {"text": overview_msg})
+            self._send_event("done", {"overview": overview_msg, "references": None, "related_questions": []})
+            return
+        events = stream_overview(chunks_for_overview, question, api_key)
+        sent = 0
+        try:
+            for kind, payload in events:
+                if kind == "paragraph":
+                    self._send_event("overview", {"text": payload})
+                    sent += 1
+                else:
+                    overviews.put(overview_key, payload["overview"])
+                    self._send_event("done", dict(payload, related_questions=[]))
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away; closing the generator closes the Gemini stream
+            pass
+        except LLMUnavailable as e:
+            ERRORS.inc(kind="llm_unavailable")
+            if sent:
+                self._send_event("error", {"error": f"[Gemini error: {e}]"})
+            else:
+                log.warning("%s; using extractive overview", e)
+                overview_msg = extractive_overview(chunks_for_overview, question)
+                self._send_event("overview", {"text": overview_msg})
+                self._send_event("done", {"overview": overview_msg, "references": None, "related_questions": []})
+        except Exception as e:
+            ERRORS.inc(kind="gemini")
+            log.exception("Streaming overview failed")
+            try:
+                self._send_event("error", {"error": f"[Gemini error: {e}]"})
+            except OSError:
+                pass
+        finally:
+            events.close()
+
 if __name__ == "__main__":
-    pdf_folder = os.path.join("RAG", "theses")
-    print("Extracting and chunking PDFs (only new/changed)...")
-    appended_chunks, appended_metadata = extract_and_chunk_pdfs(pdf_folder)
-    print(f"Appended {len(appended_chunks)} new/changed chunks.")
-    # If ChromaDB is still empty but indexed_files.json exists, recover from index
-    if collection.count() == 0:
-        print("[RECOVERY] ChromaDB is empty. Attempting to recover from indexed_files.json...")
-        recover_chromadb_from_index(pdf_folder)
-        print(f"[RECOVERY] ChromaDB collection count after recovery: {collection.count()}")
-    # Start HTTP server
+    configure_logging(LOG_LEVEL)
+    # Load and warm the shared embedder once, before indexing and serving
+    get_embedder()
+    # Serve the index already on disk right away; new and changed theses are indexed in the background
+    refresh_corpus_stats(THESIS_DIR)
+    facet_index.replace_all(doc_store.items())
     port = 5000
-    print(f"Starting Multi-Thesis RAG HTTP server on port {port}...")
-    with socketserver.TCPServer(("", port), MultiThesisRAGHTTPRequestHandler) as httpd:
-        print(f"Server started at http://localhost:{port}")
+    log.info("Starting Multi-Thesis RAG HTTP server on port %d (%s mode)...", port, SERVER_MODE)
+    if SERVER_MODE == "prefork":
+        serve_prefork(("", port), SERVER_PROCESSES)
+        raise SystemExit(0)
+    if SERVER_MODE == "single":
+        httpd = socketserver.TCPServer(("", port), MultiThesisRAGHTTPRequestHandler)
+    else:
+        httpd = BoundedThreadPoolServer(("", port), MultiThesisRAGHTTPRequestHandler)
+        log.debug("Workers: %d, queue size: %d", httpd.workers, SERVER_QUEUE_SIZE)
+    indexer = BackgroundIndexer(THESIS_DIR, lambda progress: index_folder(THESIS_DIR, progress)).start()
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    with httpd:
+        log.info("Server started at http://localhost:%d", port)
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
-            print("\nShutting down server...")
+            log.info("Shutting down server (draining in-flight requests)...")
             httpd.shutdown()
\ No newline at end of file
@@ -0,0 +1,238 @@
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# Parallel PDF -> .txt extraction used by extract_and_chunk_pdfs.
+# Worker tasks only touch PyPDF2, pdf2image (pdftoppm) and pytesseract (tesseract),
+# never ChromaDB or the embedding model.
+EXTRACT_WORKERS = int(os.environ.get("RAG_EXTRACT_WORKERS", "0")) or (os.cpu_count() or 1)
+EXTRACT_FILE_TIMEOUT = float(os.environ.get("RAG_EXTRACT_FILE_TIMEOUT", "1800"))  # seconds per PDF
+OCR_DPI = int(os.environ.get("RAG_OCR_DPI", "200"))
+MIN_TEXT_CHARS = 100  # below this the text layer is treated as missing and we OCR
+MAX_EXTRACT_ATTEMPTS = 3
+RETRY_LIST_NAME = "extraction_failures.json"
+
+log = logging.getLogger(__name__)
+
+
+def _read_text_layer(pdf_path):
+    # Worker: return (text, page_count); falls back to pdfinfo for the page count if PyPDF2 cannot parse the file
+    try:
+        from PyPDF2 import PdfReader
+        reader = PdfReader(pdf_path)
+        text = "\n".join(page.extract_text() or "" for page in reader.pages)
+        return text, len(reader.pages)
+    except Exception:
+        from pdf2image import pdfinfo_from_path
+        return "", int(pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def _ocr_page(pdf_path, page_no, dpi=OCR_DPI):
+    # Worker: rasterize and OCR a single page, so only one page image is held at a time
+    import pytesseract
+    from pdf2image import convert_from_path
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=page_no, last_page=page_no)
+    try:
+        return "\n".join(pytesseract.image_to_string(img) for img in images)
+    finally:
+        for img in images:
+            img.close()
+
+
+def _write_text(txt_path, text):
+    # Write to a temp file first so a half-written .txt is never picked up by the indexer
+    tmp_path = txt_path + ".part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, txt_path)
+
+
+def load_retry_list(pdf_folder):
+    path = os.path.join(pdf_folder, RETRY_LIST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_retry_list(pdf_folder, retry_list):
+    path = os.path.join(pdf_folder, RETRY_LIST_NAME)
+    if not retry_list:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(retry_list, f, indent=2)
+
+
+def _report_pid(pids):
+    # Worker initializer: tell the parent which process to kill when the pool is stopped
+    pids.put(os.getpid())
+
+
+def _start_pool(workers, ctx):
+    # (pool, pids): the pool's workers report their pids to the queue as they start
+    pids = ctx.SimpleQueue()
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_report_pid, initargs=(pids,))
+    return pool, pids
+
+
+def _stop_pool(pool, pids):
+    # ProcessPoolExecutor cannot stop a running task: its worker processes are killed instead.
+    # A worker started too late to report its pid has no task running yet; the pool terminates
+    # it once it sees the others die.
+    pool.shutdown(wait=False, cancel_futures=True)
+    while not pids.empty():
+        try:
+            os.kill(pids.get(), getattr(signal, "SIGKILL", signal.SIGTERM))
+        except OSError:
+            pass  # already exited
+    pool.shutdown(wait=True)
+    pids.close()
+
+
+def extract_pdfs_parallel(pdf_paths, workers=EXTRACT_WORKERS, file_timeout=EXTRACT_FILE_TIMEOUT, ocr_dpi=OCR_DPI):
+    """
+    Extract text for pdf_paths into sibling .txt files using a process pool.
+    Text layers are read one file per task; scanned PDFs are OCR'd one page per task.
+    Returns (extracted_txt_paths, failures) where failures maps pdf path -> error message.
+    A file still running after file_timeout seconds fails; the pool's processes are killed
+    and the other files' unfinished tasks resubmitted to a new pool.
+    """
+    extracted = []
+    failures = {}
+    if not pdf_paths:
+        return extracted, failures
+
+    # Never fork the caller: it runs threads (the background indexer, /search workers, the
+    # retrieval pool) whose locks a forked child could inherit held. Workers start from a
+    # forkserver (spawn where there is none) and import the main script again, which is cheap:
+    # the vector store, sparse index and document store only open on first use.
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    jobs = {}     # pdf_path -> {"deadline", "pages", "remaining", "futures"}
+    pending = {}  # future -> (pdf_path, page_no or None)
+    strays = {}   # future of a failed file that could not be cancelled -> deadline of its file
+    waiting = list(pdf_paths)
+    workers = max(1, workers)
+    # Only a few files are active at once; a file's timeout starts when its first task runs
+    max_active = 2 * workers
+    pool, pids = _start_pool(workers, ctx)
+    try:
+        def submit(pdf_path, page_no):
+            if page_no is None:
+                fut = pool.submit(_read_text_layer, pdf_path)
+            else:
+                fut = pool.submit(_ocr_page, pdf_path, page_no, ocr_dpi)
+            jobs[pdf_path]["futures"].add(fut)
+            pending[fut] = (pdf_path, page_no)
+
+        def activate():
+            while waiting and len(jobs) < max_active:
+                pdf_path = waiting.pop(0)
+                jobs[pdf_path] = {"deadline": None, "pages": None, "remaining": 0, "futures": set()}
+                submit(pdf_path, None)
+
+        def restart_pool():
+            # Kill the workers, and with them the overdue tasks. Unfinished tasks of the other
+            # files are resubmitted and those files' timeouts start over; finished results are kept.
+            nonlocal pool, pids
+            todo = [(fut, task) for fut, task in pending.items() if not fut.done()]
+            _stop_pool(pool, pids)
+            pool, pids = _start_pool(workers, ctx)
+            strays.clear()
+            for fut, (pdf_path, page_no) in todo:
+                del pending[fut]
+                job = jobs[pdf_path]
+                job["futures"].discard(fut)
+                job["deadline"] = None
+                submit(pdf_path, page_no)
+            log.warning("Restarted the extraction pool to stop timed-out tasks; %d task(s) resubmitted", len(todo))
+
+        def stop_overdue_strays(now):
+            for fut in [f for f in strays if f.done()]:
+                del strays[fut]
+            if any(now > deadline for deadline in strays.values()):
+                restart_pool()
+
+        def fail(pdf_path, error):
+            job = jobs.pop(pdf_path, None)
+            if job is None:
+                return
+            for f in job["futures"]:
+                if not f.cancel():
+                    strays[f] = job["deadline"] or time.monotonic() + file_timeout
+                pending.pop(f, None)
+            failures[pdf_path] = error
+            log.error("Failed to extract %s: %s", os.path.basename(pdf_path), error)
+
+        def finish(pdf_path, text):
+            jobs.pop(pdf_path, None)
+            txt_path = os.path.splitext(pdf_path)[0] + ".txt"
+            try:
+                _write_text(txt_path, text)
+            except OSError as e:
+                failures[pdf_path] = str(e)
+                log.error("Failed to write %s: %s", os.path.basename(txt_path), e)
+                return
+            extracted.append(txt_path)
+            log.debug("Extracted text for %s", os.path.basename(pdf_path))
+
+        activate()
+        while pending:
+            done, _ = wait(list(pending), timeout=1.0, return_when=FIRST_COMPLETED)
+            for fut in done:
+                pdf_path, page_no = pending.pop(fut)
+                job = jobs.get(pdf_path)
+                if job is None:
+                    continue  # file already failed or timed out
+                job["futures"].discard(fut)
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    fail(pdf_path, f"{type(e).__name__}: {e}")
+                    continue
+                if page_no is None:
+                    text, page_count = result
+                    if len(text.strip()) >= MIN_TEXT_CHARS:
+                        finish(pdf_path, text)
+                        continue
+                    if not page_count:
+                        fail(pdf_path, "no text layer and no pages to OCR")
+                        continue
+                    log.debug("Fallback to OCR for %s (%d pages)", os.path.basename(pdf_path), page_count)
+                    job["pages"] = [""] * page_count
+                    job["remaining"] = page_count
+                    for n in range(1, page_count + 1):
+                        submit(pdf_path, n)
+                else:
+                    job["pages"][page_no - 1] = result
+                    job["remaining"] -= 1
+                    if job["remaining"] == 0:
+                        finish(pdf_path, "\n".join(job["pages"]))
+            # Enforce per-file timeouts. Running tasks of failed files cannot be cancelled; once
+            # one of them is past its file's deadline, the pool is restarted to stop it.
+            now = time.monotonic()
+            for job in jobs.values():
+                if job["deadline"] is None and any(f.running() or f.done() for f in job["futures"]):
+                    job["deadline"] = now + file_timeout
+            overdue = [p for p, j in jobs.items() if j["deadline"] is not None and now > j["deadline"]]
+            for pdf_path in sorted(overdue, key=lambda p: jobs[p]["deadline"]):
+                # A restart before this file gave it a new timeout: it may only have been queued
+                # behind the stuck tasks
+                if jobs[pdf_path]["deadline"] is not None:
+                    fail(pdf_path, f"timed out after {file_timeout:.0f}s")
+                    stop_overdue_strays(now)
+            stop_overdue_strays(now)
+            activate()
+    finally:
+        # Also stops tasks of failed files still running, instead of leaving them behind
+        _stop_pool(pool, pids)
+    return extracted, failures
@@ -0,0 +1,267 @@
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+import time
+
+# Pre-fork serving: the supervisor binds the listening socket once and forks worker processes
+# that all accept() on it. Workers are forked after the embedder is loaded, so the model weights
+# are shared copy-on-write; each worker memory-maps the index read-only when it starts.
+# The supervisor restarts workers that die, and reload() moves all workers to the index
+# generation currently on disk: new workers are forked and report ready (index loaded) before
+# the old ones are told to stop accepting and drain, so some worker is always accepting and
+# connections waiting in the listen backlog are never dropped.
+# The supervisor itself never starts a thread, so every fork happens from a single-threaded
+# process: no lock can be inherited in a held state and no torch/OpenMP work is cut in half.
+# Work that needs threads (the background indexer) runs in a companion process instead, which
+# the supervisor forks, restarts and signals like a worker. SIGHUP is forwarded to it, and it
+# asks for a reload by sending SIGUSR1 to the supervisor.
+READY_TIMEOUT = float(os.environ.get("RAG_PREFORK_READY_TIMEOUT", "120"))
+RESTART_BACKOFF_MAX = 30.0
+FAST_EXIT_SECONDS = 5.0  # a worker exiting sooner than this after its start counts as a crash loop
+
+log = logging.getLogger(__name__)
+
+
+class _Worker:
+    def __init__(self, pid, generation, ready_fd):
+        self.pid = pid
+        self.generation = generation
+        self.ready_fd = ready_fd
+        self.ready = False
+        self.started = time.monotonic()
+        self.stopping = False
+
+
+class PreforkSupervisor:
+    """
+    serve_worker(sock, ready, generation) runs in every worker process: load what the worker
+    needs, call ready(), then serve on sock until SIGTERM (raised as KeyboardInterrupt),
+    draining in-flight requests before returning.
+    companion(request_reload), if given, runs in its own process until SIGTERM (raised as
+    KeyboardInterrupt); SIGHUP to the supervisor is forwarded to it, and request_reload()
+    called in it swaps the workers to a new generation.
+    """
+
+    def __init__(self, server_address, serve_worker, processes, drain_timeout=30.0,
+                 ready_timeout=READY_TIMEOUT, on_hangup=None, companion=None):
+        self.server_address = server_address
+        self.serve_worker = serve_worker
+        self.processes = max(1, int(processes))
+        self.drain_timeout = drain_timeout
+        self.ready_timeout = ready_timeout
+        self.companion = companion
+        self.on_hangup = on_hangup or (self._forward_hangup if companion else self.request_reload)
+        self._companion_pid = None
+        self._companion_started = 0.0
+        self.generation = 0
+        self.restarts = 0
+        self.socket = None
+        self._workers = {}  # pid -> _Worker
+        self._reload = threading.Event()
+        self._stopping = False
+        self._crash_streak = 0
+
+    # --- control (any thread) ---
+    def request_reload(self):
+        """Swap all workers to the index generation now on disk (e.g. after an indexing run)."""
+        self._reload.set()
+
+    def stats(self):
+        workers = list(self._workers.values())
+        return {
+            "mode": "prefork",
+            "processes": self.processes,
+            "generation": self.generation,
+            "workers": sum(1 for w in workers if w.generation == self.generation and not w.stopping),
+            "draining": sum(1 for w in workers if w.stopping),
+            "restarts": self.restarts,
+        }
+
+    # --- supervisor loop (main thread) ---
+    def serve_forever(self, poll_interval=0.5):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(self.server_address)
+        self.socket.listen(128)
+        self.server_address = self.socket.getsockname()
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.on_hangup())
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.request_reload())
+        try:
+            if self.companion is not None:
+                self._spawn_companion()
+            self.generation = 1
+            started = [self._spawn() for _ in range(self.processes)]
+            if not self._wait_ready(started):
+                raise RuntimeError("No worker became ready")
+            log.info("Pre-fork server: %d worker processes on %s:%d", self.processes, *self.server_address[:2])
+            while not self._stopping:
+                self._reap()
+                if self._reload.is_set():
+                    self._reload.clear()
+                    self._swap_generation()
+                time.sleep(poll_interval)
+        finally:
+            self._stop_all()
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _forward_hangup(self):
+        if self._companion_pid is not None:
+            try:
+                os.kill(self._companion_pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    def _child_signals(self):
+        # The supervisor decides when a child stops; SIGTERM starts the child's shutdown
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+
+    def _spawn_companion(self):
+        supervisor_pid = os.getpid()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._child_signals()
+                self.socket.close()
+                self.companion(lambda: os.kill(supervisor_pid, signal.SIGUSR1))
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                log.exception("Companion process %d failed", os.getpid())
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        self._companion_pid = pid
+        self._companion_started = time.monotonic()
+
+    def _spawn(self):
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            code = 0
+            try:
+                self._child_signals()
+
+                def ready():
+                    os.write(ready_w, b"1")
+                    os.close(ready_w)
+
+                self.serve_worker(self.socket, ready, self.generation)
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                log.exception("Worker %d failed", os.getpid())
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        os.close(ready_w)
+        worker = _Worker(pid, self.generation, ready_r)
+        self._workers[pid] = worker
+        return worker
+
+    def _wait_ready(self, workers):
+        # Wait until each worker has reported ready or exited; True if at least one is ready
+        deadline = time.monotonic() + self.ready_timeout
+        pending = {w.ready_fd: w for w in workers}
+        while pending and time.monotonic() < deadline:
+            readable, _, _ = select.select(list(pending), [], [], max(0.0, deadline - time.monotonic()))
+            for fd in readable:
+                worker = pending.pop(fd)
+                worker.ready = os.read(fd, 1) == b"1"
+        for worker in workers:
+            os.close(worker.ready_fd)
+            worker.ready_fd = None
+        return any(w.ready for w in workers)
+
+    def _swap_generation(self):
+        old = [w for w in self._workers.values() if not w.stopping]
+        self.generation += 1
+        log.info("Starting worker generation %d", self.generation)
+        new = [self._spawn() for _ in range(self.processes)]
+        if not self._wait_ready(new):
+            # Keep serving the previous generation rather than dropping the service
+            log.error("Worker generation %d did not start; keeping generation %d", self.generation, self.generation - 1)
+            for worker in new:
+                self._signal(worker, signal.SIGKILL)
+                worker.stopping = True
+            self.generation -= 1
+            return
+        for worker in old:
+            worker.stopping = True
+            self._signal(worker, signal.SIGTERM)
+        log.info("Worker generation %d serving; %d old worker(s) draining", self.generation, len(old))
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid == self._companion_pid:
+                self._companion_pid = None
+                if not self._stopping:
+                    log.warning("Companion process %d exited (status %d); restarting", pid, status)
+                    if time.monotonic() - self._companion_started < FAST_EXIT_SECONDS:
+                        time.sleep(FAST_EXIT_SECONDS)
+                    self._spawn_companion()
+                continue
+            worker = self._workers.pop(pid, None)
+            if worker is None or worker.stopping or self._stopping or worker.generation != self.generation:
+                continue
+            # A current worker died: replace it, backing off while workers die right after starting
+            self.restarts += 1
+            if time.monotonic() - worker.started < FAST_EXIT_SECONDS:
+                self._crash_streak += 1
+            else:
+                self._crash_streak = 0
+            delay = min(RESTART_BACKOFF_MAX, 0.5 * (2 ** self._crash_streak)) if self._crash_streak else 0.0
+            log.warning("Worker %d exited (status %d); restarting%s", pid, status,
+                        f" in {delay:.1f}s" if delay else "")
+            if delay:
+                time.sleep(delay)
+            self._wait_ready([self._spawn()])
+
+    def _signal(self, worker, signum):
+        try:
+            os.kill(worker.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _stop_all(self):
+        self._stopping = True
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.stopping = True
+            self._signal(worker, signal.SIGTERM)
+        if self._companion_pid is not None:
+            os.kill(self._companion_pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.drain_timeout
+        while (self._workers or self._companion_pid is not None) and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for worker in list(self._workers.values()):
+            log.warning("Worker %d still busy after %ss drain timeout; killing it", worker.pid, self.drain_timeout)
+            self._signal(worker, signal.SIGKILL)
+        if self._companion_pid is not None:
+            os.kill(self._companion_pid, signal.SIGKILL)
+        if self.socket is not None:
+            self.socket.close()
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Layered caches for /search:
+#   query embeddings  - LRU, independent of the index
+#   retrieval results - LRU + TTL, keyed by normalized question and index version
+#   overviews         - LRU + TTL, keyed by (normalized question, retrieved chunk ids, prompt version)
+# The indexer calls bump_index_version() after it changes the collection; retrieval and
+# overview entries from older versions are dropped.
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("RAG_QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RAG_RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL = float(os.environ.get("RAG_RETRIEVAL_CACHE_TTL", "600"))
+OVERVIEW_CACHE_SIZE = int(os.environ.get("RAG_OVERVIEW_CACHE_SIZE", "1024"))
+OVERVIEW_CACHE_TTL = float(os.environ.get("RAG_OVERVIEW_CACHE_TTL", "86400"))
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and self.ttl is not None and entry[1] < time.monotonic():
+                del self._data[key]
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+query_embeddings = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+retrieval_results = LRUCache(RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL)
+overviews = LRUCache(OVERVIEW_CACHE_SIZE, ttl=OVERVIEW_CACHE_TTL)
+
+_index_version = 0
+_version_lock = threading.Lock()
+
+
+def normalize_question(question):
+    # MiniLM is uncased, so case and whitespace do not change the embedding
+    return " ".join(question.lower().split())
+
+
+def index_version():
+    return _index_version
+
+
+def bump_index_version():
+    global _index_version
+    with _version_lock:
+        _index_version += 1
+        retrieval_results.clear()
+        overviews.clear()
+        return _index_version
+
+
+def cache_stats():
+    return {
+        "index_version": _index_version,
+        "query_embeddings": query_embeddings.stats(),
+        "retrieval_results": retrieval_results.stats(),
+        "overviews": overviews.stats(),
+    }
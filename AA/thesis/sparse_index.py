@@ -0,0 +1,270 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+from array import array
+from collections import Counter
+
+import numpy as np
+
+# Compact BM25 index over ChromaDB chunks, used next to the vector search in /search.
+# Postings are kept in arrays instead of per-document dicts (as BM25Okapi does):
+#   base segment  - CSR arrays (offsets, doc numbers, term frequencies) loaded from disk
+#   delta segment - array('I')/array('H') per term for chunks added since the last save
+# Deleted chunks are tombstoned and dropped when the index is saved (which rewrites the CSR).
+# Each save writes a new generation of .npy files and then switches meta.json to it, so
+# readers with the previous generation memory-mapped are never pointed at a half-written file.
+SPARSE_INDEX_VERSION = 1
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+log = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the this to was were which with".split()
+)
+
+
+def tokenize(text):
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class SparseIndex:
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self.vocab = {}              # term -> term id
+        self.doc_ids = []            # doc number -> chunk id
+        self._doc_of = {}            # chunk id -> doc number (alive docs only)
+        self.doc_len = array('I')    # doc number -> token count
+        self.alive = bytearray()     # doc number -> 1 if not deleted
+        self._alive_count = 0
+        self._alive_len = 0
+        self._base_offsets = np.zeros(1, dtype=np.int64)
+        self._base_docs = np.zeros(0, dtype=np.uint32)
+        self._base_tfs = np.zeros(0, dtype=np.uint16)
+        self._delta = {}             # term id -> (array('I') docs, array('H') tfs)
+        self.generation = 0
+        self.dirty = False
+        self._view = None            # (alive, doc_len) arrays shared by searches until the next write
+
+    def __len__(self):
+        return self._alive_count
+
+    # --- maintenance ---
+    def upsert(self, chunk_ids, texts):
+        with self._lock:
+            for chunk_id, text in zip(chunk_ids, texts):
+                self._delete_one(chunk_id)
+                doc = len(self.doc_ids)
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    tid = self.vocab.setdefault(term, len(self.vocab))
+                    postings = self._delta.get(tid)
+                    if postings is None:
+                        postings = self._delta[tid] = (array('I'), array('H'))
+                    postings[0].append(doc)
+                    postings[1].append(min(tf, 65535))
+                length = sum(counts.values())
+                self.doc_ids.append(chunk_id)
+                self._doc_of[chunk_id] = doc
+                self.doc_len.append(length)
+                self.alive.append(1)
+                self._alive_count += 1
+                self._alive_len += length
+            self.dirty = True
+            self._view = None
+
+    def delete(self, chunk_ids):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                self._delete_one(chunk_id)
+            self.dirty = True
+            self._view = None
+
+    def _delete_one(self, chunk_id):
+        doc = self._doc_of.pop(chunk_id, None)
+        if doc is not None:
+            self.alive[doc] = 0
+            self._alive_count -= 1
+            self._alive_len -= self.doc_len[doc]
+
+    # --- query ---
+    def _arrays(self):
+        # Read-only alive mask and document lengths as of the last write, rebuilt on the first
+        # search after one instead of copied on every search. Call with self._lock held.
+        if self._view is None:
+            alive = np.frombuffer(bytes(self.alive), dtype=np.uint8).astype(bool)
+            doc_len = np.array(self.doc_len, dtype=np.float32)
+            alive.setflags(write=False)
+            doc_len.setflags(write=False)
+            self._view = (alive, doc_len)
+        return self._view
+
+    def _postings(self, tid):
+        docs = []
+        tfs = []
+        if tid + 1 < len(self._base_offsets):
+            start, end = self._base_offsets[tid], self._base_offsets[tid + 1]
+            docs.append(self._base_docs[start:end])
+            tfs.append(self._base_tfs[start:end])
+        delta = self._delta.get(tid)
+        if delta is not None:
+            docs.append(np.array(delta[0], dtype=np.uint32))
+            tfs.append(np.array(delta[1], dtype=np.uint16))
+        if not docs:
+            return None, None
+        if len(docs) == 1:
+            return docs[0], tfs[0]
+        return np.concatenate(docs), np.concatenate(tfs)
+
+    def search(self, query, k=50, allow=None):
+        """
+        Return [(chunk_id, bm25_score)] for the k best alive chunks.
+        allow(chunk_id) -> bool restricts the result to chunks it accepts (metadata filters).
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = self._alive_count
+            if not terms or n_docs == 0:
+                return []
+            avgdl = max(1.0, self._alive_len / n_docs)
+            alive, doc_len = self._arrays()
+            doc_ids = self.doc_ids
+            postings = [self._postings(tid) for tid in map(self.vocab.get, terms) if tid is not None]
+        # Scoring and allow() run without the lock: writes replace these arrays or append past
+        # their end (doc_ids), and _postings copies the delta postings
+        scores = np.zeros(len(alive), dtype=np.float32)
+        for docs, tfs in postings:
+            if docs is None:
+                continue
+            keep = alive[docs]
+            docs = docs[keep]
+            if docs.size == 0:
+                continue
+            tf = tfs[keep].astype(np.float32)
+            df = docs.size
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            denom = tf + BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len[docs] / avgdl)
+            scores[docs] += idf * tf * (BM25_K1 + 1.0) / denom
+        hits = np.flatnonzero(scores > 0)
+        if hits.size == 0:
+            return []
+        if allow is None:
+            if hits.size > k:
+                hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+            hits = hits[np.argsort(-scores[hits], kind="stable")]
+            return [(doc_ids[d], float(scores[d])) for d in hits]
+        # Filtered: walk the hits best-first until k are accepted
+        out = []
+        for d in hits[np.argsort(-scores[hits], kind="stable")]:
+            chunk_id = doc_ids[d]
+            if allow(chunk_id):
+                out.append((chunk_id, float(scores[d])))
+                if len(out) >= k:
+                    break
+        return out
+
+    # --- persistence ---
+    def _compacted(self):
+        # Merge base + delta into new CSR arrays, renumbering docs to drop tombstones
+        alive = np.frombuffer(bytes(self.alive), dtype=np.uint8).astype(bool)
+        remap = np.cumsum(alive, dtype=np.int64) - 1
+        n_terms = len(self.vocab)
+        base_counts = np.diff(self._base_offsets)
+        term_parts = [np.repeat(np.arange(len(base_counts), dtype=np.int64), base_counts)]
+        doc_parts = [self._base_docs.astype(np.int64)]
+        tf_parts = [self._base_tfs]
+        for tid, (docs, tfs) in self._delta.items():
+            term_parts.append(np.full(len(docs), tid, dtype=np.int64))
+            doc_parts.append(np.array(docs, dtype=np.int64))
+            tf_parts.append(np.array(tfs, dtype=np.uint16))
+        terms = np.concatenate(term_parts)
+        docs = np.concatenate(doc_parts)
+        tfs = np.concatenate(tf_parts)
+        keep = alive[docs] if docs.size else np.zeros(0, dtype=bool)
+        terms, docs, tfs = terms[keep], remap[docs[keep]], tfs[keep]
+        order = np.lexsort((docs, terms))
+        terms, docs, tfs = terms[order], docs[order], tfs[order]
+        offsets = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=n_terms), out=offsets[1:])
+        doc_ids = [d for d, a in zip(self.doc_ids, alive) if a]
+        doc_len = np.array(self.doc_len, dtype=np.uint32)[alive]
+        return offsets, docs.astype(np.uint32), tfs, doc_ids, doc_len
+
+    def save(self, path=None):
+        path = path or self.path
+        with self._lock:
+            offsets, docs, tfs, doc_ids, doc_len = self._compacted()
+            os.makedirs(path, exist_ok=True)
+            generation = self.generation + 1
+            terms = [None] * len(self.vocab)
+            for term, tid in self.vocab.items():
+                terms[tid] = term
+            for name, arr in (("offsets", offsets), ("docs", docs), ("tfs", tfs), ("doc_len", doc_len)):
+                np.save(os.path.join(path, f"{name}.{generation}.npy"), arr)
+            tmp_meta = os.path.join(path, "meta.json.tmp")
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                json.dump({"version": SPARSE_INDEX_VERSION, "generation": generation, "terms": terms, "doc_ids": doc_ids}, f)
+            os.replace(tmp_meta, os.path.join(path, "meta.json"))
+            for fname in os.listdir(path):
+                parts = fname.split(".")
+                if len(parts) == 3 and parts[2] == "npy" and parts[1] != str(generation):
+                    os.remove(os.path.join(path, fname))
+            self.generation = generation
+            self._install(offsets, docs, tfs, doc_ids, doc_len)
+            self.dirty = False
+
+    def _install(self, offsets, docs, tfs, doc_ids, doc_len):
+        self._base_offsets, self._base_docs, self._base_tfs = offsets, docs, tfs
+        self._delta = {}
+        self.doc_ids = list(doc_ids)
+        self._doc_of = {chunk_id: i for i, chunk_id in enumerate(self.doc_ids)}
+        self.doc_len = array('I', np.asarray(doc_len, dtype=np.uint32).tobytes())
+        self.alive = bytearray(b"\x01" * len(self.doc_ids))
+        self._alive_count = len(self.doc_ids)
+        self._alive_len = int(np.asarray(doc_len, dtype=np.int64).sum())
+        self._view = None
+
+    @classmethod
+    def load(cls, path):
+        # A save running in another process removes the previous generation's .npy files after
+        # switching meta.json: when they vanish between reading meta.json and opening them,
+        # meta.json already names the next generation, so it is read once more
+        for attempt in range(2):
+            try:
+                return cls._load_generation(path)
+            except OSError as e:
+                error = e
+                if attempt == 0:
+                    log.info("Sparse index in %s changed while loading (%s); retrying", path, e)
+            except (ValueError, KeyError) as e:
+                error = e
+                break
+        log.warning("Could not load sparse index from %s: %s. Starting empty.", path, error)
+        return cls(path)
+
+    @classmethod
+    def _load_generation(cls, path):
+        index = cls(path)
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            return index
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != SPARSE_INDEX_VERSION:
+            return index
+        generation = int(meta["generation"])
+        index.vocab = {term: tid for tid, term in enumerate(meta["terms"])}
+        index._install(
+            np.load(os.path.join(path, f"offsets.{generation}.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, f"docs.{generation}.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, f"tfs.{generation}.npy"), mmap_mode="r"),
+            meta["doc_ids"],
+            np.load(os.path.join(path, f"doc_len.{generation}.npy")),
+        )
+        index.generation = generation
+        return index
@@ -0,0 +1,53 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# Tests import the thesis modules directly, as the server and the tools do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+API_KEY = "test-key"
+
+
+@pytest.fixture
+def mock_gemini():
+    """
+    Start a mock Gemini server (see mock_gemini.py) for one test. Yields (handler_class, api_base);
+    set failure injection on handler_class, which is private to the test.
+    """
+    from mock_gemini import MockGeminiHandler, start_mock_gemini
+    handler_class = type("TestGeminiHandler", (MockGeminiHandler,), {"delay": 0.0, "fail_statuses": [], "calls": 0})
+    server = start_mock_gemini(handler_class=handler_class)
+    yield handler_class, f"http://127.0.0.1:{server.server_address[1]}/v1beta"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_client(mock_gemini, monkeypatch):
+    """
+    make_client(**settings) -> a GeminiClient on the mock: fast retries and a generous rate limit
+    unless settings say otherwise.
+    """
+    pytest.importorskip("requests")
+    import llm_client
+    monkeypatch.setattr(llm_client, "GEMINI_BACKOFF_BASE", 0.01)
+    _, api_base = mock_gemini
+
+    def make(**settings):
+        settings = {"timeout": (2, 5), "max_retries": 2, "rate_per_minute": 6000, "burst": 100, "rate_wait": 0.1,
+                    "breaker_failures": 3, "breaker_reset": 60, **settings}
+        return llm_client.GeminiClient(API_KEY, api_base=api_base, **settings)
+    return make
+
+
+@pytest.fixture
+def gemini_client(mock_gemini, make_client):
+    """(handler_class, client): a GeminiClient on the mock with the make_client defaults."""
+    return mock_gemini[0], make_client()
+
+
+def serve_in_thread(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
@@ -0,0 +1,38 @@
+import os
+import statistics
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from import_budget import cold_import  # noqa: E402
+
+pytest.importorskip("numpy")
+
+# Cold import of the server module in fresh interpreters (see benchmarks/import_budget.py):
+# it must stay within the budget, leave the heavy dependencies unimported and the stores unopened
+BUDGET_MS = float(os.environ.get("RAG_IMPORT_BUDGET_MS", "500"))
+REPEAT = 3
+
+
+@pytest.fixture(scope="module")
+def reports(tmp_path_factory):
+    return [cold_import("multi_thesis_rag", str(tmp_path_factory.mktemp("import")))[0] for _ in range(REPEAT)]
+
+
+def test_import_time_within_budget(reports):
+    median_ms = statistics.median(report["seconds"] for report in reports) * 1000
+    assert median_ms <= BUDGET_MS, f"median cold import {median_ms:.0f} ms, budget {BUDGET_MS:.0f} ms"
+
+
+def test_no_heavy_modules_imported(reports):
+    for report in reports:
+        # chromadb, sentence_transformers and torch above all: they load on first use only
+        assert report["heavy"] == []
+
+
+def test_stores_left_unopened(reports):
+    for report in reports:
+        assert report["opened"] == []
+        assert report["lazy"] == ["collection", "sparse_index", "doc_store"]
+        assert report["created"] == []
@@ -0,0 +1,109 @@
+import time
+
+import pytest
+
+requests = pytest.importorskip("requests")
+from llm_client import LLMUnavailable  # noqa: E402
+from mock_gemini import DEFAULT_ANSWER  # noqa: E402
+
+
+def test_generate(gemini_client):
+    handler_class, client = gemini_client
+    assert client.generate("prompt") == DEFAULT_ANSWER
+    stats = client.stats()
+    assert (stats["calls"], stats["successes"], stats["retries"], stats["errors"]) == (1, 1, 0, {})
+
+
+def test_transient_errors_are_retried(gemini_client):
+    handler_class, client = gemini_client
+    handler_class.fail_statuses = [503, 429]
+    assert client.generate("prompt") == DEFAULT_ANSWER
+    assert handler_class.calls == 3
+    stats = client.stats()
+    assert stats["retries"] == 2
+    assert stats["errors"] == {"http_503": 1, "http_429": 1}
+    assert stats["breaker_state"] == "closed"
+
+
+def test_retries_used_up(gemini_client):
+    handler_class, client = gemini_client
+    handler_class.fail_statuses = [503, 503, 503]
+    with pytest.raises(LLMUnavailable, match="after 3 attempt"):
+        client.generate("prompt")
+    assert handler_class.calls == 3
+    assert client.breaker.failures == 1
+
+
+def test_client_errors_are_not_retried(gemini_client):
+    handler_class, client = gemini_client
+    handler_class.fail_statuses = [400]
+    with pytest.raises(requests.HTTPError):
+        client.generate("prompt")
+    assert handler_class.calls == 1
+    assert client.breaker.failures == 0
+
+
+def test_client_error_response_is_closed(gemini_client):
+    handler_class, client = gemini_client
+    handler_class.fail_statuses = [403]
+    with pytest.raises(requests.HTTPError) as error:
+        list(client.stream_generate("prompt"))
+    assert error.value.response.raw.closed
+
+
+def test_reply_without_text_is_a_bad_response(gemini_client):
+    handler_class, client = gemini_client
+    handler_class.blocked = True
+    with pytest.raises(LLMUnavailable, match="no answer text"):
+        client.generate("prompt")
+    stats = client.stats()
+    assert stats["errors"] == {"bad_response": 1}
+    assert stats["successes"] == 0
+    assert client.breaker.failures == 1
+
+
+def test_breaker_opens_and_fails_fast(mock_gemini, make_client):
+    handler_class, _ = mock_gemini
+    client = make_client(max_retries=0, breaker_failures=2)
+    handler_class.fail_statuses = [503, 503]
+    for _ in range(2):
+        with pytest.raises(LLMUnavailable):
+            client.generate("prompt")
+    assert client.stats()["breaker_state"] == "open"
+    with pytest.raises(LLMUnavailable, match="circuit breaker is open"):
+        client.generate("prompt")
+    assert handler_class.calls == 2  # the open breaker did not call Gemini
+    assert client.stats()["errors"]["circuit_open"] == 1
+
+
+def test_breaker_closes_after_a_successful_trial(mock_gemini, make_client):
+    handler_class, _ = mock_gemini
+    client = make_client(max_retries=0, breaker_failures=1, breaker_reset=0.2)
+    handler_class.fail_statuses = [503]
+    with pytest.raises(LLMUnavailable):
+        client.generate("prompt")
+    assert client.stats()["breaker_state"] == "open"
+    time.sleep(0.25)
+    assert client.generate("prompt") == DEFAULT_ANSWER
+    assert client.stats()["breaker_state"] == "closed"
+
+
+def test_rate_limit(mock_gemini, make_client):
+    handler_class, _ = mock_gemini
+    client = make_client(rate_per_minute=6, burst=1, rate_wait=0.05)
+    assert client.generate("prompt") == DEFAULT_ANSWER
+    with pytest.raises(LLMUnavailable, match="rate limit"):
+        client.generate("prompt")
+    assert handler_class.calls == 1
+    assert client.stats()["errors"] == {"rate_limited": 1}
+
+
+def test_retries_spend_rate_tokens(mock_gemini, make_client):
+    # Two tokens: the first attempt and one retry; the second retry finds the bucket empty
+    handler_class, _ = mock_gemini
+    client = make_client(rate_per_minute=6, burst=2, rate_wait=0.05)
+    handler_class.fail_statuses = [503, 503, 503]
+    with pytest.raises(LLMUnavailable, match="after 2 attempt"):
+        client.generate("prompt")
+    assert handler_class.calls == 2
+    assert client.stats()["errors"] == {"http_503": 2, "rate_limited": 1}
@@ -0,0 +1,140 @@
+import json
+
+import pytest
+
+from conftest import API_KEY, serve_in_thread
+
+requests = pytest.importorskip("requests")
+rag = pytest.importorskip("multi_thesis_rag")
+
+# Retrieval is replaced by three fixed sources: these tests cover the /search response and
+# its Gemini overview, streamed and not, against mock_gemini.py
+SOURCES = [
+    ("growth.txt", "Water Temperature and Tilapia Growth", "Water temperature drives the growth rate of tilapia."),
+    ("feeding.txt", "Feeding Schedules in Pond Culture", "Feeding twice a day improved growth in ponds."),
+    ("soil.txt", "Soil Amendments for Upland Rice", "Soil amendments raised rice yields in field trials."),
+]
+
+
+def fixed_retrieval(question, filters=None):
+    chunks = [{
+        "id": f"{file_name}_chunk_0",
+        "chunk": text,
+        "meta": {"file": file_name, "chunk_idx": 0, "title": title, "author": "A. Author", "publication_year": "2020"},
+        "score": 0.5,
+    } for file_name, title, text in SOURCES]
+    documents = [{"title": title, "file": file_name} for file_name, title, _ in SOURCES]
+    return documents, chunks, chunks
+
+
+@pytest.fixture
+def rag_server(gemini_client, monkeypatch, tmp_path):
+    """The RAG HTTP server with fixed retrieval and its Gemini client on the mock; yields (handler_class, url)."""
+    import llm_client
+    handler_class, client = gemini_client
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("GEMINI_API_KEY", API_KEY)
+    monkeypatch.setitem(llm_client._clients, API_KEY, client)
+    monkeypatch.setattr(rag, "retrieve_for_question", fixed_retrieval)
+    rag.overviews.clear()
+    server = rag.BoundedThreadPoolServer(("127.0.0.1", 0), rag.MultiThesisRAGHTTPRequestHandler, workers=2)
+    yield handler_class, serve_in_thread(server)
+    server.shutdown()
+    server.server_close()
+
+
+def read_events(response):
+    # [(event, data)] of a server-sent event stream
+    events = []
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            events.append((event, json.loads(line[len("data: "):])))
+    return events
+
+
+def test_search_overview(rag_server):
+    handler_class, url = rag_server
+    response = requests.post(url + "/search", json={"question": "What drives tilapia growth?"}, timeout=10)
+    assert response.status_code == 200
+    body = response.json()
+    assert [d["file"] for d in body["documents"]] == [f for f, _, _ in SOURCES]
+    # The mock's answer, its references renumbered by first appearance and moved to the paragraph ends
+    first_paragraph = body["overview"].split("\n\n")[0]
+    assert first_paragraph.startswith("The studies agree that water temperature drives growth rates")
+    assert first_paragraph.endswith("[1][2]")
+    assert handler_class.calls == 1
+
+
+def test_search_overview_is_cached(rag_server):
+    handler_class, url = rag_server
+    question = {"question": "What drives tilapia growth?"}
+    first = requests.post(url + "/search", json=question, timeout=10).json()
+    second = requests.post(url + "/search", json=question, timeout=10).json()
+    assert second["overview"] == first["overview"]
+    assert handler_class.calls == 1
+
+
+def test_search_stream(rag_server):
+    handler_class, url = rag_server
+    with requests.post(url + "/search", json={"question": "What drives tilapia growth?", "stream": True},
+                       stream=True, timeout=10) as response:
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("text/event-stream")
+        events = read_events(response)
+    kinds = [kind for kind, _ in events]
+    assert kinds[0] == "documents" and kinds[-1] == "done"
+    assert "error" not in kinds
+    paragraphs = [data["text"] for kind, data in events if kind == "overview"]
+    done = events[-1][1]
+    assert len(paragraphs) > 1
+    assert done["overview"] == "\n\n".join(paragraphs)
+    # The mock cites [2], [3] and [1] in that order
+    assert done["references"] == ["feeding.txt", "soil.txt", "growth.txt"]
+
+
+def test_search_stream_matches_non_streaming(rag_server):
+    _, url = rag_server
+    streamed = {"question": "Which practices raise yields?", "stream": True}
+    with requests.post(url + "/search", json=streamed, stream=True, timeout=10) as response:
+        done = read_events(response)[-1][1]
+    plain = requests.post(url + "/search", json={"question": "Which practices raise yields?"}, timeout=10).json()
+    assert plain["overview"] == done["overview"]
+
+
+def test_search_stream_broken_after_first_paragraph(rag_server):
+    # The paragraphs already sent stay; the stream ends with an error event instead of "done"
+    handler_class, url = rag_server
+    handler_class.drop_after = 12  # the first paragraph is out, the second is not
+    with requests.post(url + "/search", json={"question": "What drives tilapia growth?", "stream": True},
+                       stream=True, timeout=10) as response:
+        events = read_events(response)
+    kinds = [kind for kind, _ in events]
+    assert kinds[0] == "documents"
+    assert kinds.count("overview") == 1
+    assert kinds[-1] == "error"
+    assert "done" not in kinds
+    assert "Gemini stream failed" in events[-1][1]["error"]
+    assert rag.overviews.get(rag._overview_key("What drives tilapia growth?", fixed_retrieval("")[2])) is None
+
+
+def test_search_stream_broken_before_first_paragraph(rag_server):
+    # Nothing was sent yet: the extractive overview is streamed instead
+    handler_class, url = rag_server
+    handler_class.drop_after = 2
+    with requests.post(url + "/search", json={"question": "What drives tilapia growth?", "stream": True},
+                       stream=True, timeout=10) as response:
+        events = read_events(response)
+    kinds = [kind for kind, _ in events]
+    assert kinds == ["documents", "overview", "done"]
+    assert "Water temperature drives the growth rate of tilapia." in events[-1][1]["overview"]
+
+
+def test_search_gemini_unavailable_falls_back_to_extractive(rag_server):
+    handler_class, url = rag_server
+    handler_class.fail_statuses = [503, 503, 503]
+    body = requests.post(url + "/search", json={"question": "What drives tilapia growth?"}, timeout=10).json()
+    assert handler_class.calls == 3
+    assert "Water temperature drives the growth rate of tilapia." in body["overview"]
@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+from vector_store import LocalVectorStore, open_vector_store
+
+# Both backends behind the same interface: the indexer and /search must not be able to tell
+# them apart. Local-only behaviour (generations, quantized scans) is tested on its own below.
+DIM = 8
+
+
+def make_chunks(n, seed=0, prefix="doc"):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, DIM)).astype(np.float32)
+    ids = [f"{prefix}{i % 10}.txt_chunk_{i}" for i in range(n)]
+    documents = [f"text of chunk {i}" for i in range(n)]
+    # File-level fields are the same for all chunks of a file, as the indexer writes them
+    metadatas = [{"file": f"{prefix}{i % 10}.txt", "chunk_idx": i, "year": 2010 + i % 10,
+                  "university": "UPLB" if i % 2 else "CLSU"} for i in range(n)]
+    return ids, vectors, documents, metadatas
+
+
+def exact_top(vectors, ids, q, k, keep=None):
+    # [(id, squared L2)] of the k nearest rows, optionally among keep(row) only
+    distances = ((vectors - q) ** 2).sum(axis=1)
+    rows = [r for r in np.argsort(distances, kind="stable") if keep is None or keep(r)][:k]
+    return [ids[r] for r in rows], distances[rows]
+
+
+@pytest.fixture(params=["local", "chroma"])
+def open_store(request, tmp_path):
+    """open_store() -> the store at tmp_path for the backend under test (a second call reopens it)."""
+    if request.param == "chroma":
+        pytest.importorskip("chromadb")
+    return lambda: open_vector_store(request.param, chroma_path=str(tmp_path / "chroma"),
+                                     local_path=str(tmp_path / "local"), collection_name="test_chunks")
+
+
+def test_upsert_get_delete(open_store):
+    store = open_store()
+    ids, vectors, documents, metadatas = make_chunks(30)
+    store.upsert(ids=ids, embeddings=vectors, documents=documents, metadatas=metadatas)
+    store.save()
+    assert store.count() == 30
+
+    got = store.get(ids=ids[:3], include=["documents", "metadatas", "embeddings"])
+    rows = dict(zip(got["ids"], zip(got["documents"], got["metadatas"], got["embeddings"])))
+    for i in range(3):
+        document, meta, embedding = rows[ids[i]]
+        assert document == documents[i]
+        assert meta == metadatas[i]
+        np.testing.assert_allclose(embedding, vectors[i], rtol=1e-6)
+
+    # Upserting an existing id replaces it
+    store.upsert(ids=[ids[0]], embeddings=vectors[1:2], documents=["replaced"], metadatas=[metadatas[0]])
+    store.delete(ids=ids[1:3])
+    store.save()
+    assert store.count() == 28
+    got = store.get(ids=ids[:3], include=["documents"])
+    assert got["ids"] == [ids[0]] and got["documents"] == ["replaced"]
+
+
+def test_query_matches_exact_search(open_store):
+    store = open_store()
+    ids, vectors, documents, metadatas = make_chunks(200)
+    store.upsert(ids=ids, embeddings=vectors, documents=documents, metadatas=metadatas)
+    store.save()
+    queries = np.random.default_rng(1).standard_normal((3, DIM)).astype(np.float32)
+    result = store.query(query_embeddings=queries, n_results=5, include=["documents", "metadatas", "distances"])
+    for i, q in enumerate(queries):
+        expected_ids, expected_distances = exact_top(vectors, ids, q, 5)
+        assert result["ids"][i] == expected_ids
+        np.testing.assert_allclose(result["distances"][i], expected_distances, rtol=1e-4)
+        assert result["documents"][i] == [documents[ids.index(c)] for c in expected_ids]
+
+
+def test_where_filters(open_store):
+    store = open_store()
+    ids, vectors, documents, metadatas = make_chunks(100)
+    store.upsert(ids=ids, embeddings=vectors, documents=documents, metadatas=metadatas)
+    store.save()
+    where = {"$and": [{"year": {"$gte": 2015}}, {"university": "UPLB"}]}
+
+    def keep(r):
+        return metadatas[r]["year"] >= 2015 and metadatas[r]["university"] == "UPLB"
+
+    got = store.get(where=where, include=["metadatas"])
+    assert sorted(got["ids"]) == sorted(ids[r] for r in range(100) if keep(r))
+    q = np.random.default_rng(2).standard_normal(DIM).astype(np.float32)
+    result = store.query(query_embeddings=[q], n_results=5, where=where, include=["metadatas", "distances"])
+    assert result["ids"][0] == exact_top(vectors, ids, q, 5, keep)[0]
+    assert all(meta["university"] == "UPLB" for meta in result["metadatas"][0])
+
+
+def test_saved_store_reopens(open_store):
+    store = open_store()
+    ids, vectors, documents, metadatas = make_chunks(20)
+    store.upsert(ids=ids, embeddings=vectors, documents=documents, metadatas=metadatas)
+    store.delete(ids=ids[:5])
+    store.save()
+    reopened = open_store()
+    assert reopened.count() == 15
+    assert sorted(reopened.get(include=[])["ids"]) == sorted(ids[5:])
+
+
+# --- local store only ---
+
+def test_generation_switch_over(tmp_path):
+    # A reader on the previous generation keeps its vectors and texts while the writer publishes
+    path = str(tmp_path / "local")
+    ids, vectors, documents, metadatas = make_chunks(20)
+    writer = LocalVectorStore(path)
+    writer.upsert(ids, vectors, documents, metadatas)
+    writer.save()
+    reader = LocalVectorStore.load(path)
+
+    writer.upsert(ids[:1], vectors[1:2], ["rewritten"], metadatas[:1])
+    writer.delete(ids[1:2])
+    writer.save()
+    assert writer.generation == reader.generation + 1
+    got = reader.get(ids=ids[:2], include=["documents", "embeddings"])
+    assert got["documents"] == documents[:2]
+    np.testing.assert_allclose(got["embeddings"], vectors[:2])
+    result = reader.query(vectors[1:2], n_results=1, include=["documents"])
+    assert result["ids"] == [[ids[1]]] and result["documents"] == [[documents[1]]]
+
+    fresh = LocalVectorStore.load(path)
+    assert fresh.generation == writer.generation
+    assert fresh.get(ids=ids[:2], include=["documents"]) == {"ids": [ids[0]], "documents": ["rewritten"]}
+
+
+@pytest.mark.parametrize("quantization", ["float16", "int8"])
+@pytest.mark.parametrize("min_rows", [10 ** 6, 100], ids=["exact", "ivf"])
+def test_quantized_scan_rescored_to_float32(tmp_path, quantization, min_rows):
+    ids, vectors, documents, metadatas = make_chunks(2000)
+    plain = LocalVectorStore(str(tmp_path / "plain"), min_rows=min_rows, nprobe=8)
+    quantized = LocalVectorStore(str(tmp_path / quantization), min_rows=min_rows, nprobe=8,
+                                 quantization=quantization)
+    for store in (plain, quantized):
+        store.upsert(ids, vectors, documents, metadatas)
+        store.save()
+    assert str(quantized.stats()["quantization"]) == quantization
+    queries = np.random.default_rng(3).standard_normal((10, DIM)).astype(np.float32)
+    expected = plain.query(queries, n_results=10, include=["distances"])
+    result = quantized.query(queries, n_results=10, include=["distances"])
+    assert result["ids"] == expected["ids"]
+    # Distances come from the float32 rows, not the quantized codes
+    np.testing.assert_allclose(result["distances"], expected["distances"], rtol=1e-5)
@@ -0,0 +1,723 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from array import array
+
+import numpy as np
+
+from lazy_handle import LazyHandle
+
+# Vector stores behind the RAG code. Both backends expose the subset of the ChromaDB collection
+# API the indexer and /search use: add / upsert / update / delete / get / query / count, with
+# ChromaDB's result layout and squared-L2 distances, plus save() and dirty for the indexer.
+#   chroma - the ChromaDB collection (persists every call itself)
+#   local  - LocalVectorStore: an in-process IVF index over a memory-mapped float32 matrix
+# Pick one with RAG_VECTOR_BACKEND; the local index is tuned with RAG_ANN_NLIST / RAG_ANN_NPROBE.
+# RAG_VECTOR_QUANTIZATION=float16|int8 makes the local store scan a quantized copy of the saved
+# vectors (2x / 4x smaller than float32) and re-score the best candidates with the float32 rows,
+# which stay on disk and are only paged in for those candidates. All files are memory-mapped
+# read-only, so processes serving the same store share their pages.
+LOCAL_STORE_VERSION = 1
+VECTOR_BACKEND = os.environ.get("RAG_VECTOR_BACKEND", "chroma")
+ANN_NLIST = int(os.environ.get("RAG_ANN_NLIST", "0"))          # IVF lists; 0 = sqrt(rows)
+ANN_NPROBE = int(os.environ.get("RAG_ANN_NPROBE", "16"))       # lists scanned per query (recall vs latency)
+ANN_MIN_ROWS = int(os.environ.get("RAG_ANN_MIN_ROWS", "20000"))  # below this every query is exact
+VECTOR_QUANTIZATION = os.environ.get("RAG_VECTOR_QUANTIZATION", "none")  # none, float16 or int8
+RESCORE_FACTOR = int(os.environ.get("RAG_VECTOR_RESCORE_FACTOR", "4"))  # candidates re-scored per result
+# Saves a replaced or deleted chunk row is kept for, for processes still serving an older generation
+KEEP_ROW_GENERATIONS = int(os.environ.get("RAG_KEEP_ROW_GENERATIONS", "4"))
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+# Per-chunk metadata keys; everything else in a chunk's metadata is the same for all chunks of a file
+CHUNK_POSITION_KEYS = ("chunk_idx", "char_start", "char_end")
+
+log = logging.getLogger(__name__)
+
+
+def where_matches(where, meta):
+    """Evaluate a ChromaDB-style where clause ($and/$or, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin/$contains)."""
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(where_matches(c, meta) for c in cond):
+                return False
+        elif key == "$or":
+            if not any(where_matches(c, meta) for c in cond):
+                return False
+        elif not _field_matches(meta.get(key), cond):
+            return False
+    return True
+
+
+def _field_matches(value, cond):
+    if not isinstance(cond, dict):
+        return value == cond
+    for op, arg in cond.items():
+        if value is None and op != "$ne" and op != "$nin":
+            return False
+        if op == "$eq":
+            ok = value == arg
+        elif op == "$ne":
+            ok = value != arg
+        elif op == "$gt":
+            ok = value > arg
+        elif op == "$gte":
+            ok = value >= arg
+        elif op == "$lt":
+            ok = value < arg
+        elif op == "$lte":
+            ok = value <= arg
+        elif op == "$in":
+            ok = value in arg
+        elif op == "$nin":
+            ok = value not in arg
+        elif op == "$contains":
+            ok = isinstance(value, list) and arg in value
+        else:
+            raise ValueError(f"Unsupported where operator: {op}")
+        if not ok:
+            return False
+    return True
+
+
+def _where_keys(where):
+    for key, cond in where.items():
+        if key in ("$and", "$or"):
+            for c in cond:
+                yield from _where_keys(c)
+        else:
+            yield key
+
+
+def quantize(vectors, kind):
+    """
+    Scalar quantization of float32 rows. Returns (codes, scales, sq_norms): int8 codes with one
+    scale per row (symmetric, max |x| -> 127) or float16 codes with scales None, and the squared
+    norm of each dequantized row for the distance expansion |x|^2 - 2 x.q + |q|^2.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if kind == "float16":
+        codes = vectors.astype(np.float16)
+        decoded = codes.astype(np.float32)
+        return codes, None, np.einsum("ij,ij->i", decoded, decoded)
+    if kind == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0 if len(vectors) else np.zeros(0, dtype=np.float32)
+        scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        decoded = codes.astype(np.float32) * scales[:, None]
+        return codes, scales, np.einsum("ij,ij->i", decoded, decoded)
+    raise ValueError(f"Unknown vector quantization: {kind!r} (expected 'none', 'float16' or 'int8')")
+
+
+def _take(arr, rows):
+    # arr[rows], as a slice (no copy, no page-ins beyond the range) when rows are consecutive
+    if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+        return arr[rows[0]:rows[-1] + 1]
+    return arr[rows]
+
+
+def kmeans(vectors, k, iterations=KMEANS_ITERATIONS, seed=0):
+    """Plain Lloyd's k-means; returns (k, dim) float32 centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = nearest_centroid(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty lists from random vectors
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+    return centroids
+
+
+def nearest_centroid(vectors, centroids, block=16384):
+    out = np.empty(len(vectors), dtype=np.int32)
+    c_sq = (centroids * centroids).sum(axis=1)
+    for start in range(0, len(vectors), block):
+        part = np.asarray(vectors[start:start + block], dtype=np.float32)
+        out[start:start + len(part)] = np.argmin(c_sq[None, :] - 2.0 * part @ centroids.T, axis=1)
+    return out
+
+
+class ChromaVectorStore:
+    """The ChromaDB collection behind the vector-store interface."""
+    backend = "chroma"
+    dirty = False
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    @property
+    def cache_key(self):
+        # Identifies the store in caches of query results
+        return (self.backend, str(self.collection.id))
+
+    def save(self):
+        pass
+
+    def stats(self):
+        return {"backend": self.backend, "chunks": self.collection.count()}
+
+
+class LocalVectorStore:
+    """
+    In-process vector index. Layout mirrors SparseIndex:
+      base segment  - memory-mapped float32 matrix of the last save, with IVF lists in CSR form
+      delta rows    - vectors added since the last save, always scanned exactly
+    Deleted and replaced rows are tombstoned and dropped when the store is saved; each save
+    writes a new generation of .npy files and then switches meta.json to it.
+    Chunk texts and metadata live in a SQLite table next to the index, one row per chunk and
+    generation range: writes go to the generation the next save publishes and a replaced or
+    deleted row only ends there, so processes still serving an older generation (pre-fork
+    workers, while the indexer writes) keep reading the texts that match their vectors. Where
+    clauses are evaluated on file-level metadata (everything but chunk_idx / char_start / char_end).
+    """
+    backend = "local"
+
+    def __init__(self, path, nlist=ANN_NLIST, nprobe=ANN_NPROBE, min_rows=ANN_MIN_ROWS,
+                 quantization=VECTOR_QUANTIZATION, rescore_factor=RESCORE_FACTOR):
+        if quantization != "none":
+            quantize(np.zeros((0, 1), dtype=np.float32), quantization)  # validate the setting
+        self.path = path
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_rows = min_rows
+        self.quantization = quantization      # applied when the store is saved
+        self.rescore_factor = rescore_factor
+        self._lock = threading.RLock()
+        self.dim = None
+        self.ids = []                 # row -> chunk id
+        self._row_of = {}             # chunk id -> row (alive rows only)
+        self.alive = bytearray()      # row -> 1 if not deleted
+        self._alive_count = 0
+        self._base = np.zeros((0, 0), dtype=np.float32)
+        self._codes = None             # quantized base rows (None: the float32 rows are scanned)
+        self._scales = None
+        self._sq_norms = None
+        self._extra = np.zeros((0, 0), dtype=np.float32)  # delta rows, grown by doubling
+        self._n_extra = 0
+        self._file_codes = array('I')  # row -> file code
+        self.files = []                # file code -> file name
+        self._file_code = {}
+        self.file_meta = {}            # file name -> file-level metadata
+        self.centroids = None
+        self._trained_rows = 0
+        self._lists = array('i')       # row -> IVF list, -1 for delta rows
+        self._list_offsets = np.zeros(1, dtype=np.int64)
+        self._list_rows = np.zeros(0, dtype=np.int64)
+        self.dirty = False             # also: SQLite rows of generation + 1 were written
+        self._view = None              # row state shared by reads until the next write (_published)
+        os.makedirs(path, exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, "chunks.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # A row is part of generations gen_from <= g < gen_to (gen_to NULL: still current)
+        self._db.execute("CREATE TABLE IF NOT EXISTS chunk_rows (id TEXT, document TEXT, meta TEXT,"
+                         " gen_from INTEGER NOT NULL, gen_to INTEGER, PRIMARY KEY (id, gen_from))")
+        if self._db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks'").fetchone():
+            self._db.execute("INSERT OR IGNORE INTO chunk_rows SELECT id, document, meta, 0, NULL FROM chunks")
+            self._db.execute("DROP TABLE chunks")
+        self._db.commit()
+        # Never reuse a generation number the table has seen (load() sets the published one)
+        self.generation = self._db.execute(
+            "SELECT MAX(COALESCE(MAX(gen_from), 0), COALESCE(MAX(gen_to), 0)) FROM chunk_rows").fetchone()[0]
+
+    @property
+    def cache_key(self):
+        # Identifies the store in caches of query results
+        return (self.backend, os.path.abspath(self.path))
+
+    def count(self):
+        return self._alive_count
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "chunks": self._alive_count,
+                "rows": len(self.ids),
+                "unsaved_rows": self._n_extra,
+                "ivf_lists": 0 if self.centroids is None else len(self.centroids),
+                "quantization": "none" if self._codes is None else str(self._codes.dtype),
+                "nprobe": self.nprobe,
+                "generation": self.generation,
+            }
+
+    # --- maintenance ---
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        self.upsert(ids, embeddings, documents, metadatas)
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError("embeddings must be one vector per id")
+        documents = documents if documents is not None else [None] * len(ids)
+        metadatas = metadatas if metadatas is not None else [None] * len(ids)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store's {self.dim}")
+            self._reserve(len(ids))
+            for chunk_id, vector, meta in zip(ids, vectors, metadatas):
+                self._delete_one(chunk_id)
+                row = len(self.ids)
+                self._extra[self._n_extra] = vector
+                self._n_extra += 1
+                self.ids.append(chunk_id)
+                self._row_of[chunk_id] = row
+                self.alive.append(1)
+                self._alive_count += 1
+                self._file_codes.append(self._code_for(meta or {}))
+                self._lists.append(-1)
+            pending = self._begin_write()
+        self._write_rows(pending, [(chunk_id, doc, json.dumps(meta or {}))
+                                   for chunk_id, doc, meta in zip(ids, documents, metadatas)])
+
+    def update(self, ids, metadatas=None, documents=None):
+        # Metadata is merged as in ChromaDB; a None value removes the key
+        with self._lock:
+            ids = [chunk_id for chunk_id in ids if chunk_id in self._row_of]
+        current = self._fetch(ids)
+        rows = []
+        for i, chunk_id in enumerate(ids):
+            document, meta = current.get(chunk_id, (None, {}))
+            if metadatas is not None:
+                meta = {k: v for k, v in {**meta, **metadatas[i]}.items() if v is not None}
+            if documents is not None:
+                document = documents[i]
+            rows.append((chunk_id, document, meta))
+        with self._lock:
+            for chunk_id, _, meta in rows:
+                row = self._row_of.get(chunk_id)
+                if row is not None:
+                    self._file_codes[row] = self._code_for(meta)
+            pending = self._begin_write()
+        self._write_rows(pending, [(chunk_id, document, json.dumps(meta)) for chunk_id, document, meta in rows])
+
+    def delete(self, ids=None, where=None):
+        with self._lock:
+            if ids is None:
+                ids = self.get(where=where, include=[])["ids"] if where else []
+            deleted = [(chunk_id,) for chunk_id in ids if self._delete_one(chunk_id)]
+            pending = self._begin_write()
+        self._db_write(
+            ("UPDATE chunk_rows SET gen_to = ? WHERE id = ? AND gen_to IS NULL AND gen_from < ?",
+             [(pending, chunk_id, pending) for chunk_id, in deleted]),
+            ("DELETE FROM chunk_rows WHERE id = ? AND gen_from = ?", [(chunk_id, pending) for chunk_id, in deleted]),
+        )
+
+    def _delete_one(self, chunk_id):
+        row = self._row_of.pop(chunk_id, None)
+        if row is None:
+            return False
+        self.alive[row] = 0
+        self._alive_count -= 1
+        return True
+
+    def _reserve(self, n):
+        if self._extra.shape[1:] != (self.dim,):
+            self._extra = np.zeros((max(1024, n), self.dim), dtype=np.float32)
+        if self._n_extra + n > len(self._extra):
+            grown = np.zeros((max(2 * len(self._extra), self._n_extra + n), self.dim), dtype=np.float32)
+            grown[:self._n_extra] = self._extra[:self._n_extra]
+            self._extra = grown
+
+    def _code_for(self, meta):
+        file_name = meta.get("file") or meta.get("pdf") or ""
+        code = self._file_code.get(file_name)
+        if code is None:
+            code = self._file_code[file_name] = len(self.files)
+            self.files.append(file_name)
+        self.file_meta[file_name] = {k: v for k, v in meta.items() if k not in CHUNK_POSITION_KEYS}
+        return code
+
+    def _begin_write(self):
+        # Generation the SQLite writes go to (the next save's). On the first write after a save,
+        # rows left behind by a writer that died before publishing its generation are undone.
+        # Call with self._lock held.
+        if not self.dirty:
+            self._db_write(("DELETE FROM chunk_rows WHERE gen_from > ?", [(self.generation,)]),
+                           ("UPDATE chunk_rows SET gen_to = NULL WHERE gen_to > ?", [(self.generation,)]))
+            self.dirty = True
+        self._view = None
+        return self.generation + 1
+
+    def _read_generation(self):
+        # Rows matching this process's vectors: its own unsaved writes included
+        return self.generation + 1 if self.dirty else self.generation
+
+    def _write_rows(self, pending, rows):
+        # rows: [(chunk id, document, metadata json)], current as of generation `pending`
+        self._db_write(
+            ("UPDATE chunk_rows SET gen_to = ? WHERE id = ? AND gen_to IS NULL AND gen_from < ?",
+             [(pending, row[0], pending) for row in rows]),
+            ("INSERT OR REPLACE INTO chunk_rows (id, document, meta, gen_from, gen_to) VALUES (?, ?, ?, ?, NULL)",
+             [(*row, pending) for row in rows]),
+        )
+
+    def _db_write(self, *statements):
+        # (sql, rows) pairs, committed together
+        if not any(rows for _, rows in statements):
+            return
+        with self._db_lock:
+            for sql, rows in statements:
+                self._db.executemany(sql, rows)
+            self._db.commit()
+
+    def _fetch(self, ids, generation=None):
+        # {chunk id: (document, metadata)} as of a generation (default: the one this process serves)
+        out = {}
+        ids = list(ids)
+        if generation is None:
+            generation = self._read_generation()
+        with self._db_lock:
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT id, document, meta FROM chunk_rows WHERE id IN ({','.join('?' * len(part))})"
+                    " AND gen_from <= ? AND (gen_to IS NULL OR gen_to > ?)", [*part, generation, generation]
+                ).fetchall()
+                out.update((chunk_id, (document, json.loads(meta))) for chunk_id, document, meta in rows)
+        return out
+
+    # --- query ---
+    def _vectors(self, rows, base, extra):
+        rows = np.asarray(rows, dtype=np.int64)
+        n_base = len(base)
+        if rows.size and rows.max() < n_base:
+            return np.asarray(base[rows], dtype=np.float32)
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        in_base = rows < n_base
+        if in_base.any():
+            out[in_base] = base[rows[in_base]]
+        if not in_base.all():
+            out[~in_base] = extra[rows[~in_base] - n_base]
+        return out
+
+    def _distances(self, rows, q, base, extra, block=65536):
+        # Squared L2 from q to the given rows, a block at a time to bound the temporary memory
+        out = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), block):
+            diff = self._vectors(rows[start:start + block], base, extra) - q
+            out[start:start + len(diff)] = np.einsum("ij,ij->i", diff, diff)
+        return out
+
+    def _scan_distances(self, rows, queries, snap, block=32768):
+        """
+        Distances of rows to each query, shape (len(rows), len(queries)), as |x|^2 - 2 x.q + |q|^2
+        so a block of rows meets all queries in one matrix product. Saved rows are read from the
+        quantized codes when the store is quantized (approximate; see the re-scoring in query).
+        """
+        scan, scales, sq_norms, base, extra = snap["scan"], snap["scales"], snap["sq_norms"], snap["base"], snap["extra"]
+        q_sq = np.einsum("ij,ij->i", queries, queries)
+        out = np.empty((len(rows), len(queries)), dtype=np.float32)
+        in_base = rows < len(base)
+        positions = np.flatnonzero(in_base)
+        saved = rows[in_base]
+        for start in range(0, len(saved), block):
+            part = saved[start:start + block]
+            vectors = np.asarray(_take(scan, part), dtype=np.float32)
+            dots = vectors @ queries.T
+            if scales is not None:
+                dots *= _take(scales, part)[:, None]
+            norms = _take(sq_norms, part) if sq_norms is not None else np.einsum("ij,ij->i", vectors, vectors)
+            out[positions[start:start + block]] = norms[:, None] - 2.0 * dots + q_sq[None, :]
+        if len(saved) < len(rows):
+            vectors = extra[rows[~in_base] - len(base)]
+            out[~in_base] = (np.einsum("ij,ij->i", vectors, vectors)[:, None] - 2.0 * (vectors @ queries.T)
+                             + q_sq[None, :])
+        return np.maximum(out, 0.0, out=out)
+
+    def _allowed_files(self, where, file_meta):
+        # File codes whose file-level metadata matches; None when there is no filter
+        if not where:
+            return None
+        position_keys = set(_where_keys(where)) & set(CHUNK_POSITION_KEYS)
+        if position_keys:
+            raise ValueError(f"Where clauses on {', '.join(sorted(position_keys))} are not supported by the local store")
+        return np.array([code for code, meta in file_meta if where_matches(where, meta)], dtype=np.int64)
+
+    def _published(self):
+        # Read-only row state as of the last write. A write drops it and the first read after
+        # rebuilds it, so reads between writes do not copy per-row state.
+        view = self._view
+        if view is None:
+            with self._lock:
+                view = self._view
+                if view is None:
+                    n_rows = len(self.ids)
+                    alive = np.frombuffer(bytes(self.alive), dtype=np.uint8).astype(bool)
+                    file_codes = np.frombuffer(self._file_codes, dtype=np.uint32)[:n_rows].copy()
+                    alive.setflags(write=False)
+                    file_codes.setflags(write=False)
+                    view = self._view = {
+                        "generation": self._read_generation(),
+                        # Only appended to until a save installs a new list; rows < n_rows are fixed
+                        "ids": self.ids,
+                        "alive": alive,
+                        "file_codes": file_codes,
+                        "file_meta": [(self._file_code[f], meta) for f, meta in self.file_meta.items()],
+                        "base": self._base,
+                        "codes": self._codes,
+                        "scan": self._codes if self._codes is not None else self._base,
+                        "scales": self._scales,
+                        "sq_norms": self._sq_norms,
+                        "extra": self._extra[:self._n_extra],
+                        "centroids": self.centroids,
+                        "list_offsets": self._list_offsets,
+                        "list_rows": self._list_rows,
+                    }
+        return view
+
+    def _snapshot(self, where=None):
+        view = self._published()
+        mask = view["alive"]
+        allowed = self._allowed_files(where, view["file_meta"])
+        if allowed is not None:
+            mask = mask & np.isin(view["file_codes"], allowed)
+        return {**view, "mask": mask, "nprobe": self.nprobe}
+
+    def query(self, query_embeddings, n_results=10, where=None, include=("metadatas", "documents", "distances")):
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim or np.shape(query_embeddings)[-1])
+        out_ids, out_distances = [], []
+        if self.dim is None:
+            return self._result([[] for _ in queries], [[] for _ in queries], include, None)
+        snap = self._snapshot(where)
+        mask, base, extra = snap["mask"], snap["base"], snap["extra"]
+        n_base = len(base)
+        delta_rows = np.arange(n_base, n_base + len(extra), dtype=np.int64)
+        exact_rows = np.flatnonzero(mask)
+        centroids = snap["centroids"]
+        if centroids is None or snap["nprobe"] >= len(centroids):
+            # Exact scan: every query sees the same rows, so queries share the matrix products
+            for start in range(0, len(queries), 64):
+                group = queries[start:start + 64]
+                distances = self._scan_distances(exact_rows, group, snap) if exact_rows.size else None
+                for j, q in enumerate(group):
+                    self._top(exact_rows, None if distances is None else distances[:, j], q, n_results, snap,
+                              out_ids, out_distances)
+            return self._result(out_ids, out_distances, include, snap["generation"])
+        offsets = snap["list_offsets"]
+        for q in queries:
+            # IVF: scan the nprobe lists whose centroids are nearest, plus the unsaved rows
+            probe = np.argpartition(((centroids - q) ** 2).sum(axis=1), snap["nprobe"] - 1)[:snap["nprobe"]]
+            parts = [snap["list_rows"][offsets[p]:offsets[p + 1]] for p in probe] + [delta_rows]
+            rows = np.concatenate(parts)
+            rows = np.sort(rows[mask[rows]])
+            # A selective filter can leave the probed lists short of results: fall back to exact
+            if len(rows) < n_results and len(exact_rows) > len(rows):
+                rows = exact_rows
+            distances = self._scan_distances(rows, q[None, :], snap)[:, 0] if rows.size else None
+            self._top(rows, distances, q, n_results, snap, out_ids, out_distances)
+        return self._result(out_ids, out_distances, include, snap["generation"])
+
+    def _top(self, rows, distances, q, n_results, snap, out_ids, out_distances):
+        if distances is None:
+            out_ids.append([])
+            out_distances.append([])
+            return
+        if snap["codes"] is not None:
+            # Re-score the best rescore_factor * n_results candidates with the float32 rows
+            keep = max(n_results, n_results * self.rescore_factor)
+            if len(rows) > keep:
+                rows = rows[np.argpartition(distances, keep - 1)[:keep]]
+            distances = self._distances(rows, q, snap["base"], snap["extra"])
+        if len(rows) > n_results:
+            top = np.argpartition(distances, n_results - 1)[:n_results]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(distances[top], kind="stable")]
+        out_ids.append([snap["ids"][r] for r in rows[top]])
+        out_distances.append([float(d) for d in distances[top]])
+
+    def _result(self, ids, distances, include, generation):
+        result = {"ids": ids}
+        if "distances" in include:
+            result["distances"] = distances
+        if "documents" in include or "metadatas" in include:
+            rows = self._fetch({chunk_id for group in ids for chunk_id in group}, generation)
+            if "documents" in include:
+                result["documents"] = [[rows.get(c, (None, {}))[0] for c in group] for group in ids]
+            if "metadatas" in include:
+                result["metadatas"] = [[rows.get(c, (None, {}))[1] for c in group] for group in ids]
+        return result
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("metadatas", "documents")):
+        snap = self._snapshot(where)
+        mask = snap["mask"]
+        if ids is not None:
+            with self._lock:
+                rows = [self._row_of[c] for c in ids if c in self._row_of]
+            rows = np.array([r for r in rows if r < len(mask) and mask[r]], dtype=np.int64)
+        else:
+            rows = np.flatnonzero(mask)
+        start = offset or 0
+        rows = rows[start:start + limit if limit is not None else None]
+        chunk_ids = [snap["ids"][r] for r in rows]
+        result = {"ids": chunk_ids}
+        if "embeddings" in include:
+            result["embeddings"] = self._vectors(rows, snap["base"], snap["extra"]) if len(rows) else np.zeros((0, self.dim or 0), dtype=np.float32)
+        if "documents" in include or "metadatas" in include:
+            fetched = self._fetch(chunk_ids, snap["generation"])
+            if "documents" in include:
+                result["documents"] = [fetched.get(c, (None, {}))[0] for c in chunk_ids]
+            if "metadatas" in include:
+                result["metadatas"] = [fetched.get(c, (None, {}))[1] for c in chunk_ids]
+        return result
+
+    # --- persistence ---
+    def _train_or_assign(self, vectors, lists):
+        # (Re)train the IVF centroids when the store has outgrown them, else assign new rows
+        n = len(vectors)
+        if n < self.min_rows:
+            return None, np.full(n, -1, dtype=np.int32)
+        if self.centroids is None or n > 2 * self._trained_rows:
+            k = self.nlist or max(1, int(np.sqrt(n)))
+            sample_size = min(n, k * KMEANS_SAMPLE_PER_LIST)
+            sample = np.asarray(vectors[np.sort(np.random.default_rng(0).choice(n, sample_size, replace=False))],
+                                dtype=np.float32)
+            log.info("Training %d IVF lists on %d of %d vectors...", k, sample_size, n)
+            centroids = kmeans(sample, min(k, sample_size))
+            self._trained_rows = n
+            return centroids, nearest_centroid(vectors, centroids)
+        todo = np.flatnonzero(lists < 0)
+        if todo.size:
+            lists[todo] = nearest_centroid(vectors[todo], self.centroids)
+        return self.centroids, lists
+
+    def save(self, path=None):
+        path = path or self.path
+        with self._lock:
+            keep = np.frombuffer(bytes(self.alive), dtype=np.uint8).astype(bool)
+            rows = np.flatnonzero(keep)
+            vectors = self._vectors(rows, self._base, self._extra[:self._n_extra]) if self.dim else np.zeros((0, 0), dtype=np.float32)
+            ids = [self.ids[r] for r in rows]
+            lists = np.frombuffer(self._lists, dtype=np.int32)[rows].copy()
+            file_codes = np.frombuffer(self._file_codes, dtype=np.uint32)[rows]
+            # Drop files without chunks and renumber the rest
+            used = sorted(set(file_codes.tolist()))
+            remap = np.zeros(len(self.files) + 1, dtype=np.uint32)
+            remap[used] = np.arange(len(used), dtype=np.uint32)
+            files = [self.files[c] for c in used]
+            file_codes = remap[file_codes] if len(file_codes) else file_codes
+            centroids, lists = self._train_or_assign(vectors, lists)
+            order = np.argsort(lists, kind="stable")
+            list_offsets = np.zeros((len(centroids) if centroids is not None else 0) + 1, dtype=np.int64)
+            if centroids is not None:
+                np.cumsum(np.bincount(lists, minlength=len(centroids)), out=list_offsets[1:])
+            generation = self.generation + 1
+            arrays = {"vectors": vectors, "lists": lists.astype(np.int32), "list_rows": order.astype(np.int64),
+                      "list_offsets": list_offsets, "file_codes": file_codes.astype(np.uint32)}
+            if centroids is not None:
+                arrays["centroids"] = centroids
+            if self.quantization != "none":
+                arrays["codes"], scales, arrays["sq_norms"] = quantize(vectors, self.quantization)
+                if scales is not None:
+                    arrays["scales"] = scales
+            else:
+                arrays["sq_norms"] = np.einsum("ij,ij->i", vectors, vectors) if len(vectors) else np.zeros(0, dtype=np.float32)
+            os.makedirs(path, exist_ok=True)
+            for name, arr in arrays.items():
+                np.save(os.path.join(path, f"{name}.{generation}.npy"), arr)
+            tmp_meta = os.path.join(path, "meta.json.tmp")
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                json.dump({
+                    "version": LOCAL_STORE_VERSION,
+                    "generation": generation,
+                    "dim": self.dim,
+                    "ids": ids,
+                    "files": files,
+                    "file_meta": {f: self.file_meta.get(f, {}) for f in files},
+                    "trained_rows": self._trained_rows,
+                    "quantization": self.quantization,
+                }, f)
+            os.replace(tmp_meta, os.path.join(path, "meta.json"))
+            for fname in os.listdir(path):
+                parts = fname.split(".")
+                if len(parts) == 3 and parts[2] == "npy" and parts[1] != str(generation):
+                    os.remove(os.path.join(path, fname))
+            self.generation = generation
+            self._install(path, generation, ids, files, {f: self.file_meta.get(f, {}) for f in files})
+            self.dirty = False
+            self._view = None
+        # Rows no generation still served (the last KEEP_ROW_GENERATIONS) can see
+        self._db_write(("DELETE FROM chunk_rows WHERE gen_to <= ?", [(generation - KEEP_ROW_GENERATIONS,)]))
+
+    def _install(self, path, generation, ids, files, file_meta):
+        def load(name):
+            return np.load(os.path.join(path, f"{name}.{generation}.npy"), mmap_mode="r")
+
+        self._base = load("vectors")
+        self.dim = self._base.shape[1] if self._base.ndim == 2 and self._base.shape[1] else self.dim
+        self._extra = np.zeros((0, 0), dtype=np.float32)
+        self._n_extra = 0
+        self.ids = list(ids)
+        self._row_of = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+        self.alive = bytearray(b"\x01" * len(self.ids))
+        self._alive_count = len(self.ids)
+        self.files = list(files)
+        self._file_code = {f: i for i, f in enumerate(self.files)}
+        self.file_meta = dict(file_meta)
+        self._file_codes = array('I', np.asarray(load("file_codes"), dtype=np.uint32).tobytes())
+        self._lists = array('i', np.asarray(load("lists"), dtype=np.int32).tobytes())
+        self._list_rows = np.asarray(load("list_rows"))
+        self._list_offsets = np.asarray(load("list_offsets"))
+        centroids_path = os.path.join(path, f"centroids.{generation}.npy")
+        self.centroids = np.load(centroids_path) if os.path.exists(centroids_path) else None
+        # Quantized rows as written by the save that made this generation (the setting may differ)
+        codes_path = os.path.join(path, f"codes.{generation}.npy")
+        self._codes = load("codes") if os.path.exists(codes_path) else None
+        norms_path = os.path.join(path, f"sq_norms.{generation}.npy")
+        self._sq_norms = load("sq_norms") if os.path.exists(norms_path) else None
+        scales_path = os.path.join(path, f"scales.{generation}.npy")
+        self._scales = load("scales") if self._codes is not None and os.path.exists(scales_path) else None
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        store = cls(path, **kwargs)
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            return store
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != LOCAL_STORE_VERSION:
+                return store
+            store.dim = meta["dim"]
+            store._trained_rows = meta.get("trained_rows", 0)
+            store._install(path, int(meta["generation"]), meta["ids"], meta["files"], meta["file_meta"])
+            store.generation = int(meta["generation"])
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("Could not load vector store from %s: %s. Starting empty.", path, e)
+            return cls(path, **kwargs)
+        return store
+
+
+class LazyVectorStore(LazyHandle):
+    """
+    Stand-in for the store that factory() returns, opened on first use instead of at import
+    (creating a ChromaDB client imports chromadb, about a second). Attribute access goes to
+    the opened store; open() opens it explicitly. set_factory() swaps in another store
+    (tests, tools) and drops the one opened so far.
+    """
+
+
+def open_vector_store(backend=VECTOR_BACKEND, chroma_path=os.path.join("RAG", "chromadb_data"),
+                      local_path=os.path.join("RAG", "vector_store"), collection_name="thesis_chunks"):
+    if backend == "local":
+        return LocalVectorStore.load(local_path)
+    if backend != "chroma":
+        raise ValueError(f"Unknown vector backend: {backend!r} (expected 'chroma' or 'local')")
+    import chromadb
+    # Use PersistentClient API for ChromaDB >=1.1.0
+    client = chromadb.PersistentClient(path=chroma_path)
+    return ChromaVectorStore(client.get_or_create_collection(collection_name))